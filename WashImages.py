@@ -1,13 +1,13 @@
 import cv2
 import os
-from utils.retinaface import RetinaFace
+from utils.face_daemon import connect, load_models
 
 os.environ['MXNET_CUDNN_AUTOTUNE_DEFAULT']='0'
 
 thresh = 0.8
 
 gpuid = 0
-detector = RetinaFace('./model/mnet.25/mnet.25', 0, gpuid)
+detector, _ = load_models('./model/mnet.25/mnet.25', None, gpuid, connect())
 
 img_dir = './DATA/Images/'
 
@@ -0,0 +1,81 @@
+"""
+Recall-vs-latency report of the approximate gallery indexes against exact search.
+
+The synthetic gallery is clustered like real face embeddings: every identity
+is a random direction and each of its faces a noisy copy of it. Queries are
+fresh noisy copies of gallery identities.
+
+Run from the repository root:
+    python -m benchmarks.bench_ann --rows 200000 --nlist 1024 --pq-m 64
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.gallery import ExactIndex
+from utils.ivf_index import IVFIndex
+
+
+def normalize(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def synthetic_faces(rows, dim, faces_per_identity, noise, rng):
+    identities = normalize(rng.standard_normal((rows // faces_per_identity + 1, dim)).astype(np.float32))
+    owner = np.arange(rows) // faces_per_identity
+    faces = identities[owner] + noise * rng.standard_normal((rows, dim)).astype(np.float32)
+    return normalize(faces).astype(np.float32), identities
+
+
+def recall_at_k(index, queries, truth, k):
+    hits = 0
+    t0 = time.perf_counter()
+    for q, t in zip(queries, truth):
+        rows, _ = index.search(q, k)
+        hits += len(np.intersect1d(rows, t))
+    elapsed = time.perf_counter() - t0
+    return hits / float(truth.size), elapsed / len(queries) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--pq-m', type=int, default=64, help='0 skips the IVF-PQ rows')
+    parser.add_argument('--faces-per-identity', type=int, default=10)
+    parser.add_argument('--noise', type=float, default=0.03)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix, identities = synthetic_faces(args.rows, args.dim, args.faces_per_identity, args.noise, rng)
+    picked = rng.choice(args.rows // args.faces_per_identity, args.queries, replace=False)
+    queries = normalize(identities[picked] + args.noise * rng.standard_normal(
+        (args.queries, args.dim)).astype(np.float32)).astype(np.float32)
+
+    exact = ExactIndex(matrix)
+    truth = np.stack([exact.search(q, args.k)[0] for q in queries])
+    _, exact_ms = recall_at_k(exact, queries, truth, args.k)
+
+    engines = [('IVF-Flat', IVFIndex(args.nlist))]
+    if args.pq_m > 0:
+        engines.append(('IVF-PQ{}'.format(args.pq_m), IVFIndex(args.nlist, pq_m=args.pq_m)))
+
+    print('{} rows x {} dims, exact search {:.2f} ms/query'.format(args.rows, args.dim, exact_ms))
+    print('{:>10} {:>8} {:>10} {:>12} {:>9}'.format('engine', 'nprobe', 'recall@{}'.format(args.k), 'ms/query', 'speedup'))
+    for label, index in engines:
+        t0 = time.perf_counter()
+        index.build(matrix)
+        print('{:>10} built in {:.1f} s'.format(label, time.perf_counter() - t0))
+        for nprobe in args.nprobe:
+            index.nprobe = nprobe
+            recall, ms = recall_at_k(index, queries, truth, args.k)
+            print('{:>10} {:>8} {:>10.3f} {:>12.3f} {:>8.1f}x'.format(label, nprobe, recall, ms, exact_ms / ms))
+
+
+if __name__ == '__main__':
+    main()
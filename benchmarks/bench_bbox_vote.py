@@ -0,0 +1,111 @@
+"""
+RetinaFace vote-mode post-processing on crowded scenes: the blocked
+bbox_vote against the former implementation, which recomputed overlaps and
+copied the remaining boxes for every cluster.
+
+Every face contributes a cloud of jittered candidate boxes, as the detector
+produces at a low threshold. Run from the repository root:
+    python -m benchmarks.bench_bbox_vote --boxes 1000 4000 10000 30000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.retinaface import RetinaFace
+
+
+def legacy_bbox_vote(det, nms_threshold):
+    if det.shape[0] == 0:
+        return np.zeros((0, 5))
+    dets = None
+    while det.shape[0] > 0:
+        if dets is not None and dets.shape[0] >= 750:
+            break
+        area = (det[:, 2] - det[:, 0] + 1) * (det[:, 3] - det[:, 1] + 1)
+        xx1 = np.maximum(det[0, 0], det[:, 0])
+        yy1 = np.maximum(det[0, 1], det[:, 1])
+        xx2 = np.minimum(det[0, 2], det[:, 2])
+        yy2 = np.minimum(det[0, 3], det[:, 3])
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        o = inter / (area[0] + area[:] - inter)
+        merge_index = np.where(o >= nms_threshold)[0]
+        det_accu = det[merge_index, :]
+        det = np.delete(det, merge_index, 0)
+        if merge_index.shape[0] <= 1:
+            if det.shape[0] == 0:
+                try:
+                    dets = np.row_stack((dets, det_accu))
+                except:
+                    dets = det_accu
+            continue
+        det_accu[:, 0:4] = det_accu[:, 0:4] * np.tile(det_accu[:, -1:], (1, 4))
+        max_score = np.max(det_accu[:, 4])
+        det_accu_sum = np.zeros((1, 5))
+        det_accu_sum[:, 0:4] = np.sum(det_accu[:, 0:4], axis=0) / np.sum(det_accu[:, -1:])
+        det_accu_sum[:, 4] = max_score
+        if dets is None:
+            dets = det_accu_sum
+        else:
+            dets = np.row_stack((dets, det_accu_sum))
+    return dets[0:750, :]
+
+
+def crowded_scene(rng, num_boxes, boxes_per_face=20, size=1920):
+    """
+    :return: [num_boxes, 5] float32 detections sorted by score and their [num_boxes, 5, 2] landmarks
+    """
+    num_faces = max(num_boxes // boxes_per_face, 1)
+    centers = rng.uniform(0, size, (num_faces, 2))
+    sizes = rng.uniform(12, 80, num_faces)
+    face = rng.randint(0, num_faces, num_boxes)
+    jitter = rng.normal(0, 0.08, (num_boxes, 4)) * sizes[face, np.newaxis]
+    det = np.empty((num_boxes, 5), dtype=np.float32)
+    det[:, 0:2] = centers[face] - sizes[face, np.newaxis] / 2 + jitter[:, 0:2]
+    det[:, 2:4] = centers[face] + sizes[face, np.newaxis] / 2 + jitter[:, 2:4]
+    det[:, 4] = rng.uniform(0.5, 1.0, num_boxes)
+    det = det[np.argsort(-det[:, 4])]
+    landmarks = (det[:, np.newaxis, 0:2] + rng.uniform(0, 1, (num_boxes, 5, 2)) *
+                 (det[:, np.newaxis, 2:4] - det[:, np.newaxis, 0:2])).astype(np.float32)
+    return det, landmarks
+
+
+def timeit(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--boxes', type=int, nargs='+', default=[1000, 4000, 10000, 30000])
+    parser.add_argument('--nms', type=float, default=0.4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # bbox_vote only needs the NMS threshold of a detector
+    detector = RetinaFace.__new__(RetinaFace)
+    detector.nms_threshold = args.nms
+    rng = np.random.RandomState(0)
+
+    print('{:>8} {:>8} {:>12} {:>12} {:>9}'.format('boxes', 'voted', 'before ms', 'after ms', 'speedup'))
+    for num_boxes in args.boxes:
+        det, landmarks = crowded_scene(rng, num_boxes)
+        reference = legacy_bbox_vote(det.copy(), args.nms)
+        voted, voted_landmarks = detector.bbox_vote(det.copy(), landmarks)
+        assert voted.shape == reference.shape and np.array_equal(voted, reference)
+        assert voted_landmarks.shape == (voted.shape[0], 5, 2)
+
+        before = timeit(lambda: legacy_bbox_vote(det.copy(), args.nms), args.repeat)
+        after = timeit(lambda: detector.bbox_vote(det.copy(), landmarks), args.repeat)
+        print('{:>8} {:>8} {:>12.1f} {:>12.1f} {:>8.1f}x'.format(num_boxes, voted.shape[0], before, after,
+                                                               before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Per-face vs batched 5-point face alignment on --faces faces (10k by default).
+
+    estimate  similarity transforms of all faces: one similarity_transform
+              per face (and skimage's SimilarityTransform when it is
+              installed, the original implementation) vs one
+              similarity_transform_batch call
+    align     preprocess(img, landmark=...) per face vs align_batch into one
+              (B, 112, 112, 3) array
+
+Landmarks are random similarity transforms of the template, with a few
+pixels of noise, placed inside --image, and are truncated to integers like
+the detector landmarks are. The batched transforms and crops are checked
+against the per-face ones before timing. Run from the repository root:
+    python -m benchmarks.bench_face_align --faces 10000
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from utils import face_preprocess
+from utils.face_preprocess import landmark_template, similarity_transform, similarity_transform_batch, align_batch
+
+
+def random_landmarks(rng, n, width, height):
+    template = landmark_template()
+    angle = rng.uniform(-0.6, 0.6, n)
+    scale = rng.uniform(0.3, 3.0, n)
+    cos, sin = np.cos(angle) * scale, np.sin(angle) * scale
+    R = np.stack([np.stack([cos, -sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=1)
+    points = np.einsum('bij,nj->bni', R, template - template.mean(axis=0))
+    centres = np.stack([rng.uniform(0, width, n), rng.uniform(0, height, n)], axis=-1)
+    points += centres[:, np.newaxis, :] + rng.normal(0, 2.0, (n, 5, 2))
+    return points.astype(np.int64)
+
+
+def skimage_transforms(landmarks):
+    from skimage import transform as trans
+    template = landmark_template()
+    M = []
+    for landmark in landmarks:
+        tform = trans.SimilarityTransform()
+        tform.estimate(landmark.astype(np.float32), template)
+        M.append(tform.params[0:2, :])
+    return np.array(M)
+
+
+def loop_transforms(landmarks):
+    template = landmark_template()
+    return np.array([similarity_transform(landmark.astype(np.float32), template)[0:2, :] for landmark in landmarks])
+
+
+def loop_align(img, landmarks):
+    return np.array([face_preprocess.preprocess(img, None, landmark, image_size='112,112') for landmark in landmarks])
+
+
+def timeit(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', default='./TestImages/2.jpg')
+    parser.add_argument('--faces', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    rng = np.random.RandomState(0)
+
+    img = cv2.imread(args.image)
+    landmarks = random_landmarks(rng, args.faces, img.shape[1], img.shape[0])
+    template = landmark_template()
+
+    batched = similarity_transform_batch(landmarks.astype(np.float32), template)
+    reference = loop_transforms(landmarks)
+    assert np.allclose(batched, reference, rtol=1e-9, atol=1e-9), 'batched transforms differ from the per-face ones'
+    crops = align_batch(img, landmarks)
+    reference_crops = loop_align(img, landmarks)
+    diff = np.abs(crops.astype(np.int16) - reference_crops.astype(np.int16))
+    assert diff.max() <= 1, 'batched crops differ from preprocess by up to {}'.format(diff.max())
+    print('Batched transforms and crops match the per-face ones ({} pixels off by 1)'.format(np.count_nonzero(diff)))
+
+    cases = []
+    try:
+        legacy = skimage_transforms(landmarks[:100])
+        print('skimage max abs difference: {:.2e}'.format(np.abs(legacy - reference[:100]).max()))
+        cases.append(('estimate', 'skimage loop', lambda: skimage_transforms(landmarks)))
+    except ImportError:
+        print('skimage is not installed, skipping the original per-face estimate')
+    out = np.empty_like(crops)
+    cases += [('estimate', 'numpy loop', lambda: loop_transforms(landmarks)),
+              ('estimate', 'batched', lambda: similarity_transform_batch(landmarks.astype(np.float32), template)),
+              ('align', 'preprocess loop', lambda: loop_align(img, landmarks)),
+              ('align', 'align_batch', lambda: align_batch(img, landmarks, out=out))]
+
+    print('{:>9} {:>16} {:>10} {:>12}'.format('stage', 'method', 'seconds', 'faces/sec'))
+    for stage, method, func in cases:
+        seconds = timeit(func, args.repeat)
+        print('{:>9} {:>16} {:>10.3f} {:>12.0f}'.format(stage, method, seconds, args.faces / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Cold vs warm latency of the one-shot detect / embed / search commands.
+
+Cold runs pass --no-daemon, so every command imports mxnet, loads both
+checkpoints and binds the modules itself, as the scripts used to. Warm runs
+go through a face daemon started once by this benchmark (its start-up time
+is reported separately). Every run is a fresh `python -m utils.face_daemon`
+process timed from spawn to exit. Run from the repository root:
+    python -m benchmarks.bench_face_daemon --image ./TestImages/2.jpg --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from utils.face_daemon import connect
+
+
+def run_command(command, args, warm):
+    cmd = [sys.executable, '-m', 'utils.face_daemon', command, args.image,
+           '--socket', args.socket, '--gpuid', str(args.gpuid), '--gallery', args.gallery]
+    if not warm:
+        cmd.append('--no-daemon')
+    t0 = time.perf_counter()
+    subprocess.check_call(cmd, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+
+def start_daemon(args):
+    t0 = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'utils.face_daemon', 'serve', '--socket', args.socket,
+                                '--gpuid', str(args.gpuid), '--gallery', args.gallery],
+                               stdout=subprocess.DEVNULL)
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError('The daemon exited with code {}'.format(process.returncode))
+        client = connect(args.socket)
+        if client is not None:
+            client.close()
+            return process, time.perf_counter() - t0
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', default='./TestImages/2.jpg')
+    parser.add_argument('--gallery', default='./DATA/Images')
+    parser.add_argument('--socket', default='/tmp/face_searching_bench.sock')
+    parser.add_argument('--gpuid', type=int, default=0)
+    parser.add_argument('--commands', nargs='+', default=['detect', 'embed', 'search'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if connect(args.socket) is not None:
+        parser.error('A daemon is already listening on {}'.format(args.socket))
+
+    cold = {command: [run_command(command, args, False) for _ in range(args.repeat)] for command in args.commands}
+
+    process, startup = start_daemon(args)
+    try:
+        warm = {command: [run_command(command, args, True) for _ in range(args.repeat)]
+                for command in args.commands}
+    finally:
+        client = connect(args.socket)
+        if client is not None:
+            client.shutdown()
+        process.wait()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+    print('Daemon start-up: {:.2f}s'.format(startup))
+    print('{:>8} {:>14} {:>14} {:>9}'.format('command', 'cold median s', 'warm median s', 'speedup'))
+    for command in args.commands:
+        cold_s, warm_s = np.median(cold[command]), np.median(warm[command])
+        print('{:>8} {:>14.3f} {:>14.3f} {:>8.1f}x'.format(command, cold_s, warm_s, cold_s / warm_s))
+
+
+if __name__ == '__main__':
+    main()
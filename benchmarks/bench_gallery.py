@@ -0,0 +1,89 @@
+"""
+Compare the per-vector loop of the original find_FaceVector with Gallery search.
+
+Run from the repository root:
+    python -m benchmarks.bench_gallery --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.gallery import Gallery
+
+
+def find_FaceVector_loop(vector, vector_dict, dist_thres=1.0):
+    # The original implementation from face_searching.py, kept as the baseline
+    min_image_names = []
+    for image_name in vector_dict.keys():
+        vector_list = vector_dict[image_name]
+        for v in vector_list:
+            v = np.array(v, dtype=np.float32)
+            distance = np.sum(np.square(vector - v))
+            if distance < dist_thres:
+                min_image_names.append(image_name)
+    return min_image_names
+
+
+def random_embeddings(n, dim, rng):
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x
+
+
+def time_call(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--loop-max', type=int, default=100000,
+                        help='largest gallery the Python loop is actually run on; '
+                             'bigger sizes are extrapolated from the per-row cost')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    loop_per_row = None
+
+    print('{:>10} {:>14} {:>14} {:>14} {:>10}'.format('rows', 'loop (ms)', 'threshold (ms)', 'top-10 (ms)', 'speedup'))
+    for n in args.sizes:
+        matrix = random_embeddings(n, args.dim, rng)
+        names = ['{:08d}.jpg'.format(i) for i in range(n)]
+        gallery = Gallery(matrix, names, np.arange(n + 1))
+        # Plant a near duplicate so the threshold search has a hit
+        query = matrix[n // 2] + 0.01 * random_embeddings(1, args.dim, rng)[0]
+        query /= np.linalg.norm(query)
+
+        t_thres = time_call(lambda: gallery.search_threshold(query, 1.0), args.repeat)
+        t_topk = time_call(lambda: gallery.search(query, 10), args.repeat)
+
+        if n <= args.loop_max:
+            vector_dict = {names[i]: [matrix[i].tolist()] for i in range(n)}
+            t_loop = time_call(lambda: find_FaceVector_loop(query, vector_dict), 1)
+            expected = find_FaceVector_loop(query, vector_dict)
+            got = [name for name, _ in gallery.search_threshold(query, 1.0)]
+            assert got == expected, 'Gallery and loop results differ'
+            loop_per_row = t_loop / n
+            loop_str = '{:.1f}'.format(t_loop * 1e3)
+            del vector_dict
+        elif loop_per_row is not None:
+            t_loop = loop_per_row * n
+            loop_str = '~{:.1f}'.format(t_loop * 1e3)
+        else:
+            t_loop = float('nan')
+            loop_str = 'n/a'
+
+        print('{:>10} {:>14} {:>14.2f} {:>14.2f} {:>9.0f}x'.format(
+            n, loop_str, t_thres * 1e3, t_topk * 1e3, t_loop / t_thres))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+QPS and recall@10 of the HNSW index against exact search on a synthetic gallery.
+
+Insertion runs at a few hundred rows per second in pure Python, so the
+default 50k-row gallery builds in a few minutes. A million-row graph takes
+hours: ask for it explicitly and cache the built index with --index-path to
+reuse it across runs.
+
+Run from the repository root:
+    python -m benchmarks.bench_hnsw
+    python -m benchmarks.bench_hnsw --rows 1000000 --index-path /tmp/hnsw_1m.npz
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from benchmarks.bench_ann import normalize, synthetic_faces, recall_at_k
+from utils.gallery import ExactIndex
+from utils.hnsw_index import HNSWIndex
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--M', type=int, default=16)
+    parser.add_argument('--ef-construction', type=int, default=100)
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[10, 20, 40, 80, 160, 320])
+    parser.add_argument('--faces-per-identity', type=int, default=10)
+    parser.add_argument('--noise', type=float, default=0.03)
+    parser.add_argument('--index-path', default=None, help='load the graph from / save it to this .npz')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix, identities = synthetic_faces(args.rows, args.dim, args.faces_per_identity, args.noise, rng)
+    picked = rng.choice(args.rows // args.faces_per_identity, args.queries, replace=False)
+    queries = normalize(identities[picked] + args.noise * rng.standard_normal(
+        (args.queries, args.dim)).astype(np.float32)).astype(np.float32)
+
+    exact = ExactIndex(matrix)
+    truth = np.stack([exact.search(q, args.k)[0] for q in queries])
+    _, exact_ms = recall_at_k(exact, queries, truth, args.k)
+
+    if args.index_path and os.path.exists(args.index_path):
+        index = HNSWIndex.load(args.index_path)
+        if len(index) != args.rows or not index.indexes_rows_of(matrix):
+            raise ValueError('Cached index {} was built for a different gallery'.format(args.index_path))
+        print('Loaded {} nodes from {}'.format(len(index), args.index_path))
+    else:
+        index = HNSWIndex(args.dim, args.M, args.ef_construction)
+        t0 = time.perf_counter()
+        step = max(args.rows // 20, 1)
+        for start in range(0, args.rows, step):
+            index.add(matrix[start:start + step])
+            elapsed = time.perf_counter() - t0
+            print('Inserted {}/{} ({:.0f} inserts/s)'.format(len(index), args.rows, len(index) / elapsed))
+        if args.index_path:
+            index.save(args.index_path)
+
+    print('{} rows x {} dims, exact search {:.2f} ms/query ({:.0f} QPS)'.format(
+        args.rows, args.dim, exact_ms, 1e3 / exact_ms))
+    print('{:>10} {:>10} {:>10} {:>10}'.format('ef_search', 'recall@{}'.format(args.k), 'ms/query', 'QPS'))
+    for ef in args.ef_search:
+        index.ef_search = ef
+        recall, ms = recall_at_k(index, queries, truth, args.k)
+        print('{:>10} {:>10.3f} {:>10.3f} {:>10.0f}'.format(ef, recall, ms, 1e3 / ms))
+
+
+if __name__ == '__main__':
+    main()
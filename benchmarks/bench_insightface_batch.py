@@ -0,0 +1,50 @@
+"""
+Recognition throughput of InsightFace.face_vertorizing_batch by batch size,
+against one face_vertorizing call per face.
+
+Needs the insightface model in ./model/insightface (see Readme). Run from the
+repository root, on CPU by default:
+    python -m benchmarks.bench_insightface_batch --faces 256 --batch-sizes 1 4 16 32 64
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.insightface import InsightFace
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prefix', default='./model/insightface/insightface')
+    parser.add_argument('--ctx-id', type=int, default=-1, help='GPU id, -1 for CPU')
+    parser.add_argument('--faces', type=int, default=256)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    aligned_list = [rng.randint(0, 256, (3, 112, 112)).astype(np.uint8) for _ in range(args.faces)]
+
+    Recognizer = InsightFace(args.prefix, 0, ctx_id=args.ctx_id, max_batch_size=max(args.batch_sizes))
+    # Warm up and check that the batched path matches the per-face one
+    reference = np.stack([Recognizer.face_vertorizing(a) for a in aligned_list[:4]])
+    assert np.allclose(Recognizer.face_vertorizing_batch(aligned_list[:4]), reference, atol=1e-4)
+
+    t0 = time.perf_counter()
+    for aligned in aligned_list:
+        Recognizer.face_vertorizing(aligned)
+    single = args.faces / (time.perf_counter() - t0)
+    print('{:>12} {:>12} {:>9}'.format('batch size', 'faces/s', 'speedup'))
+    print('{:>12} {:>12.1f} {:>9}'.format('per-face', single, '1.0x'))
+
+    for batch_size in args.batch_sizes:
+        Recognizer.max_batch_size = batch_size
+        Recognizer.face_vertorizing_batch(aligned_list[:batch_size])
+        t0 = time.perf_counter()
+        Recognizer.face_vertorizing_batch(aligned_list)
+        rate = args.faces / (time.perf_counter() - t0)
+        print('{:>12} {:>12.1f} {:>8.1f}x'.format(batch_size, rate, rate / single))
+
+
+if __name__ == '__main__':
+    main()
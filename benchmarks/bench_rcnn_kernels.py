@@ -0,0 +1,101 @@
+"""
+Equivalence checks and timings of every available backend of the box
+kernels in rcnn/processing/kernels.py, against the pure-Python reference.
+
+The Cython backend only shows up once the extensions are built:
+    cd rcnn/cython && python setup.py build_ext --inplace
+
+Run from the repository root:
+    python -m benchmarks.bench_rcnn_kernels --repeat 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from rcnn.processing import kernels
+# Importing the kernel modules registers their backends
+from rcnn.processing import generate_anchor, bbox_transform  # noqa: F401
+
+
+def random_boxes(rng, n, size=640):
+    xy = rng.uniform(0, size, (n, 2))
+    wh = rng.uniform(1, size / 4.0, (n, 2))
+    boxes = np.hstack([xy, xy + wh])
+    # Degenerate and touching boxes hit the iw / ih <= 0 branches
+    boxes[:n // 20, 2:] = boxes[:n // 20, :2] - 1
+    return boxes
+
+
+BASE_ANCHORS = np.array([[-248., -248., 263., 263.], [-120., -120., 135., 135.]], dtype=np.float32)
+
+
+def check_anchors():
+    reference = kernels.get('anchors_plane', 'python')
+    for backend in kernels.available_backends('anchors_plane'):
+        func = kernels.get('anchors_plane', backend)
+        for height, width, stride in [(1, 1, 8), (3, 7, 16), (80, 80, 8), (135, 240, 8)]:
+            expected = reference(height, width, stride, BASE_ANCHORS)
+            result = func(height, width, stride, BASE_ANCHORS)
+            assert result.dtype == expected.dtype and np.array_equal(result, expected), \
+                'anchors_plane/{} differs on {}x{} stride {}'.format(backend, height, width, stride)
+
+
+def check_overlaps(rng):
+    reference = kernels.get('bbox_overlaps', 'python')
+    for backend in kernels.available_backends('bbox_overlaps'):
+        func = kernels.get('bbox_overlaps', backend)
+        for n, k in [(0, 5), (5, 0), (1, 1), (200, 30)]:
+            boxes, query_boxes = random_boxes(rng, n), random_boxes(rng, k)
+            # Identical boxes and boxes sharing only an edge
+            if n and k:
+                boxes[0] = query_boxes[0]
+                boxes[-1] = query_boxes[-1] + [query_boxes[-1, 2] - query_boxes[-1, 0] + 1, 0, 0, 0]
+            expected = reference(boxes, query_boxes)
+            result = func(boxes, query_boxes)
+            assert result.shape == expected.shape and np.allclose(result, expected, rtol=1e-12, atol=0), \
+                'bbox_overlaps/{} differs on {}x{}'.format(backend, n, k)
+
+
+def timeit(func, repeat):
+    func()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--boxes', type=int, default=2000)
+    parser.add_argument('--query-boxes', type=int, default=50)
+    args = parser.parse_args()
+    rng = np.random.RandomState(0)
+
+    check_anchors()
+    check_overlaps(rng)
+    print('All backends match the python reference')
+    print('Active backends: anchors_plane={}, bbox_overlaps={}'.format(
+        kernels.active_backend('anchors_plane'), kernels.active_backend('bbox_overlaps')))
+
+    boxes, query_boxes = random_boxes(rng, args.boxes), random_boxes(rng, args.query_boxes)
+    cases = [('anchors_plane 80x80/8', 'anchors_plane', (80, 80, 8, BASE_ANCHORS)),
+             ('anchors_plane 135x240/8', 'anchors_plane', (135, 240, 8, BASE_ANCHORS)),
+             ('bbox_overlaps {}x{}'.format(args.boxes, args.query_boxes), 'bbox_overlaps', (boxes, query_boxes))]
+
+    print('{:>26} {:>8} {:>11} {:>9}'.format('kernel', 'backend', 'ms', 'speedup'))
+    for label, kernel, call_args in cases:
+        reference_ms = None
+        for backend in reversed(kernels.available_backends(kernel)):
+            func = kernels.get(kernel, backend)
+            ms = timeit(lambda: func(*call_args), args.repeat)
+            if reference_ms is None:
+                reference_ms = ms
+            print('{:>26} {:>8} {:>11.3f} {:>8.1f}x'.format(label, backend, ms, reference_ms / ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Detection throughput of RetinaFace.detect_batch by batch size, against one
+detect call per image, on 640x640 images as produced by WashImages.py.
+
+Run from the repository root, on CPU by default:
+    python -m benchmarks.bench_retinaface_batch --images 64 --batch-sizes 1 2 4 8 16
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils.retinaface import RetinaFace
+
+
+def load_images(image_dir, count, size=640):
+    images = []
+    for image_name in sorted(os.listdir(image_dir)):
+        image = cv2.imread(os.path.join(image_dir, image_name))
+        if image is not None:
+            images.append(cv2.resize(image, dsize=(size, size)))
+        if len(images) == count:
+            break
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prefix', default='./model/mnet.25/mnet.25')
+    parser.add_argument('--image-dir', default='./DATA/Images')
+    parser.add_argument('--ctx-id', type=int, default=-1, help='GPU id, -1 for CPU')
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    images = load_images(args.image_dir, args.images)
+    detector = RetinaFace(args.prefix, 0, ctx_id=args.ctx_id, max_batch_size=max(args.batch_sizes))
+
+    # Warm up and check that batching does not change the detections
+    for image, (det, _) in zip(images[:2], detector.detect_batch(images[:2], args.threshold)):
+        reference, _ = detector.detect(image, args.threshold)
+        assert det.shape == reference.shape and np.allclose(det, reference, atol=1e-3)
+
+    t0 = time.perf_counter()
+    for image in images:
+        detector.detect(image, args.threshold)
+    single = len(images) / (time.perf_counter() - t0)
+    print('{:>12} {:>12} {:>9}'.format('batch size', 'images/s', 'speedup'))
+    print('{:>12} {:>12.1f} {:>9}'.format('per-image', single, '1.0x'))
+
+    for batch_size in args.batch_sizes:
+        detector.max_batch_size = batch_size
+        detector.detect_batch(images[:batch_size], args.threshold)
+        t0 = time.perf_counter()
+        detector.detect_batch(images, args.threshold)
+        rate = len(images) / (time.perf_counter() - t0)
+        print('{:>12} {:>12.1f} {:>8.1f}x'.format(batch_size, rate, rate / single))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Module cache behaviour of RetinaFace on images of mixed sizes: detect is
+run over an image directory at the images' native sizes for several bucket
+multiples, and the executor hit rate, binds, evictions and throughput are
+reported for each. Zero-padding to the bucket shape approximates the
+unpadded forward, so the detections of every multiple are also compared
+with those of multiple 1, which never pads: the number of images whose face
+count changed and the largest box coordinate shift among the others.
+
+Run from the repository root, on CPU by default:
+    python -m benchmarks.bench_retinaface_buckets --images 200 --multiples 32 64 128
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils.retinaface import RetinaFace
+
+
+def load_native_images(image_dir, count, max_side=1024):
+    images = []
+    for image_name in sorted(os.listdir(image_dir)):
+        image = cv2.imread(os.path.join(image_dir, image_name))
+        if image is None:
+            continue
+        scale = float(max_side) / max(image.shape[:2])
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale)
+        images.append(image)
+        if len(images) == count:
+            break
+    return images
+
+
+def drift(detections, reference):
+    """
+    :return: images whose face count differs from reference, max abs box coordinate difference of the others
+    """
+    changed, max_shift = 0, 0.0
+    for (det, _), (ref, _) in zip(detections, reference):
+        if det.shape[0] != ref.shape[0]:
+            changed += 1
+        elif det.shape[0] > 0:
+            # Both sorted by score after NMS, which a small shift can reorder
+            det, ref = det[np.lexsort(det[:, :4].T)], ref[np.lexsort(ref[:, :4].T)]
+            max_shift = max(max_shift, float(np.abs(det[:, :4] - ref[:, :4]).max()))
+    return changed, max_shift
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prefix', default='./model/mnet.25/mnet.25')
+    parser.add_argument('--image-dir', default='./DATA/Images')
+    parser.add_argument('--ctx-id', type=int, default=-1, help='GPU id, -1 for CPU')
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--multiples', type=int, nargs='+', default=[32, 64, 128])
+    parser.add_argument('--max-buckets', type=int, default=8)
+    args = parser.parse_args()
+
+    images = load_native_images(args.image_dir, args.images)
+    print('{} images, {} distinct sizes'.format(len(images), len(set(image.shape for image in images))))
+
+    print('{:>9} {:>9} {:>7} {:>7} {:>10} {:>9} {:>10} {:>8} {:>9}'.format(
+        'multiple', 'hit rate', 'binds', 'evicts', 'buckets', 'images/s', 'warm im/s', 'changed', 'max shift'))
+    reference = None
+    for multiple in [1] + [m for m in args.multiples if m != 1]:
+        detector = RetinaFace(args.prefix, 0, ctx_id=args.ctx_id,
+                              bucket_multiple=multiple, max_buckets=args.max_buckets)
+        # First pass pays for the binds, the second one shows the steady state
+        t0 = time.perf_counter()
+        for image in images:
+            detector.detect(image, args.threshold)
+        cold = len(images) / (time.perf_counter() - t0)
+        stats = detector.bucket_stats()
+        t0 = time.perf_counter()
+        detections = [detector.detect(image, args.threshold) for image in images]
+        warm = len(images) / (time.perf_counter() - t0)
+        if reference is None:
+            reference = detections
+        changed, max_shift = drift(detections, reference)
+        print('{:>9} {:>9.3f} {:>7} {:>7} {:>10} {:>9.1f} {:>10.1f} {:>8} {:>9.2f}'.format(
+            multiple, stats['hit_rate'], stats['binds'], stats['evictions'],
+            len(stats['buckets']), cold, warm, changed, max_shift))
+
+
+if __name__ == '__main__':
+    main()
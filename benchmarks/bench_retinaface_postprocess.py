@@ -0,0 +1,70 @@
+"""
+Latency of the RetinaFace post-processing stage alone (decoding,
+thresholding, NMS) on synthetic network outputs, by score threshold.
+
+The outputs have the shapes the model produces for the given frame size;
+face scores are mostly low with a few confident anchors, as on real frames.
+Run from the repository root, on CPU by default:
+    python -m benchmarks.bench_retinaface_postprocess --height 1080 --width 1920
+"""
+import argparse
+import time
+
+import numpy as np
+from mxnet import ndarray as nd
+
+from utils.retinaface import RetinaFace
+
+
+def synthetic_outputs(detector, height, width, batch_size, rng, face_ratio=0.001):
+    """
+    :return: list of nd arrays laid out like the network outputs, stride by stride
+    """
+    net_out = []
+    for stride in detector._feat_stride_fpn:
+        A = detector._num_anchors['stride%s' % stride]
+        h, w = -(-height // stride), -(-width // stride)
+        face = (rng.uniform(size=(batch_size, A, h, w)) < face_ratio) * rng.uniform(0.8, 1.0, (batch_size, A, h, w))
+        background = rng.beta(0.5, 20.0, (batch_size, A, h, w))
+        face = np.maximum(face, background)
+        scores = np.concatenate([1.0 - face, face], axis=1).astype(np.float32)
+        net_out.append(nd.array(scores))
+        net_out.append(nd.array(rng.normal(0, 0.1, (batch_size, 4 * A, h, w)).astype(np.float32)))
+        if detector.use_landmarks:
+            net_out.append(nd.array(rng.normal(0, 0.3, (batch_size, 10 * A, h, w)).astype(np.float32)))
+    return net_out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prefix', default='./model/mnet.25/mnet.25')
+    parser.add_argument('--height', type=int, default=640)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.8, 0.95])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    detector = RetinaFace(args.prefix, 0, ctx_id=-1)
+    net_out = synthetic_outputs(detector, args.height, args.width, args.batch_size, np.random.RandomState(0))
+    im_info = [args.height, args.width]
+    num_anchors = sum(out.shape[1] // 2 * out.shape[2] * out.shape[3] for out in net_out[::3 if detector.use_landmarks else 2])
+    print('{}x{} x{}, {} anchors per image'.format(args.width, args.height, args.batch_size, num_anchors))
+
+    print('{:>10} {:>9} {:>12} {:>10}'.format('threshold', 'kept', 'faces/image', 'ms/image'))
+    for threshold in args.thresholds:
+        kept = sum(int((out.asnumpy()[:, out.shape[1] // 2:] >= threshold).sum())
+                   for out in net_out[::3 if detector.use_landmarks else 2])
+        results = detector._postprocess(net_out, im_info, threshold, 1.0)
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            detector._postprocess(net_out, im_info, threshold, 1.0)
+            times.append(time.perf_counter() - t0)
+        faces = np.mean([det.shape[0] for det, _ in results])
+        print('{:>10} {:>9} {:>12.1f} {:>10.3f}'.format(threshold, kept, faces,
+                                                      np.median(times) * 1000 / args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Allocation and latency profile of RetinaFace input preprocessing per frame:
+the former detect path (copy, float32 cast, float64 zeros tensor filled
+channel by channel, zero-padded copy to the bucket shape) against
+InputBuffers.fill, which normalizes straight into a reused float32 buffer.
+
+Only the NumPy side is measured, the nd.array copy is the same for both.
+Run from the repository root:
+    python -m benchmarks.bench_retinaface_preprocess --repeat 20
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils.module_cache import InputBuffers, bucket_shape
+
+PIXEL_MEANS = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+PIXEL_STDS = np.array([1.0, 1.0, 1.0], dtype=np.float32)
+PIXEL_SCALE = 1.0
+
+
+def legacy_preprocess(img, multiple=32):
+    im = img.copy()
+    im = im.astype(np.float32)
+    im_tensor = np.zeros((1, 3, im.shape[0], im.shape[1]))
+    for i in range(3):
+        im_tensor[0, i, :, :] = (im[:, :, 2 - i] / PIXEL_SCALE - PIXEL_MEANS[2 - i]) / PIXEL_STDS[2 - i]
+    shape = bucket_shape(im_tensor.shape, multiple)
+    if shape != im_tensor.shape:
+        padded = np.zeros(shape, dtype=im_tensor.dtype)
+        padded[:, :, :im_tensor.shape[2], :im_tensor.shape[3]] = im_tensor
+        im_tensor = padded
+    return im_tensor
+
+
+def profile(func, img, repeat):
+    func(img)
+    tracemalloc.start()
+    func(img)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(img)
+        times.append(time.perf_counter() - t0)
+    return peak, np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    buffers = InputBuffers(PIXEL_MEANS, PIXEL_STDS, PIXEL_SCALE)
+    rng = np.random.RandomState(0)
+    print('{:>10} {:>8} {:>14} {:>9} {:>9}'.format('frame', 'path', 'peak alloc MB', 'ms', 'speedup'))
+    for height, width in [(640, 640), (1080, 1920)]:
+        img = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+        reference = legacy_preprocess(img)
+        assert np.array_equal(buffers.fill([img]), reference.astype(np.float32))
+
+        label = '{}x{}'.format(width, height)
+        legacy_peak, legacy_ms = profile(legacy_preprocess, img, args.repeat)
+        fused_peak, fused_ms = profile(lambda im: buffers.fill([im]), img, args.repeat)
+        print('{:>10} {:>8} {:>14.2f} {:>9.2f} {:>9}'.format(label, 'before', legacy_peak / 2.0 ** 20, legacy_ms, ''))
+        print('{:>10} {:>8} {:>14.2f} {:>9.2f} {:>8.1f}x'.format(label, 'after', fused_peak / 2.0 ** 20, fused_ms,
+                                                               legacy_ms / fused_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Peak memory and latency per megapixel of RetinaFace on a very large image:
+one full-resolution forward, a downscaled forward, and detect_tiled.
+
+Every mode runs in its own process so its peak resident memory can be read
+from getrusage. The image is an image of --image-dir resized to the target
+size (24 MP by default). Run from the repository root, on CPU by default:
+    python -m benchmarks.bench_retinaface_tiled --width 6000 --height 4000
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import cv2
+
+
+def run_mode(args, mode):
+    from utils.retinaface import RetinaFace
+
+    image_name = sorted(os.listdir(args.image_dir))[0]
+    img = cv2.resize(cv2.imread(os.path.join(args.image_dir, image_name)), dsize=(args.width, args.height))
+    detector = RetinaFace(args.prefix, 0, ctx_id=args.ctx_id, max_batch_size=args.batch_size)
+
+    if mode == 'full':
+        detect = lambda: detector.detect(img, args.threshold)
+    elif mode == 'downscaled':
+        scale = float(args.downscale_side) / max(args.width, args.height)
+        detect = lambda: detector.detect(img, args.threshold, scales=scale)
+    else:
+        detect = lambda: detector.detect_tiled(img, args.threshold, args.tile_size, args.overlap)
+
+    det, _ = detect()
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        detect()
+    seconds = (time.perf_counter() - t0) / args.repeat
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return det.shape[0], seconds, peak_mb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prefix', default='./model/mnet.25/mnet.25')
+    parser.add_argument('--image-dir', default='./DATA/Images')
+    parser.add_argument('--ctx-id', type=int, default=-1, help='GPU id, -1 for CPU')
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--tile-size', type=int, default=640)
+    parser.add_argument('--overlap', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--downscale-side', type=int, default=1920)
+    parser.add_argument('--modes', nargs='+', default=['full', 'downscaled', 'tiled'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    megapixels = args.width * args.height / 1e6
+    print('{}x{} ({:.1f} MP)'.format(args.width, args.height, megapixels))
+    print('{:>11} {:>7} {:>10} {:>9} {:>13}'.format('mode', 'faces', 'seconds', 'ms/MP', 'peak RSS MB'))
+    ctx = multiprocessing.get_context('spawn')
+    for mode in args.modes:
+        with ctx.Pool(1) as pool:
+            try:
+                faces, seconds, peak_mb = pool.apply(run_mode, (args, mode))
+            except Exception as e:
+                print('{:>11} failed: {!r}'.format(mode, e))
+                continue
+        print('{:>11} {:>7} {:>10.2f} {:>9.1f} {:>13.0f}'.format(mode, faces, seconds,
+                                                                seconds * 1000 / megapixels, peak_mb))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Latency percentiles and throughput of the asyncio search service for
+several micro-batch windows, under a local closed-loop load generator.
+
+The models and the gallery are loaded once; for every --max-wait-ms value
+a fresh SearchService is served on an ephemeral port and --concurrency
+clients each send search requests back to back over a keep-alive
+connection. Requests cycle over the images of --image-dir. Run from the
+repository root:
+    python -m benchmarks.bench_search_server --max-wait-ms 0 2 5 10 20 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+
+async def _post(reader, writer, body):
+    writer.write('POST /search HTTP/1.1\r\nHost: bench\r\nContent-Length: {}\r\n\r\n'.format(
+        len(body)).encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        if key.strip().lower() == 'content-length':
+            length = int(value)
+    payload = json.loads((await reader.readexactly(length)).decode('utf-8'))
+    assert status == 200, payload
+    return payload
+
+
+async def _client(port, bodies, offset, deadline, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    i = offset
+    try:
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            await _post(reader, writer, bodies[i % len(bodies)])
+            latencies.append(time.perf_counter() - t0)
+            i += 1
+    finally:
+        writer.close()
+
+
+async def run_window(service, bodies, concurrency, seconds, warmup):
+    from utils.search_server import start_server
+
+    server = await start_server(service, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        # Warm-up binds the batch shapes the window produces
+        await asyncio.gather(*[_client(port, bodies, c, time.perf_counter() + warmup, [])
+                               for c in range(concurrency)])
+        detect_before = dict(service.detect_batcher.stats())
+        latencies = []
+        t0 = time.perf_counter()
+        await asyncio.gather(*[_client(port, bodies, c, t0 + seconds, latencies)
+                               for c in range(concurrency)])
+        elapsed = time.perf_counter() - t0
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+    detect_after = service.detect_batcher.stats()
+    batches = detect_after['batches'] - detect_before['batches']
+    items = detect_after['items'] - detect_before['items']
+    return np.array(latencies), elapsed, items / float(batches) if batches else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image-dir', default='./TestImages')
+    parser.add_argument('--gallery', default='./DATA/Images')
+    parser.add_argument('--ctx-id', type=int, default=0, help='GPU id, -1 for CPU')
+    parser.add_argument('--max-batch', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, nargs='+', default=[0.0, 2.0, 5.0, 10.0, 20.0])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    args = parser.parse_args()
+
+    from utils.retinaface import RetinaFace
+    from utils.insightface import InsightFace
+    from utils.embedding_store import load_gallery
+    from utils.search_server import SearchService
+
+    bodies = []
+    for image_name in sorted(os.listdir(args.image_dir)):
+        with open(os.path.join(args.image_dir, image_name), 'rb') as f:
+            bodies.append(f.read())
+    gallery = load_gallery(args.gallery, json_path=args.gallery + '.json')
+    detector = RetinaFace('./model/mnet.25/mnet.25', 0, ctx_id=args.ctx_id, max_batch_size=args.max_batch)
+    Recognizer = InsightFace('./model/insightface/insightface', 0, ctx_id=args.ctx_id, max_batch_size=32)
+    print('{} images, {} gallery faces, {} clients'.format(len(bodies), len(gallery), args.concurrency))
+
+    print('{:>12} {:>9} {:>9} {:>9} {:>11}'.format('max wait ms', 'p50 ms', 'p99 ms', 'QPS', 'mean batch'))
+    for max_wait_ms in args.max_wait_ms:
+        service = SearchService(detector, Recognizer, gallery, max_batch_size=args.max_batch,
+                                max_wait=max_wait_ms / 1000.0)
+        latencies, elapsed, mean_batch = asyncio.run(
+            run_window(service, bodies, args.concurrency, args.seconds, args.warmup))
+        service.model_executor.shutdown()
+        print('{:>12.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>11.2f}'.format(
+            max_wait_ms, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000,
+            len(latencies) / elapsed, mean_batch))
+
+
+if __name__ == '__main__':
+    main()
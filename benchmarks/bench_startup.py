@@ -0,0 +1,128 @@
+"""
+Start-up cost of face_searching.py, checked against a budget.
+
+Two numbers are measured in fresh processes:
+    import      `python -X importtime -c "import face_searching"`: what every
+                run pays before deciding how to get its models. mxnet,
+                sklearn and skimage must not be among these imports.
+    first query spawn to exit of a process that runs face_searching's
+                load_searching + search_image on --image, i.e. the time to
+                the first answer. With a face daemon warm (started here with
+                --daemon, or already running) no model is loaded in-process.
+The slowest imports of both are listed. The exit status is 1 when a budget
+is exceeded. Run from the repository root:
+    python -m benchmarks.bench_startup --daemon
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Target budgets, on the reference machine of the Readme
+IMPORT_BUDGET_MS = 300.0
+FIRST_QUERY_BUDGET_S = 1.0
+
+HEAVY_MODULES = ('mxnet', 'sklearn', 'skimage')
+
+FIRST_QUERY = """
+import cv2
+import face_searching
+gallery, detector, Recognizer = face_searching.load_searching(face_searching.connect())
+face_searching.search_image(cv2.imread({image!r}), gallery, detector, Recognizer)
+"""
+
+
+def parse_importtime(stderr):
+    """
+    :return: {module: cumulative ms} of the top-level imports, {module: self ms} of every import
+    """
+    cumulative, own = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        own[module] = own.get(module, 0.0) + int(self_us) / 1000.0
+        # Nested imports are indented below the module importing them
+        if name[1:2] != ' ':
+            cumulative[module] = cumulative.get(module, 0.0) + int(cumulative_us) / 1000.0
+    return cumulative, own
+
+
+def run(code):
+    t0 = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - t0
+    if result.returncode != 0:
+        raise RuntimeError('Benchmark process failed:\n{}'.format(result.stderr[-2000:]))
+    return elapsed, parse_importtime(result.stderr)
+
+
+def report_imports(label, own, top):
+    print('Slowest imports of {} (self ms):'.format(label))
+    for module, ms in sorted(own.items(), key=lambda item: -item[1])[:top]:
+        print('  {:>9.1f}  {}'.format(ms, module))
+
+
+def main():
+    from utils.face_daemon import DEFAULT_SOCKET, connect
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', default='./TestImages/2.jpg')
+    parser.add_argument('--daemon', action='store_true', help='start a face daemon for the first query')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--first-query-budget', type=float, default=FIRST_QUERY_BUDGET_S)
+    args = parser.parse_args()
+
+    # Read by utils.face_daemon in the benchmark processes
+    os.environ['FACE_DAEMON_SOCKET'] = args.socket
+    over_budget = False
+    runs = [run('import face_searching') for _ in range(args.repeat)]
+    import_ms = np.median([sum(cumulative.values()) for _, (cumulative, _) in runs])
+    _, (cumulative, own) = runs[-1]
+    heavy = [m for m in own if m.split('.')[0] in HEAVY_MODULES]
+    print('import face_searching: {:.1f} ms (budget {:.0f} ms)'.format(import_ms, args.import_budget_ms))
+    report_imports('face_searching', own, args.top)
+    if heavy:
+        print('Heavy modules imported eagerly: {}'.format(sorted(set(m.split('.')[0] for m in heavy))))
+        over_budget = True
+    if import_ms > args.import_budget_ms:
+        over_budget = True
+
+    process = None
+    if args.daemon:
+        from benchmarks.bench_face_daemon import start_daemon
+        args.gpuid, args.gallery = 0, './DATA/Images'
+        process, startup = start_daemon(args)
+        print('Face daemon started in {:.2f}s'.format(startup))
+    warm = connect(args.socket) is not None
+    try:
+        runs = [run(FIRST_QUERY.format(image=args.image)) for _ in range(args.repeat)]
+    finally:
+        if process is not None:
+            connect(args.socket).shutdown()
+            process.wait()
+    first_query = np.median([elapsed for elapsed, _ in runs])
+    if warm:
+        print('Time to first query with the daemon: {:.3f}s (budget {:.2f}s)'.format(
+            first_query, args.first_query_budget))
+        if first_query > args.first_query_budget:
+            over_budget = True
+    else:
+        print('Time to first query without a daemon: {:.3f}s (the budget applies with a daemon, '
+              'pass --daemon)'.format(first_query))
+    report_imports('the first query', runs[-1][1][1], args.top)
+
+    print('Over budget' if over_budget else 'Within budget')
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,72 @@
 import cv2
-import json
-import numpy as np
-from utils.retinaface import RetinaFace
-from utils.insightface import InsightFace
+from utils.embedding_store import load_gallery
+from utils.encode_pipeline import align_detections
+from utils.face_daemon import RemoteGallery, connect, load_models
 
-def find_FaceVector(vector, vector_dict):
+def find_FaceVector(vector, gallery):
     dist_thres = 1.0
-    min_image_names = []
-    for image_name in vector_dict.keys():
-        vector_list = vector_dict[image_name]
-        for v in vector_list:
-            v = np.array(v, dtype=np.float32)
-            distance = np.sum(np.square(vector - v))
-            if distance < dist_thres:
-                min_image_names.append(image_name)
+    hits = gallery.search_threshold(vector, dist_thres)
+    min_image_names = [image_name for image_name, _ in hits]
     return min_image_names
 
-# Load the vector dictionary
-with open('./DATA/Images.json', 'r') as f:
-    vector_dict = json.load(f)
+def load_searching(client=None):
+    """
+    Gallery and models of the face daemon behind client, or loaded in-process
+    (mxnet and the models are only imported here) when client is None
+    :return: gallery, detector, Recognizer
+    """
+    # Memory-map the embedding store (converted from Images.json on first use)
+    if client is not None and client.has_gallery:
+        gallery = RemoteGallery(client)
+    else:
+        gallery = load_gallery('./DATA/Images', json_path='./DATA/Images.json')
 
-# Load the image which is later used for searching
-img = cv2.imread('./TestImages/2.jpg')
+    # Load the face detection model and face recognition model
+    print('Loading Models...')
+    detector, Recognizer = load_models('./model/mnet.25/mnet.25', './model/insightface/insightface', 0, client)
+    print('Done!')
+    return gallery, detector, Recognizer
 
-# Load the face detection model and face recognition model
-print('Loading Models...')
-detector = RetinaFace('./model/mnet.25/mnet.25', 0, ctx_id=0)
-Recognizer = InsightFace('./model/insightface/insightface', 0, ctx_id=0)
-print('Done!')
+def search_image(img, gallery, detector, Recognizer):
+    """
+    :return: names of the gallery images matching the only face of img, None unless img has exactly 1 face
+    """
+    # Detect faces in the image
+    faces, landmarks = detector.detect(img, threshold=0.8)
 
-# Detect faces in the image
-faces, landmarks = detector.detect(img, threshold=0.8)
+    if len(faces) != 1:
+        return None
 
-if len(faces) == 1:
+    # Aligned like the faces of the gallery were when Encode_dir.py encoded them
+    aligned = align_detections(Recognizer, img, faces, landmarks)
+    img_vector = Recognizer.face_vertorizing_batch(aligned)[0]
 
-    face = faces[0].astype(np.int)
-    landmark = landmarks[0].astype(np.int)
+    return find_FaceVector(img_vector, gallery)
 
-    aligned = Recognizer.prepare_insight_input(face, landmark, img)
-    img_vector = Recognizer.face_vertorizing(aligned)
+if __name__ == '__main__':
 
-    min_image_names = find_FaceVector(img_vector, vector_dict)
+    # Models and gallery already loaded by `python -m utils.face_daemon serve`, if it is running
+    gallery, detector, Recognizer = load_searching(connect())
 
+    # Load the image which is later used for searching
+    img = cv2.imread('./TestImages/2.jpg')
 
+    min_image_names = search_image(img, gallery, detector, Recognizer)
 
-    cv2.namedWindow('This is the image you used for searching', 0)
-    cv2.imshow('This is the image you used for searching', img)
-    cv2.waitKey(0)
+    if min_image_names is not None:
 
-    cv2.namedWindow('Search results', 0)
-    for name in min_image_names:
-        result = cv2.imread('./DATA/Images/' + name)
-        cv2.imshow('Search results', result)
-        if cv2.waitKey(0) == ord('q'):
-            continue
+        cv2.namedWindow('This is the image you used for searching', 0)
+        cv2.imshow('This is the image you used for searching', img)
+        cv2.waitKey(0)
 
-    cv2.destroyAllWindows()
+        cv2.namedWindow('Search results', 0)
+        for name in min_image_names:
+            result = cv2.imread('./DATA/Images/' + name)
+            cv2.imshow('Search results', result)
+            if cv2.waitKey(0) == ord('q'):
+                continue
 
-else:
-    print('Please input an image with only 1 face.')
\ No newline at end of file
+        cv2.destroyAllWindows()
+
+    else:
+        print('Please input an image with only 1 face.')
@@ -1,10 +1,38 @@
 import numpy as np
-#from ..cython.bbox import bbox_overlaps_cython
+from . import kernels
 #from rcnn.config import config
 
 
 def bbox_overlaps(boxes, query_boxes):
-    return bbox_overlaps_py(boxes, query_boxes)#bbox_overlaps_cython(boxes, query_boxes)
+    return kernels.get('bbox_overlaps')(boxes, query_boxes)
+
+
+def bbox_overlaps_numpy(boxes, query_boxes):
+    """
+    Broadcast version of bbox_overlaps_py
+    :param boxes: n * 4 bounding boxes
+    :param query_boxes: k * 4 bounding boxes
+    :return: overlaps: n * k overlaps
+    """
+    boxes = boxes.astype(np.float64, copy=False)
+    query_boxes = query_boxes.astype(np.float64, copy=False)
+    query_areas = (query_boxes[:, 2] - query_boxes[:, 0] + 1) * (query_boxes[:, 3] - query_boxes[:, 1] + 1)
+    box_areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    iw = np.minimum(boxes[:, 2:3], query_boxes[:, 2]) - np.maximum(boxes[:, 0:1], query_boxes[:, 0]) + 1
+    ih = np.minimum(boxes[:, 3:4], query_boxes[:, 3]) - np.maximum(boxes[:, 1:2], query_boxes[:, 1]) + 1
+    np.maximum(iw, 0, out=iw)
+    np.maximum(ih, 0, out=ih)
+    inter = iw * ih
+    union = box_areas[:, np.newaxis] + query_areas[np.newaxis, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=inter > 0)
+
+
+def _load_bbox_overlaps_cython():
+    from ..cython.bbox import bbox_overlaps_cython
+
+    def _bbox_overlaps_cython(boxes, query_boxes):
+        return bbox_overlaps_cython(boxes.astype(np.float64, copy=False), query_boxes.astype(np.float64, copy=False))
+    return _bbox_overlaps_cython
 
 
 def bbox_overlaps_py(boxes, query_boxes):
@@ -16,7 +44,7 @@ def bbox_overlaps_py(boxes, query_boxes):
     """
     n_ = boxes.shape[0]
     k_ = query_boxes.shape[0]
-    overlaps = np.zeros((n_, k_), dtype=np.float)
+    overlaps = np.zeros((n_, k_), dtype=np.float64)
     for k in range(k_):
         query_box_area = (query_boxes[k, 2] - query_boxes[k, 0] + 1) * (query_boxes[k, 3] - query_boxes[k, 1] + 1)
         for n in range(n_):
@@ -30,6 +58,11 @@ def bbox_overlaps_py(boxes, query_boxes):
     return overlaps
 
 
+kernels.register('bbox_overlaps', 'python', bbox_overlaps_py)
+kernels.register('bbox_overlaps', 'numpy', bbox_overlaps_numpy)
+kernels.register_lazy('bbox_overlaps', 'cython', _load_bbox_overlaps_cython)
+
+
 def clip_boxes(boxes, im_shape):
     """
     Clip boxes to image boundaries.
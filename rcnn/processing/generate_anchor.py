@@ -5,12 +5,29 @@ from __future__ import print_function
 import sys
 from builtins import range
 import numpy as np
-#from ..cython.anchors import anchors_cython
+from . import kernels
 #from ..config import config
 
 
 def anchors_plane(feat_h, feat_w, stride, base_anchor):
-    return anchors_py(feat_h, feat_w, stride, base_anchor)#anchors_cython(feat_h, feat_w, stride, base_anchor)
+    return kernels.get('anchors_plane')(feat_h, feat_w, stride, base_anchor)
+
+def anchors_numpy(height, width, stride, base_anchors):
+    """
+    Broadcast version of anchors_py, same (height, width, A, 4) float32 output
+    """
+    base_anchors = base_anchors.astype(np.float32, copy=False)
+    shifts = np.zeros((height, width, 1, 4), dtype=np.float32)
+    shifts[:, :, 0, 0::2] = (np.arange(width, dtype=np.float32) * stride)[np.newaxis, :, np.newaxis]
+    shifts[:, :, 0, 1::2] = (np.arange(height, dtype=np.float32) * stride)[:, np.newaxis, np.newaxis]
+    return base_anchors[np.newaxis, np.newaxis, :, :] + shifts
+
+def _load_anchors_cython():
+    from ..cython.anchors import anchors_cython
+
+    def _anchors_cython(height, width, stride, base_anchors):
+        return anchors_cython(height, width, stride, base_anchors.astype(np.float32, copy=False))
+    return _anchors_cython
 
 def anchors_py(height, width, stride, base_anchors):
     """
@@ -41,6 +58,10 @@ def anchors_py(height, width, stride, base_anchors):
                 all_anchors[ih, iw, k, 3] = base_anchors[k, 3] + sh
     return all_anchors
 
+kernels.register('anchors_plane', 'python', anchors_py)
+kernels.register('anchors_plane', 'numpy', anchors_numpy)
+kernels.register_lazy('anchors_plane', 'cython', _load_anchors_cython)
+
 def generate_anchors(base_size=16, ratios=[0.5, 1, 2],
                      scales=2 ** np.arange(3, 6), stride=16, dense_anchor=False):
     """
@@ -0,0 +1,87 @@
+"""
+Backend registry for the box kernels (anchors_plane, bbox_overlaps)
+
+Every kernel has interchangeable implementations:
+    cython  the extensions in rcnn/cython, when they have been compiled
+    numpy   broadcast implementations
+    python  the original loops, kept as the reference
+The first available backend of BACKEND_ORDER is selected on first use. The
+RCNN_KERNEL_BACKEND environment variable, or use_backend() at runtime,
+overrides the choice for one kernel or all of them.
+
+Compiled backends are registered with register_lazy: their extension is
+only imported the first time the backends of the kernel are looked at, so
+importing the processing modules does not probe for them.
+"""
+import os
+
+BACKEND_ORDER = ('cython', 'numpy', 'python')
+
+_registry = {}
+_loaders = {}
+_active = {}
+
+
+def register(kernel, backend, func):
+    _registry.setdefault(kernel, {})[backend] = func
+
+
+def register_lazy(kernel, backend, loader):
+    """
+    :param loader: returns the implementation, raises ImportError if it is not available
+    """
+    _registry.setdefault(kernel, {})
+    _loaders.setdefault(kernel, {})[backend] = loader
+
+
+def _load(kernel):
+    for backend, loader in _loaders.pop(kernel, {}).items():
+        try:
+            register(kernel, backend, loader())
+        except ImportError:
+            pass
+
+
+def available_backends(kernel):
+    _load(kernel)
+    return [backend for backend in BACKEND_ORDER if backend in _registry[kernel]]
+
+
+def _select(kernel, backend):
+    _load(kernel)
+    if backend is None:
+        backend = os.environ.get('RCNN_KERNEL_BACKEND')
+        if backend is not None and backend not in _registry[kernel]:
+            backend = None
+    if backend is None:
+        backend = available_backends(kernel)[0]
+    if backend not in _registry[kernel]:
+        raise ValueError('Backend {} is not available for {}, choose from {}'.format(
+            backend, kernel, available_backends(kernel)))
+    return backend
+
+
+def use_backend(backend=None, kernel=None):
+    """
+    :param backend: backend name, None for the automatic choice
+    :param kernel: kernel name, None for every kernel offering the backend
+    """
+    kernels = [kernel] if kernel is not None else list(_registry)
+    for k in kernels:
+        _load(k)
+        if kernel is None and backend is not None and backend not in _registry[k]:
+            continue
+        _active[k] = _select(k, backend)
+
+
+def active_backend(kernel):
+    if kernel not in _active:
+        _active[kernel] = _select(kernel, None)
+    return _active[kernel]
+
+
+def get(kernel, backend=None):
+    _load(kernel)
+    if backend is None:
+        backend = active_backend(kernel)
+    return _registry[kernel][backend]
@@ -1,12 +1,5 @@
 import numpy as np
-try:
-    from ..cython.cpu_nms import cpu_nms
-except ImportError:
-    cpu_nms = None
-try:
-    from ..cython.gpu_nms import gpu_nms
-except ImportError:
-    gpu_nms = None
+from . import kernels
 
 
 def py_nms_wrapper(thresh):
@@ -16,23 +9,25 @@ def py_nms_wrapper(thresh):
 
 
 def cpu_nms_wrapper(thresh):
+    """
+    NMS with the active 'nms' kernel backend: the compiled cpu_nms when it
+    was built, the blocked NumPy nms_numpy otherwise
+    """
     def _nms(dets):
-        return cpu_nms(dets, thresh)
-    if cpu_nms is not None:
-        return _nms
-    else:
-        return py_nms_wrapper(thresh)
+        return kernels.get('nms')(dets, thresh)
+    return _nms
 
 
 def gpu_nms_wrapper(thresh, device_id):
+    # Imported here: loading the CUDA extension is slow and only GPU detectors need it
+    try:
+        from ..cython.gpu_nms import gpu_nms
+    except ImportError:
+        return cpu_nms_wrapper(thresh)
+
     def _nms(dets):
         return gpu_nms(dets, thresh, device_id)
-    if gpu_nms is not None:
-        return _nms
-    elif cpu_nms is not None:
-        return cpu_nms_wrapper(thresh)
-    else:
-        return py_nms_wrapper(thresh)
+    return _nms
 
 
 def nms(dets, thresh):
@@ -70,3 +65,129 @@ def nms(dets, thresh):
         order = order[inds + 1]
 
     return keep
+
+
+def nms_numpy(dets, thresh, tile=64):
+    """
+    Blocked version of nms with the same result. The score-ordered boxes are
+    processed tile by tile: the overlaps of the surviving boxes of a tile with
+    every surviving lower scoring box are computed at once as a suppression
+    mask, the greedy pass only runs within the tile, and the masks of the
+    boxes it kept are then OR-ed into the suppression of all later boxes together.
+    :param dets: [[x1, y1, x2, y2 score]]
+    :param thresh: retain overlap <= thresh
+    :param tile: boxes per tile, a mask takes at most tile * len(dets) bytes
+    :return: indexes to keep
+    """
+    scores = dets[:, 4]
+    order = scores.argsort()[::-1]
+    x1 = dets[order, 0]
+    y1 = dets[order, 1]
+    x2 = dets[order, 2]
+    y2 = dets[order, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    n = order.shape[0]
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for start in range(0, n, tile):
+        # Surviving boxes from the tile on; the first num_rows of them are the tile's
+        cols = np.flatnonzero(~suppressed[start:]) + start
+        num_rows = np.searchsorted(cols, start + tile)
+        if num_rows == 0:
+            continue
+        rows = cols[:num_rows]
+        xx1 = np.maximum(x1[rows, np.newaxis], x1[cols])
+        yy1 = np.maximum(y1[rows, np.newaxis], y1[cols])
+        xx2 = np.minimum(x2[rows, np.newaxis], x2[cols])
+        yy2 = np.minimum(y2[rows, np.newaxis], y2[cols])
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        # Not <= rather than >, so that, as in nms, a NaN overlap of two zero-area boxes suppresses
+        mask = ~(inter / (areas[rows, np.newaxis] + areas[cols] - inter) <= thresh)
+
+        # Greedy pass within the tile
+        tile_suppressed = np.zeros(num_rows, dtype=bool)
+        kept = []
+        for r in range(num_rows):
+            if tile_suppressed[r]:
+                continue
+            kept.append(r)
+            tile_suppressed |= mask[r, :num_rows]
+        keep.extend(rows[kept])
+        suppressed[cols[num_rows:]] |= mask[kept, num_rows:].any(axis=0)
+
+    return order[keep].tolist()
+
+
+def soft_nms(dets, sigma=0.5, thresh=0.3, score_thresh=0.001, method='linear'):
+    """
+    Soft-NMS (Bodla et al., 2017): instead of dropping the boxes overlapping a
+    kept box, their scores are decayed, linearly by (1 - overlap) above thresh
+    or by exp(-overlap^2 / sigma) for method='gaussian'. Boxes whose score
+    falls below score_thresh are dropped.
+    :param dets: [[x1, y1, x2, y2 score]]
+    :return: indexes to keep, in the order they were kept, and their decayed scores
+    """
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    x2 = dets[:, 2]
+    y2 = dets[:, 3]
+    scores = dets[:, 4].astype(np.float32, copy=True)
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    candidates = np.flatnonzero(scores >= score_thresh)
+    keep = []
+    keep_scores = []
+    while candidates.shape[0] > 0:
+        top = np.argmax(scores[candidates])
+        i = candidates[top]
+        keep.append(i)
+        keep_scores.append(scores[i])
+        candidates = np.delete(candidates, top)
+
+        xx1 = np.maximum(x1[i], x1[candidates])
+        yy1 = np.maximum(y1[i], y1[candidates])
+        xx2 = np.minimum(x2[i], x2[candidates])
+        yy2 = np.minimum(y2[i], y2[candidates])
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[candidates] - inter)
+
+        if method == 'gaussian':
+            decay = np.exp(-(ovr * ovr) / sigma)
+        else:
+            decay = np.where(ovr > thresh, 1.0 - ovr, 1.0)
+        scores[candidates] *= decay
+        candidates = candidates[scores[candidates] >= score_thresh]
+
+    return keep, np.array(keep_scores, dtype=np.float32)
+
+
+def batched_nms(dets, group_ids, thresh):
+    """
+    Independent NMS for every group of boxes (e.g. the images of a batch) in
+    a single blocked NMS call: every group is shifted to its own region of
+    the plane, so boxes of different groups never overlap.
+    :param dets: [[x1, y1, x2, y2 score]]
+    :param group_ids: [N] integer group of every box
+    :return: indexes to keep
+    """
+    if dets.shape[0] == 0:
+        return []
+    offsets = group_ids.astype(dets.dtype) * (dets[:, 0:4].max() - dets[:, 0:4].min() + 2)
+    shifted = dets.copy()
+    shifted[:, 0:4] += offsets[:, np.newaxis]
+    return nms_numpy(shifted, thresh)
+
+
+def _load_cpu_nms():
+    from ..cython.cpu_nms import cpu_nms
+    return cpu_nms
+
+
+kernels.register('nms', 'python', nms)
+kernels.register('nms', 'numpy', nms_numpy)
+kernels.register_lazy('nms', 'cython', _load_cpu_nms)
@@ -0,0 +1,30 @@
+import argparse
+from utils.retinaface import RetinaFace
+from utils.insightface import InsightFace
+from utils.embedding_store import load_gallery
+from utils.search_server import SearchService, serve
+
+parser = argparse.ArgumentParser(description='Serve face searches over HTTP, e.g. '
+                                             'curl --data-binary @./TestImages/2.jpg http://127.0.0.1:8080/search')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=8080)
+parser.add_argument('--gallery', default='./DATA/Images', help='embedding store prefix')
+parser.add_argument('--gpuid', type=int, default=0)
+parser.add_argument('--threshold', type=float, default=0.8)
+parser.add_argument('--dist-thres', type=float, default=1.0)
+parser.add_argument('--max-batch', type=int, default=16, help='requests coalesced into one model batch')
+parser.add_argument('--max-wait-ms', type=float, default=5.0, help='how long a batch waits for more requests')
+args = parser.parse_args()
+
+# Memory-map the embedding store (converted from Images.json on first use)
+gallery = load_gallery(args.gallery, json_path=args.gallery + '.json')
+
+# Load the face detection model and face recognition model
+print('Loading Models...')
+detector = RetinaFace('./model/mnet.25/mnet.25', 0, ctx_id=args.gpuid, max_batch_size=args.max_batch)
+Recognizer = InsightFace('./model/insightface/insightface', 0, ctx_id=args.gpuid, max_batch_size=32)
+print('Done!')
+
+service = SearchService(detector, Recognizer, gallery, threshold=args.threshold, dist_thres=args.dist_thres,
+                        max_batch_size=args.max_batch, max_wait=args.max_wait_ms / 1000.0)
+serve(service, args.host, args.port)
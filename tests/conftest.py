@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The repository root, so the tests import utils and rcnn like the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,166 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from utils.embedding_store import (StoreWriter, json_2_store, load_gallery, merge_stores, open_store,
+                                   read_meta, remove_images, store_exists, store_paths)
+
+DIM = 8
+
+
+def image_vectors(i, n):
+    # Distinct, recognizable rows: image i, face j holds i + j / 10
+    return np.full((n, DIM), i, dtype=np.float32) + np.arange(n, dtype=np.float32)[:, np.newaxis] / 10
+
+
+def write_store(prefix, counts, start=0, append=False):
+    with StoreWriter(prefix, DIM, append=append) as writer:
+        for i, n in enumerate(counts, start):
+            writer.append('image{}.jpg'.format(i), image_vectors(i, n))
+    return writer
+
+
+def check_store(prefix, images):
+    """
+    :param images: [(index, num_faces)] the store must hold, in order
+    """
+    gallery = open_store(prefix)
+    assert gallery.names == ['image{}.jpg'.format(i) for i, _ in images]
+    assert len(gallery.offsets) == len(images) + 1
+    for k, (i, n) in enumerate(images):
+        rows = gallery.matrix[gallery.offsets[k]:gallery.offsets[k + 1]]
+        assert np.array_equal(rows, image_vectors(i, n))
+    return gallery
+
+
+def test_round_trip(tmp_path):
+    prefix = str(tmp_path / 'store')
+    counts = [2, 0, 3, 1]
+    writer = write_store(prefix, counts)
+    assert (writer.num_images, writer.num_rows) == (4, 6)
+    assert store_exists(prefix)
+    assert read_meta(prefix) == {'version': 1, 'dim': DIM, 'rows': 6, 'images': 4}
+    gallery = check_store(prefix, list(enumerate(counts)))
+    assert gallery.matrix.shape == (6, DIM)
+
+
+def test_empty_store(tmp_path):
+    prefix = str(tmp_path / 'store')
+    write_store(prefix, [])
+    gallery = open_store(prefix)
+    assert gallery.names == [] and gallery.matrix.shape == (0, DIM)
+
+
+def test_interrupted_append_is_dropped_and_resumed(tmp_path):
+    prefix = str(tmp_path / 'store')
+    write_store(prefix, [2, 1])
+    sizes = {key: os.path.getsize(path) for key, path in store_paths(prefix).items()}
+
+    with pytest.raises(RuntimeError):
+        with StoreWriter(prefix, DIM, append=True) as writer:
+            writer.append('image2.jpg', image_vectors(2, 4))
+            writer.commit()
+            writer.append('image3.jpg', image_vectors(3, 2))
+            writer.append('image4.jpg', image_vectors(4, 1))
+            for f in (writer._vectors, writer._offsets, writer._names):
+                f.flush()
+            raise RuntimeError('interrupted')
+    # Only the committed image made it, the files hold more than the meta describes
+    check_store(prefix, [(0, 2), (1, 1), (2, 4)])
+    assert os.path.getsize(store_paths(prefix)['vectors']) > sizes['vectors'] + 4 * DIM * 4
+
+    # Resuming truncates the uncommitted tail before appending
+    write_store(prefix, [5, 0], start=3, append=True)
+    check_store(prefix, [(0, 2), (1, 1), (2, 4), (3, 5), (4, 0)])
+    assert os.path.getsize(store_paths(prefix)['vectors']) == 12 * DIM * 4
+
+
+def test_writer_without_commit_leaves_no_store(tmp_path):
+    prefix = str(tmp_path / 'store')
+    with pytest.raises(RuntimeError):
+        with StoreWriter(prefix, DIM) as writer:
+            writer.append('image0.jpg', image_vectors(0, 1))
+            raise RuntimeError('interrupted')
+    assert not store_exists(prefix)
+
+
+def test_rewrite_replaces_store(tmp_path):
+    prefix = str(tmp_path / 'store')
+    write_store(prefix, [2, 2])
+    write_store(prefix, [1])
+    check_store(prefix, [(0, 1)])
+
+
+def test_remove_images_keeps_order(tmp_path):
+    prefix = str(tmp_path / 'store')
+    write_store(prefix, [2, 0, 3, 1, 2])
+    assert remove_images(prefix, ['image1.jpg', 'image3.jpg', 'missing.jpg']) == (3, 7)
+    check_store(prefix, [(0, 2), (2, 3), (4, 2)])
+    assert not store_exists(prefix + '.tmp')
+
+    # The rewritten store can still be appended to
+    write_store(prefix, [1], start=5, append=True)
+    check_store(prefix, [(0, 2), (2, 3), (4, 2), (5, 1)])
+
+
+def test_merge_stores(tmp_path):
+    a, b, out = (str(tmp_path / name) for name in ('a', 'b', 'out'))
+    write_store(a, [1, 2])
+    write_store(b, [0, 3], start=2)
+    assert merge_stores([a, b], out) == (4, 6)
+    check_store(out, [(0, 1), (1, 2), (2, 0), (3, 3)])
+
+
+def test_merge_stores_rejects_mixed_dimensions(tmp_path):
+    a, b = str(tmp_path / 'a'), str(tmp_path / 'b')
+    write_store(a, [1])
+    with StoreWriter(b, DIM + 1) as writer:
+        writer.append('x.jpg', np.zeros((1, DIM + 1)))
+    with pytest.raises(ValueError):
+        merge_stores([a, b], str(tmp_path / 'out'))
+
+
+def test_append_rejects_other_dimension(tmp_path):
+    prefix = str(tmp_path / 'store')
+    write_store(prefix, [1])
+    with pytest.raises(ValueError):
+        StoreWriter(prefix, DIM * 2, append=True)
+
+
+def test_unsupported_version(tmp_path):
+    prefix = str(tmp_path / 'store')
+    write_store(prefix, [1])
+    meta = read_meta(prefix)
+    meta['version'] = 99
+    with open(store_paths(prefix)['meta'], 'w') as f:
+        json.dump(meta, f)
+    with pytest.raises(ValueError):
+        open_store(prefix)
+
+
+def test_name_with_newline(tmp_path):
+    with StoreWriter(str(tmp_path / 'store'), DIM) as writer:
+        with pytest.raises(ValueError):
+            writer.append('bad\nname.jpg', image_vectors(0, 1))
+
+
+def test_json_2_store_and_load_gallery(tmp_path):
+    # load_gallery converts at the default 512 dimensions of InsightFace
+    rng = np.random.RandomState(0)
+    vector_dict = {'image{}.jpg'.format(i): rng.rand(n, 512).astype(np.float32).tolist()
+                   for i, n in enumerate([1, 0, 2])}
+    json_path = str(tmp_path / 'Images.json')
+    with open(json_path, 'w') as f:
+        json.dump(vector_dict, f)
+
+    prefix = str(tmp_path / 'Images')
+    with pytest.raises(IOError):
+        load_gallery(prefix)
+    gallery = load_gallery(prefix, json_path=json_path)
+    assert gallery.names == list(vector_dict)
+    assert list(gallery.offsets) == [0, 1, 1, 3]
+    assert np.array_equal(gallery.matrix, np.array(vector_dict['image0.jpg'] + vector_dict['image2.jpg'],
+                                                   dtype=np.float32))
+    assert json_2_store(json_path, str(tmp_path / 'other')) == (3, 3)
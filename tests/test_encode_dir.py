@@ -0,0 +1,162 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from utils import Encode_dir
+from utils.embedding_store import StoreWriter, open_store
+
+
+class FakeDetector:
+    """Finds value % 3 faces in an image filled with value"""
+
+    def __init__(self):
+        self.images = []
+
+    def detect(self, image, thresh):
+        value = int(image[0, 0, 0])
+        self.images.append(value)
+        n = value % 3
+        faces = np.tile([[0, 0, 10, 10, 0.9]], (n, 1)).astype(np.float32)
+        landmarks = np.full((n, 5, 2), value, dtype=np.float32)
+        landmarks[:, :, 1] = np.arange(n)[:, np.newaxis]
+        return faces, landmarks
+
+
+class FakeRecognizer:
+    """Embeds face j of an image filled with value as a 512-d vector holding value + j / 10"""
+
+    def prepare_insight_input_batch(self, landmarks, image):
+        return [landmark[0].astype(np.float32) for landmark in landmarks]
+
+    def face_vertorizing_batch(self, aligned):
+        values = np.array([a[0] + a[1] / 10.0 for a in aligned], dtype=np.float32).reshape((-1, 1))
+        return np.repeat(values, 512, axis=1)
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    detector = FakeDetector()
+    monkeypatch.setattr(Encode_dir, 'load_models', lambda *args, **kwargs: (detector, FakeRecognizer()))
+    return detector
+
+
+def write_image(image_dir, name, value, mtime=1000000):
+    path = os.path.join(image_dir, name)
+    cv2.imwrite(path, np.full((8, 8, 3), value, dtype=np.uint8))
+    os.utime(path, (mtime, mtime))
+
+
+def encode(image_dir, prefix, **kwargs):
+    return Encode_dir.images_2_store(image_dir, prefix, batch_size=4, workers=0, use_daemon=False, **kwargs)
+
+
+def stored(prefix):
+    """
+    :return: {name: first embedding value of every face}
+    """
+    gallery = open_store(prefix)
+    assert len(set(gallery.names)) == len(gallery.names), 'duplicate images in the store'
+    return {name: [round(float(v), 3) for v in gallery.matrix[gallery.offsets[i]:gallery.offsets[i + 1], 0]]
+            for i, name in enumerate(gallery.names)}
+
+
+def manifest(prefix):
+    with open(prefix + '.manifest.json') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    image_dir = str(tmp_path / 'images')
+    os.mkdir(image_dir)
+    for name, value in [('a.png', 10), ('b.png', 11), ('c.png', 12), ('d.png', 13)]:
+        write_image(image_dir, name, value)
+    return image_dir
+
+
+def test_first_run_then_up_to_date(image_dir, tmp_path, encoder):
+    prefix = str(tmp_path / 'store')
+    num_images, _ = encode(image_dir, prefix)
+    assert num_images == 4
+    assert stored(prefix) == {'a.png': [10.0], 'b.png': [11.0, 11.1], 'c.png': [], 'd.png': [13.0]}
+    assert sorted(manifest(prefix)) == ['a.png', 'b.png', 'c.png', 'd.png']
+
+    encoder.images[:] = []
+    assert encode(image_dir, prefix) == (0, 0.0)
+    assert encoder.images == []
+
+
+def test_touched_file_with_same_content_is_not_reencoded(image_dir, tmp_path, encoder, monkeypatch):
+    prefix = str(tmp_path / 'store')
+    encode(image_dir, prefix)
+    before = manifest(prefix)['b.png']
+    os.utime(os.path.join(image_dir, 'b.png'), (2000000, 2000000))
+
+    encoder.images[:] = []
+    assert encode(image_dir, prefix) == (0, 0.0)
+    assert encoder.images == []
+    after = manifest(prefix)['b.png']
+    assert after['mtime'] == 2000000 and after['sha1'] == before['sha1']
+
+    # The size and mtime shortcut now holds again, without hashing
+    calls = []
+    file_digest = Encode_dir.file_digest
+    monkeypatch.setattr(Encode_dir, 'file_digest', lambda path: calls.append(path) or file_digest(path))
+    encode(image_dir, prefix)
+    assert calls == []
+
+
+def test_changed_and_deleted_images(image_dir, tmp_path, encoder):
+    prefix = str(tmp_path / 'store')
+    encode(image_dir, prefix)
+    write_image(image_dir, 'b.png', 20, mtime=2000000)
+    os.remove(os.path.join(image_dir, 'c.png'))
+    write_image(image_dir, 'e.png', 14)
+
+    encoder.images[:] = []
+    num_images, _ = encode(image_dir, prefix)
+    assert num_images == 2
+    assert sorted(encoder.images) == [14, 20]
+    # b is removed and appended again after the untouched images, with its new faces
+    assert list(stored(prefix).items()) == [('a.png', [10.0]), ('d.png', [13.0]),
+                                            ('e.png', [14.0, 14.1]), ('b.png', [20.0, 20.1])]
+    assert sorted(manifest(prefix)) == ['a.png', 'b.png', 'd.png', 'e.png']
+    assert manifest(prefix)['b.png']['mtime'] == 2000000
+
+
+def test_stored_images_without_manifest_are_adopted(image_dir, tmp_path, encoder):
+    # A store converted from Images.json has no manifest
+    prefix = str(tmp_path / 'store')
+    with StoreWriter(prefix, 512) as writer:
+        writer.append('a.png', np.full((1, 512), 10.0))
+        writer.append('b.png', np.full((1, 512), 11.0))
+
+    num_images, _ = encode(image_dir, prefix)
+    assert num_images == 2
+    assert sorted(encoder.images) == [12, 13]
+    assert list(stored(prefix)) == ['a.png', 'b.png', 'c.png', 'd.png']
+    assert stored(prefix)['b.png'] == [11.0]
+    assert sorted(manifest(prefix)) == ['a.png', 'b.png', 'c.png', 'd.png']
+
+
+def test_stale_manifest_entries_are_dropped(image_dir, tmp_path, encoder):
+    prefix = str(tmp_path / 'store')
+    encode(image_dir, prefix)
+    entries = manifest(prefix)
+    # Entry of an image that never reached the store, e.g. from an interrupted run
+    entries['ghost.png'] = dict(entries['a.png'], path=os.path.join(image_dir, 'ghost.png'))
+    with open(prefix + '.manifest.json', 'w') as f:
+        json.dump(entries, f)
+
+    assert encode(image_dir, prefix) == (0, 0.0)
+    assert 'ghost.png' not in manifest(prefix)
+
+
+def test_subset_of_the_directory(image_dir, tmp_path, encoder):
+    prefix = str(tmp_path / 'store')
+    encode(image_dir, prefix, image_names=['a.png', 'd.png'])
+    assert list(stored(prefix)) == ['a.png', 'd.png']
@@ -0,0 +1,128 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from utils import encode_pipeline
+from utils.encode_pipeline import FaceBatcher
+
+
+class FakeRecognizer:
+    """Embeds a face, here just a number, as a 1-d vector holding it"""
+
+    def __init__(self):
+        self.batches = []
+
+    def face_vertorizing_batch(self, faces):
+        self.batches.append(list(faces))
+        return np.array(faces, dtype=np.float32).reshape(-1, 1)
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.images = []
+
+    def append(self, image_name, vectors):
+        self.images.append((image_name, [float(v[0]) for v in vectors]))
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(encode_pipeline.time, 'time', clock)
+    return clock
+
+
+def test_faces_reach_their_images_across_batches(clock):
+    Recognizer, writer = FakeRecognizer(), FakeWriter()
+    done = []
+    counts = [3, 0, 5, 1, 4, 2, 0, 7]
+    expected, face = [], 0
+    with FaceBatcher(Recognizer, writer, batch_size=4, max_latency=10.0, on_image_done=done.append) as batcher:
+        for i, n in enumerate(counts):
+            faces = list(range(face, face + n))
+            face += n
+            expected.append(('image{}'.format(i), [float(f) for f in faces]))
+            batcher.add_image('image{}'.format(i), faces)
+
+    assert writer.images == expected
+    assert done == [name for name, _ in expected]
+    assert batcher.num_faces == sum(counts)
+    assert [len(batch) for batch in Recognizer.batches] == [4, 4, 4, 4, 4, 2]
+
+
+def test_images_complete_in_order(clock):
+    writer = FakeWriter()
+    batcher = FaceBatcher(FakeRecognizer(), writer, batch_size=4, max_latency=10.0)
+    batcher.add_image('a', [0, 1, 2])
+    batcher.add_image('b', [])
+    # b has no faces but is held back until a is complete
+    assert writer.images == []
+    batcher.add_image('c', [3, 4])
+    assert writer.images == [('a', [0.0, 1.0, 2.0]), ('b', [])]
+    batcher.flush()
+    assert writer.images[-1] == ('c', [3.0, 4.0])
+
+
+def test_latency_counts_from_the_oldest_pending_face(clock):
+    Recognizer = FakeRecognizer()
+    batcher = FaceBatcher(Recognizer, FakeWriter(), batch_size=4, max_latency=2.0)
+    batcher.add_image('a', [0, 1, 2])
+    clock.now += 1.5
+    # Fills a batch with a's faces and the first of b's, the second of b's arrived at +1.5
+    batcher.add_image('b', [3, 4])
+    assert [len(batch) for batch in Recognizer.batches] == [4]
+
+    clock.now += 1.0
+    batcher.poll()
+    assert len(Recognizer.batches) == 1
+    clock.now += 1.0
+    batcher.poll()
+    assert [len(batch) for batch in Recognizer.batches] == [4, 1]
+
+
+def test_latency_of_a_full_batch_leftover(clock):
+    Recognizer = FakeRecognizer()
+    batcher = FaceBatcher(Recognizer, FakeWriter(), batch_size=2, max_latency=2.0)
+    batcher.add_image('a', [0])
+    clock.now += 1.9
+    # The leftover face 2 arrived now, but face 0 ran in the full batch
+    batcher.add_image('b', [1, 2])
+    clock.now += 0.5
+    batcher.poll()
+    assert len(Recognizer.batches) == 1
+    clock.now += 1.5
+    batcher.poll()
+    assert [len(batch) for batch in Recognizer.batches] == [2, 1]
+
+
+class FakeDetector:
+
+    def detect(self, image, thresh):
+        return np.zeros((0, 5)), np.zeros((0, 5, 2))
+
+
+def test_iter_aligned_polls_while_decoding_is_slow(monkeypatch):
+    def slow_imread(path):
+        time.sleep(0.2)
+        return np.zeros((8, 8, 3), dtype=np.uint8)
+
+    monkeypatch.setattr(encode_pipeline.cv2, 'imread', slow_imread)
+    idle = []
+    names = ['a.jpg', 'b.jpg']
+    out = list(encode_pipeline.iter_aligned('.', names, FakeDetector(), None, 0.8, workers=1,
+                                            on_idle=lambda: idle.append(1), idle_timeout=0.02))
+    assert out == [('a.jpg', []), ('b.jpg', [])]
+    assert len(idle) >= 5
@@ -0,0 +1,83 @@
+import os
+import stat
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils import face_daemon
+from utils.embedding_store import StoreWriter, remove_images
+from utils.face_daemon import OP_PING, OP_SEARCH, FaceDaemon, connect, pack_arrays, unpack_arrays, unpack_matches
+
+DIM = 8
+
+
+def write_images(prefix, names, append=False):
+    # Image i is the unit vector along axis i
+    with StoreWriter(prefix, DIM, append=append) as writer:
+        for i in names:
+            writer.append('image{}.jpg'.format(i), np.eye(DIM, dtype=np.float32)[i:i + 1])
+
+
+def search(daemon, *axes):
+    vectors = np.eye(DIM, dtype=np.float32)[list(axes)]
+    payload = daemon.handle(OP_SEARCH, unpack_arrays(pack_arrays(vectors, np.array(0.5, dtype=np.float32))))
+    return [[name for name, _ in matches] for matches in unpack_matches(unpack_arrays(payload))]
+
+
+def test_search_follows_the_store(tmp_path):
+    prefix = str(tmp_path / 'Images')
+    write_images(prefix, [0, 1, 2])
+    daemon = FaceDaemon(None, None, gallery_prefix=prefix)
+    assert unpack_arrays(daemon.handle(OP_PING, []))[0].tolist() == [1]
+    assert search(daemon, 1, 3) == [['image1.jpg'], []]
+
+    # Appended by a later run of Encode_dir.py
+    write_images(prefix, [3], append=True)
+    assert search(daemon, 1, 3) == [['image1.jpg'], ['image3.jpg']]
+
+    # Rows after a removed image shift, the daemon must not answer from the old rows
+    remove_images(prefix, ['image1.jpg'])
+    assert search(daemon, 1, 2, 3) == [[], ['image2.jpg'], ['image3.jpg']]
+    gallery = daemon.current_gallery()
+    assert daemon.current_gallery() is gallery
+
+
+def test_search_while_the_store_is_rewritten(tmp_path):
+    prefix = str(tmp_path / 'Images')
+    write_images(prefix, [0])
+    daemon = FaceDaemon(None, None, gallery_prefix=prefix)
+    writer = StoreWriter(prefix, DIM)
+    with pytest.raises(ValueError):
+        search(daemon, 0)
+    writer.append('image5.jpg', np.eye(DIM, dtype=np.float32)[5:6])
+    writer.close()
+    assert search(daemon, 0, 5) == [[], ['image5.jpg']]
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='needs Unix sockets')
+def test_socket_is_private(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_daemon, 'load_models', lambda *args: (None, None))
+    socket_path = str(tmp_path / 'daemon.sock')
+    thread = threading.Thread(target=face_daemon.serve, args=(socket_path,), daemon=True)
+    thread.start()
+    for _ in range(200):
+        client = connect(socket_path)
+        if client is not None:
+            break
+        time.sleep(0.01)
+    assert client is not None and not client.has_gallery
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    client.shutdown()
+    client.close()
+    thread.join(5)
+    assert not os.path.exists(socket_path)
+
+
+def test_default_socket_is_per_user(monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1000')
+    assert face_daemon._default_socket() == '/run/user/1000/face_searching.sock'
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    if hasattr(os, 'getuid'):
+        assert face_daemon._default_socket().endswith('face_searching-{}.sock'.format(os.getuid()))
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from utils import face_preprocess
+from utils.face_preprocess import align_batch, landmark_template, similarity_transform, similarity_transform_batch
+
+
+def random_landmarks(rng, n, width=640, height=480, noise=2.0):
+    template = landmark_template()
+    angle = rng.uniform(-0.6, 0.6, n)
+    scale = rng.uniform(0.3, 3.0, n)
+    cos, sin = np.cos(angle) * scale, np.sin(angle) * scale
+    R = np.stack([np.stack([cos, -sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=1)
+    points = np.einsum('bij,nj->bni', R, template - template.mean(axis=0))
+    centres = np.stack([rng.uniform(0, width, n), rng.uniform(0, height, n)], axis=-1)
+    return points + centres[:, np.newaxis, :] + rng.normal(0, noise, (n, 5, 2))
+
+
+def loop_transforms(landmarks, template):
+    return np.array([similarity_transform(landmark, template)[0:2, :] for landmark in landmarks])
+
+
+def special_cases():
+    rng = np.random.RandomState(1)
+    template = landmark_template().astype(np.float64)
+    # Rank 0: every landmark at the same point
+    coincident = np.full((5, 2), 37.0)
+    # Rank 1: landmarks on a line, in both directions
+    line = np.outer(np.array([0.0, 1.0, 2.0, 3.0, 5.0]), [3.0, 1.0]) + [10.0, 20.0]
+    reversed_line = line[::-1].copy()
+    # Mirrored: the template flipped left to right, det(A) < 0
+    mirrored = template * [-1.0, 1.0] + [200.0, 0.0]
+    mirrored_noisy = mirrored + rng.normal(0, 1.0, (5, 2))
+    # Exact similarity of the template
+    exact = template * 1.7 + [15.0, -4.0]
+    return {'coincident': coincident, 'line': line, 'reversed_line': reversed_line,
+            'mirrored': mirrored, 'mirrored_noisy': mirrored_noisy, 'exact': exact}
+
+
+def test_batch_matches_loop_on_random_landmarks():
+    rng = np.random.RandomState(0)
+    landmarks = random_landmarks(rng, 500).astype(np.int64).astype(np.float32)
+    template = landmark_template()
+    batched = similarity_transform_batch(landmarks, template)
+    assert batched.shape == (500, 2, 3)
+    assert np.allclose(batched, loop_transforms(landmarks, template), rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize('case', sorted(special_cases()))
+def test_batch_matches_loop_on_special_cases(case):
+    landmarks = special_cases()[case][np.newaxis]
+    template = landmark_template()
+    batched = similarity_transform_batch(landmarks, template)
+    expected = loop_transforms(landmarks, template)
+    assert np.allclose(batched, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_special_cases_in_one_batch():
+    # Every row is solved on its own, whatever the other rows of the batch are
+    cases = special_cases()
+    landmarks = np.stack([cases[name] for name in sorted(cases)] + list(random_landmarks(np.random.RandomState(2), 3)))
+    template = landmark_template()
+    batched = similarity_transform_batch(landmarks, template)
+    assert np.allclose(batched, loop_transforms(landmarks, template), rtol=1e-9, atol=1e-9, equal_nan=True)
+
+    names = sorted(cases)
+    assert np.isnan(batched[names.index('coincident')]).all()
+    assert not np.isnan(batched[[i for i, name in enumerate(names) if name != 'coincident']]).any()
+
+
+def test_exact_similarity_is_recovered():
+    template = landmark_template().astype(np.float64)
+    M = similarity_transform_batch(special_cases()['exact'][np.newaxis], template)[0]
+    assert np.allclose(M, [[1 / 1.7, 0, -15.0 / 1.7], [0, 1 / 1.7, 4.0 / 1.7]], atol=1e-9)
+
+
+def test_mirrored_is_not_reflected():
+    # A similarity transform cannot flip, the rotation part keeps a positive determinant
+    M = similarity_transform_batch(special_cases()['mirrored_noisy'][np.newaxis], landmark_template())[0]
+    assert np.linalg.det(M[:, :2]) > 0
+
+
+def test_matches_skimage():
+    transform = pytest.importorskip('skimage.transform')
+    rng = np.random.RandomState(3)
+    landmarks = random_landmarks(rng, 20).astype(np.float32)
+    template = landmark_template()
+    expected = []
+    for landmark in landmarks:
+        tform = transform.SimilarityTransform()
+        tform.estimate(landmark, template)
+        expected.append(tform.params[0:2, :])
+    assert np.allclose(similarity_transform_batch(landmarks, template), expected, atol=1e-6)
+
+
+def test_align_batch_matches_preprocess():
+    rng = np.random.RandomState(4)
+    img = rng.randint(0, 256, (480, 640, 3)).astype(np.uint8)
+    landmarks = random_landmarks(rng, 50).astype(np.int64)
+    crops = align_batch(img, landmarks)
+    assert crops.shape == (50, 112, 112, 3) and crops.dtype == np.uint8
+    for crop, landmark in zip(crops, landmarks):
+        expected = face_preprocess.preprocess(img, None, landmark, image_size='112,112')
+        assert np.abs(crop.astype(np.int16) - expected.astype(np.int16)).max() <= 1
+
+    # One image per face, written into a caller's buffer
+    images = [img, img[::-1].copy()] * 25
+    out = np.zeros_like(crops)
+    assert align_batch(images, landmarks, out=out) is out
+    assert np.array_equal(out[0::2], crops[0::2])
+    expected = face_preprocess.preprocess(images[1], None, landmarks[1], image_size='112,112')
+    assert np.abs(out[1].astype(np.int16) - expected.astype(np.int16)).max() <= 1
+
+
+def test_align_batch_empty():
+    img = np.zeros((10, 10, 3), dtype=np.uint8)
+    assert align_batch(img, np.zeros((0, 5, 2))).shape == (0, 112, 112, 3)
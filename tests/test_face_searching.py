@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from face_searching import find_FaceVector, search_image
+from utils.gallery import Gallery
+
+
+class FakeDetector:
+
+    def __init__(self, num_faces):
+        self.num_faces = num_faces
+
+    def detect(self, img, threshold=0.5):
+        faces = np.tile([[10.6, 10.2, 50.4, 50.9, 0.99]], (self.num_faces, 1)).astype(np.float32)
+        landmarks = np.tile(np.array([[20.7, 25.2], [40.1, 25.8], [30.5, 35.5], [22.9, 45.1], [38.3, 45.6]],
+                                     dtype=np.float32), (self.num_faces, 1, 1))
+        return faces, landmarks
+
+
+class FakeRecognizer:
+    """Embeds a face as the unit vector along its truncated first landmark x"""
+
+    def prepare_insight_input_batch(self, landmarks, face_img):
+        assert landmarks.dtype == np.int64
+        return [int(landmark[0, 0]) for landmark in landmarks]
+
+    def face_vertorizing_batch(self, aligned_list):
+        return np.eye(64, dtype=np.float32)[aligned_list]
+
+
+def gallery():
+    # a holds the truncated landmark x of 20.7, b the rounded one
+    return Gallery(np.eye(64, dtype=np.float32)[[20, 21, 0]], ['a.jpg', 'b.jpg', 'c.jpg'], [0, 1, 2, 3])
+
+
+def test_search_image_matches_the_only_face():
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    assert search_image(img, gallery(), FakeDetector(1), FakeRecognizer()) == ['a.jpg']
+
+
+@pytest.mark.parametrize('num_faces', [0, 2])
+def test_search_image_needs_exactly_one_face(num_faces):
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    assert search_image(img, gallery(), FakeDetector(num_faces), FakeRecognizer()) is None
+
+
+def test_find_face_vector():
+    assert find_FaceVector(np.eye(64, dtype=np.float32)[21], gallery()) == ['b.jpg']
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from utils.embedding_store import StoreWriter, open_store, remove_images
+from utils.gallery import ExactIndex
+from utils.hnsw_index import HNSWIndex
+
+
+def random_gallery(n, dim=32, seed=0):
+    rng = np.random.RandomState(seed)
+    # A few clusters, like many faces of the same people
+    centres = rng.randn(20, dim)
+    matrix = centres[rng.randint(0, 20, n)] + 0.5 * rng.randn(n, dim)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix.astype(np.float32)
+
+
+def recall_at_k(index, matrix, queries, k=10):
+    exact = ExactIndex(matrix)
+    hits = 0
+    for query in queries:
+        rows, _ = index.search(query, top_k=k)
+        expected, _ = exact.search(query, top_k=k)
+        hits += len(set(rows.tolist()) & set(expected.tolist()))
+    return hits / float(k * len(queries))
+
+
+def test_recall():
+    matrix = random_gallery(800)
+    index = HNSWIndex(dim=32, M=8, ef_construction=40, ef_search=64).add(matrix)
+    assert len(index) == 800
+    assert recall_at_k(index, matrix, random_gallery(50, seed=1)) >= 0.95
+
+    rows, dist = index.search(matrix[7], top_k=3)
+    assert rows[0] == 7 and abs(dist[0]) < 1e-5
+    rows, dist = index.search_threshold(matrix[7], dist_thres=0.5)
+    assert 7 in rows.tolist() and np.all(dist < 0.5)
+    assert np.all(np.diff(rows) > 0)
+
+
+def test_empty_index():
+    index = HNSWIndex(dim=32)
+    rows, dist = index.search(np.ones(32, dtype=np.float32))
+    assert rows.shape == (0,) and dist.shape == (0,)
+    assert index.search_threshold(np.ones(32, dtype=np.float32))[0].shape == (0,)
+
+
+def test_save_load_and_continue(tmp_path):
+    matrix = random_gallery(600)
+    queries = random_gallery(30, seed=2)
+    index = HNSWIndex(dim=32, M=8, ef_construction=40).add(matrix[:400])
+    path = str(tmp_path / 'hnsw.npz')
+    index.save(path)
+    loaded = HNSWIndex.load(path)
+    assert len(loaded) == 400
+    for query in queries:
+        assert all(np.array_equal(a, b) for a, b in zip(loaded.search(query), index.search(query)))
+
+    # Incremental add after loading keeps the node ids in row order
+    loaded.update(matrix)
+    assert len(loaded) == 600
+    assert loaded.search(matrix[500], top_k=1)[0][0] == 500
+    assert recall_at_k(loaded, matrix, queries) >= 0.95
+
+
+def test_update_after_remove_images_requires_rebuild(tmp_path):
+    matrix = random_gallery(60)
+    prefix = str(tmp_path / 'store')
+    with StoreWriter(prefix, 32) as writer:
+        for i in range(30):
+            writer.append('image{}.jpg'.format(i), matrix[2 * i:2 * i + 2])
+    index = HNSWIndex(dim=32, M=8).add(open_store(prefix).matrix)
+
+    # Appending keeps the indexed rows in place
+    with StoreWriter(prefix, 32, append=True) as writer:
+        writer.append('image30.jpg', random_gallery(3, seed=3))
+    index.update(open_store(prefix).matrix)
+    assert len(index) == 63
+
+    # Removing an image shifts every later row
+    remove_images(prefix, ['image4.jpg'])
+    with pytest.raises(ValueError):
+        index.update(open_store(prefix).matrix)
+    assert not index.indexes_rows_of(open_store(prefix).matrix)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from utils.gallery import ExactIndex
+from utils.ivf_index import IVFIndex, kmeans
+
+
+def random_gallery(n, dim=64, seed=0):
+    rng = np.random.RandomState(seed)
+    matrix = rng.randn(n, dim).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def test_small_gallery_clamps_nlist():
+    matrix = random_gallery(100)
+    index = IVFIndex().build(matrix)
+    assert index.nlist == 100
+    assert index.list_offsets[-1] == 100
+
+    # Probing every cell is exact
+    index.nprobe = index.nlist
+    rows, dist = index.search(matrix[3], top_k=5)
+    expected_rows, expected_dist = ExactIndex(matrix).search(matrix[3], top_k=5)
+    assert np.array_equal(rows, expected_rows)
+    assert np.allclose(dist, expected_dist, atol=1e-5)
+
+
+def test_small_gallery_pq_roundtrip(tmp_path):
+    matrix = random_gallery(50)
+    index = IVFIndex(nlist=8, pq_m=8).build(matrix)
+    assert index.pq_codebooks.shape[:2] == (8, 50)
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert loaded.pq_ksub == 50
+    assert np.array_equal(loaded.search(matrix[0], 3)[0], index.search(matrix[0], 3)[0])
+
+
+def test_kmeans_rejects_too_few_vectors():
+    with pytest.raises(ValueError):
+        kmeans(random_gallery(3), 4)
+    with pytest.raises(ValueError):
+        IVFIndex().build(np.zeros((0, 64), dtype=np.float32))
@@ -0,0 +1,234 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from rcnn.processing import kernels
+from rcnn.processing.bbox_transform import bbox_overlaps
+from rcnn.processing.generate_anchor import anchors_plane, generate_anchors_fpn
+from rcnn.processing.nms import cpu_nms_wrapper
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The anchor configuration of utils/retinaface.RetinaFace, strides 32, 16 and 8
+ANCHOR_CFG = {'32': {'SCALES': (32, 16), 'BASE_SIZE': 16, 'RATIOS': (1.,), 'ALLOWED_BORDER': 9999},
+              '16': {'SCALES': (8, 4), 'BASE_SIZE': 16, 'RATIOS': (1.,), 'ALLOWED_BORDER': 9999},
+              '8': {'SCALES': (2, 1), 'BASE_SIZE': 16, 'RATIOS': (1.,), 'ALLOWED_BORDER': 9999}}
+
+
+def base_anchors_fpn():
+    return dict(zip((32, 16, 8), generate_anchors_fpn(cfg=ANCHOR_CFG)))
+
+
+@pytest.fixture(autouse=True)
+def restore_kernels(monkeypatch):
+    monkeypatch.delenv('RCNN_KERNEL_BACKEND', raising=False)
+    registry = {kernel: dict(backends) for kernel, backends in kernels._registry.items()}
+    loaders = {kernel: dict(backends) for kernel, backends in kernels._loaders.items()}
+    active = dict(kernels._active)
+    kernels._active.clear()
+    yield
+    kernels._registry.clear()
+    kernels._registry.update(registry)
+    kernels._loaders.clear()
+    kernels._loaders.update(loaders)
+    kernels._active.clear()
+    kernels._active.update(active)
+
+
+def backends(kernel):
+    return kernels.available_backends(kernel)
+
+
+def random_boxes(rng, n, size=200.0, max_side=60.0):
+    xy = rng.uniform(0, size, (n, 2))
+    wh = rng.uniform(1, max_side, (n, 2))
+    return np.hstack([xy, xy + wh]).astype(np.float32)
+
+
+def random_dets(rng, n):
+    return np.hstack([random_boxes(rng, n), rng.rand(n, 1).astype(np.float32)])
+
+
+def test_python_and_numpy_are_always_available():
+    for kernel in ('anchors_plane', 'bbox_overlaps', 'nms'):
+        assert {'numpy', 'python'} <= set(backends(kernel))
+
+
+@pytest.mark.parametrize('height, width', [(0, 0), (1, 1), (3, 7), (20, 20), (40, 25)])
+def test_anchors_plane_backends_agree(height, width):
+    for stride, base_anchors in base_anchors_fpn().items():
+        expected = kernels.get('anchors_plane', 'python')(height, width, stride, base_anchors)
+        assert expected.shape == (height, width, base_anchors.shape[0], 4)
+        for backend in backends('anchors_plane'):
+            out = kernels.get('anchors_plane', backend)(height, width, stride, base_anchors)
+            assert out.dtype == np.float32
+            assert np.array_equal(out, expected), backend
+
+
+def overlap_cases():
+    rng = np.random.RandomState(0)
+    boxes = random_boxes(rng, 50)
+    single = boxes[:1]
+    # Zero-area (x2 = x1 - 1 with the +1 convention), single-pixel and inverted boxes
+    degenerate = np.array([[10, 10, 9, 9], [10, 10, 10, 10], [30, 30, 20, 20], [0, 0, 40, 40]], dtype=np.float32)
+    return [(boxes, random_boxes(rng, 30)),
+            (boxes, boxes[:0]),
+            (boxes[:0], boxes),
+            (single, single),
+            (single, boxes),
+            (degenerate, degenerate),
+            (degenerate, boxes)]
+
+
+@pytest.mark.parametrize('boxes, query_boxes', overlap_cases())
+def test_bbox_overlaps_backends_agree(boxes, query_boxes):
+    expected = kernels.get('bbox_overlaps', 'python')(boxes, query_boxes)
+    assert expected.shape == (boxes.shape[0], query_boxes.shape[0])
+    for backend in backends('bbox_overlaps'):
+        out = kernels.get('bbox_overlaps', backend)(boxes, query_boxes)
+        assert out.shape == expected.shape
+        assert np.allclose(out, expected, rtol=1e-6, atol=1e-7), backend
+
+
+def nms_cases():
+    rng = np.random.RandomState(1)
+    crowded = random_dets(rng, 300)
+    # Boxes piled up in a few places, to exercise suppression across tiles
+    centres = random_boxes(rng, 5)
+    jitter = rng.uniform(-3, 3, (200, 4)).astype(np.float32)
+    piles = np.hstack([centres[rng.randint(0, 5, 200)] + jitter, rng.rand(200, 1).astype(np.float32)])
+    tied = crowded.copy()
+    tied[:, 4] = np.round(tied[:, 4], 1)
+    duplicates = np.repeat(crowded[:10], 3, axis=0)
+    return [crowded, piles, tied, duplicates, crowded[:0], crowded[:1]]
+
+
+@pytest.mark.parametrize('dets', nms_cases())
+@pytest.mark.parametrize('thresh', [0.3, 0.7])
+def test_nms_backends_agree(dets, thresh):
+    expected = [int(i) for i in kernels.get('nms', 'python')(dets, thresh)]
+    for backend in backends('nms'):
+        keep = [int(i) for i in kernels.get('nms', backend)(dets, thresh)]
+        assert keep == expected, backend
+
+
+def test_nms_numpy_small_tiles():
+    dets = nms_cases()[1]
+    expected = [int(i) for i in kernels.get('nms', 'python')(dets, 0.4)]
+    for tile in (1, 3, 64, 1000):
+        assert kernels.get('nms', 'numpy')(dets, 0.4, tile=tile) == expected
+
+
+def test_nms_zero_area_boxes():
+    dets = np.array([[10, 10, 9, 9, 0.9],
+                     [10, 10, 9, 9, 0.8],
+                     [0, 0, 5, 5, 0.7],
+                     [0, 0, 5, 5, 0.6]], dtype=np.float32)
+    with np.errstate(invalid='ignore'):
+        expected = [int(i) for i in kernels.get('nms', 'python')(dets, 0.4)]
+        assert kernels.get('nms', 'numpy')(dets, 0.4) == expected
+    assert expected == [0, 2]
+
+
+def test_env_var_selects_backend(monkeypatch):
+    monkeypatch.setenv('RCNN_KERNEL_BACKEND', 'python')
+    assert kernels.active_backend('nms') == 'python'
+    assert kernels.get('bbox_overlaps') is kernels.get('bbox_overlaps', 'python')
+
+
+def test_unknown_env_var_falls_back(monkeypatch):
+    monkeypatch.setenv('RCNN_KERNEL_BACKEND', 'fortran')
+    assert kernels.active_backend('nms') == backends('nms')[0]
+
+
+def test_default_is_first_available():
+    for kernel in ('anchors_plane', 'bbox_overlaps', 'nms'):
+        assert kernels.active_backend(kernel) == backends(kernel)[0]
+
+
+def test_use_backend_overrides(monkeypatch):
+    monkeypatch.setenv('RCNN_KERNEL_BACKEND', 'numpy')
+    kernels.use_backend('python', 'nms')
+    assert kernels.active_backend('nms') == 'python'
+    assert kernels.active_backend('bbox_overlaps') == 'numpy'
+
+    kernels.use_backend('python')
+    for kernel in ('anchors_plane', 'bbox_overlaps', 'nms'):
+        assert kernels.active_backend(kernel) == 'python'
+    dets = nms_cases()[0]
+    assert cpu_nms_wrapper(0.3)(dets) == kernels.get('nms', 'python')(dets, 0.3)
+
+    # Back to the automatic choice, which honours the environment variable
+    kernels.use_backend()
+    assert kernels.active_backend('nms') == 'numpy'
+
+
+def test_use_backend_unavailable():
+    with pytest.raises(ValueError):
+        kernels.use_backend('fortran', 'nms')
+    # Without a kernel, only the kernels offering the backend switch
+    kernels.register('nms', 'fortran', kernels.get('nms', 'python'))
+    kernels.use_backend('fortran')
+    assert kernels.active_backend('nms') == 'fortran'
+    assert kernels.active_backend('bbox_overlaps') == backends('bbox_overlaps')[0]
+
+
+def test_wrappers_follow_the_active_backend():
+    rng = np.random.RandomState(2)
+    boxes = random_boxes(rng, 20)
+    base_anchors = base_anchors_fpn()[16]
+    for backend in ('python', 'numpy'):
+        kernels.use_backend(backend)
+        assert np.array_equal(bbox_overlaps(boxes, boxes), kernels.get('bbox_overlaps', backend)(boxes, boxes))
+        assert np.array_equal(anchors_plane(4, 5, 16, base_anchors),
+                              kernels.get('anchors_plane', backend)(4, 5, 16, base_anchors))
+
+
+def test_lazy_loader_runs_on_first_use():
+    calls = []
+
+    def loader():
+        calls.append('cython')
+        return lambda x: x + 1
+
+    kernels.register('test_kernel', 'python', lambda x: x)
+    kernels.register_lazy('test_kernel', 'cython', loader)
+    assert calls == []
+    assert kernels.get('test_kernel', 'python')(1) == 1
+    # Any look at the kernel's backends resolves its loaders, once
+    assert calls == ['cython']
+    assert kernels.available_backends('test_kernel') == ['cython', 'python']
+    assert kernels.active_backend('test_kernel') == 'cython'
+    assert kernels.get('test_kernel')(1) == 2
+    assert calls == ['cython']
+
+
+def test_lazy_loader_import_error_drops_backend():
+    def loader():
+        raise ImportError('not compiled')
+
+    kernels.register('test_kernel', 'python', lambda x: x)
+    kernels.register_lazy('test_kernel', 'cython', loader)
+    assert kernels.available_backends('test_kernel') == ['python']
+    assert kernels.active_backend('test_kernel') == 'python'
+    with pytest.raises(ValueError):
+        kernels.use_backend('cython', 'test_kernel')
+
+
+def test_use_backend_resolves_lazy_loaders(monkeypatch):
+    monkeypatch.setenv('RCNN_KERNEL_BACKEND', 'python')
+    kernels.register('test_kernel', 'python', lambda x: x)
+    kernels.register_lazy('test_kernel', 'cython', lambda: (lambda x: x + 1))
+    kernels.use_backend('cython')
+    assert kernels.active_backend('test_kernel') == 'cython'
+
+
+def test_processing_imports_do_not_load_extensions():
+    # Importing the processing modules only registers the compiled backends' loaders
+    code = ('import sys; from rcnn.processing import kernels, nms, bbox_transform, generate_anchor; '
+            'print(sorted(kernels._loaders)); print([m for m in sys.modules if m.startswith("rcnn.cython")])')
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=REPO_ROOT, universal_newlines=True)
+    assert out.splitlines() == ["['anchors_plane', 'bbox_overlaps', 'nms']", '[]']
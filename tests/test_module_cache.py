@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from utils.module_cache import InputBuffers, bucket_shape
+
+STRIDES = (32, 16, 8)
+
+
+def test_bucket_shape_rounds_up():
+    assert bucket_shape((1, 3, 640, 640)) == (1, 3, 640, 640)
+    assert bucket_shape((2, 3, 481, 33)) == (2, 3, 512, 64)
+    assert bucket_shape((1, 3, 1, 1)) == (1, 3, 32, 32)
+    assert bucket_shape((1, 3, 100, 200), multiple=64) == (1, 3, 128, 256)
+
+
+def test_bucket_multiple_one_never_pads():
+    for h, w in [(1, 1), (37, 480), (481, 641)]:
+        assert bucket_shape((1, 3, h, w), multiple=1) == (1, 3, h, w)
+
+
+def test_fill_pads_with_zeros():
+    buffers = InputBuffers([0.0, 0.0, 0.0], [1.0, 1.0, 1.0], 1.0, multiple=32)
+    large = np.full((60, 60, 3), 255, dtype=np.uint8)
+    buffers.fill([large])
+    small = np.arange(40 * 50 * 3, dtype=np.uint8).reshape((40, 50, 3))
+    buf = buffers.fill([small])
+    # Same bucket as the larger image, whose pixels must not leak into the padding
+    assert buf.shape == (1, 3, 64, 64)
+    assert np.array_equal(buf[0, :, :40, :50], small[:, :, ::-1].transpose((2, 0, 1)))
+    assert not buf[0, :, 40:, :].any()
+    assert not buf[0, :, :, 50:].any()
+
+
+def unpadded_feature_size(length, stride):
+    # Every stride-2 stage of the network maps n positions to ceil(n / 2)
+    while stride > 1:
+        length = -(-length // 2)
+        stride //= 2
+    return length
+
+
+@pytest.mark.parametrize('multiple', [1, 32, 64])
+def test_clip_pad_restores_unpadded_extents(multiple):
+    pytest.importorskip('mxnet')
+    from utils.retinaface import RetinaFace
+
+    rng = np.random.RandomState(0)
+    for h, w in [(1, 1), (31, 33), (100, 75), (481, 640), (640, 640)]:
+        _, _, H, W = bucket_shape((1, 3, h, w), multiple)
+        for stride in STRIDES:
+            feat = rng.rand(1, 4, unpadded_feature_size(H, stride), unpadded_feature_size(W, stride))
+            # As RetinaFace._decode computes it from im_info
+            feat_shape = (-(-h // stride), -(-w // stride))
+            clipped = RetinaFace._clip_pad(feat, feat_shape)
+            expected = (unpadded_feature_size(h, stride), unpadded_feature_size(w, stride))
+            assert clipped.shape[2:] == expected
+            assert np.array_equal(clipped, feat[:, :, :expected[0], :expected[1]])
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from rcnn.processing.nms import batched_nms, nms, soft_nms
+
+
+def random_dets(rng, n, size=200.0, max_side=60.0):
+    xy = rng.uniform(0, size, (n, 2))
+    wh = rng.uniform(1, max_side, (n, 2))
+    return np.hstack([xy, xy + wh, rng.rand(n, 1)]).astype(np.float32)
+
+
+# A and B overlap with IoU 1/3, C is apart
+A = [0, 0, 9, 9, 0.9]
+B = [0, 5, 9, 14, 0.8]
+C = [50, 50, 59, 59, 0.7]
+
+
+@pytest.mark.parametrize('num_groups', [1, 3, 10])
+def test_batched_nms_equals_per_group_nms(num_groups):
+    rng = np.random.RandomState(num_groups)
+    dets = random_dets(rng, 300)
+    group_ids = rng.randint(0, num_groups, 300)
+    expected = []
+    for group in range(num_groups):
+        members = np.flatnonzero(group_ids == group)
+        expected.extend(members[nms(dets[members], 0.4)].tolist())
+    keep = batched_nms(dets, group_ids, 0.4)
+    assert sorted(keep) == sorted(expected)
+    # Kept in descending score order, like nms
+    assert np.all(np.diff(dets[keep, 4]) <= 0)
+
+
+def test_batched_nms_groups_never_suppress_each_other():
+    dets = np.array([A[:4] + [0.9], A[:4] + [0.8], A[:4] + [0.7]], dtype=np.float32)
+    assert batched_nms(dets, np.array([0, 1, 2]), 0.4) == [0, 1, 2]
+    assert batched_nms(dets, np.array([0, 0, 1]), 0.4) == [0, 2]
+
+
+def test_batched_nms_empty():
+    assert batched_nms(np.zeros((0, 5), dtype=np.float32), np.zeros(0, dtype=np.int64), 0.4) == []
+
+
+def test_soft_nms_linear():
+    dets = np.array([A, B, C], dtype=np.float32)
+    keep, scores = soft_nms(dets, thresh=0.3, method='linear')
+    # B overlaps A above thresh: 0.8 * (1 - 1/3) drops below C
+    assert keep == [0, 2, 1]
+    assert np.allclose(scores, [0.9, 0.7, 0.8 * (2.0 / 3)], atol=1e-6)
+
+    # Below thresh, scores are left alone
+    keep, scores = soft_nms(dets, thresh=0.5, method='linear')
+    assert keep == [0, 1, 2]
+    assert np.allclose(scores, [0.9, 0.8, 0.7])
+
+
+def test_soft_nms_gaussian():
+    dets = np.array([A, B, C], dtype=np.float32)
+    keep, scores = soft_nms(dets, sigma=0.5, method='gaussian')
+    # exp(-IoU^2 / sigma) decays B even below thresh, here to 0.64 behind C
+    decayed = 0.8 * np.exp(-(1.0 / 9) / 0.5)
+    assert keep == [0, 2, 1]
+    assert np.allclose(scores, [0.9, 0.7, decayed], atol=1e-6)
+
+
+def test_soft_nms_score_thresh_drops_boxes():
+    # Identical boxes: a linear decay by 1 - IoU zeroes the duplicate
+    dets = np.array([A, A, C], dtype=np.float32)
+    keep, scores = soft_nms(dets, method='linear')
+    assert keep == [0, 2]
+    keep, _ = soft_nms(dets, method='linear', score_thresh=0.8)
+    assert keep == [0]
+
+
+def reference_soft_nms(dets, sigma, thresh, score_thresh, method):
+    # Straight loop over the remaining boxes, as in the Soft-NMS paper
+    boxes = [list(map(float, d)) + [i] for i, d in enumerate(dets)]
+    boxes = [b for b in boxes if b[4] >= score_thresh]
+    keep, keep_scores = [], []
+    while boxes:
+        best = max(range(len(boxes)), key=lambda j: boxes[j][4])
+        top = boxes.pop(best)
+        keep.append(top[5])
+        keep_scores.append(top[4])
+        area = (top[2] - top[0] + 1) * (top[3] - top[1] + 1)
+        remaining = []
+        for b in boxes:
+            iw = max(0.0, min(top[2], b[2]) - max(top[0], b[0]) + 1)
+            ih = max(0.0, min(top[3], b[3]) - max(top[1], b[1]) + 1)
+            ovr = iw * ih / (area + (b[2] - b[0] + 1) * (b[3] - b[1] + 1) - iw * ih)
+            if method == 'gaussian':
+                b[4] *= np.exp(-ovr * ovr / sigma)
+            elif ovr > thresh:
+                b[4] *= 1.0 - ovr
+            if b[4] >= score_thresh:
+                remaining.append(b)
+        boxes = remaining
+    return keep, keep_scores
+
+
+@pytest.mark.parametrize('method', ['linear', 'gaussian'])
+def test_soft_nms_matches_reference(method):
+    dets = random_dets(np.random.RandomState(5), 150)
+    keep, scores = soft_nms(dets, sigma=0.5, thresh=0.3, score_thresh=0.01, method=method)
+    expected_keep, expected_scores = reference_soft_nms(dets, 0.5, 0.3, 0.01, method)
+    assert [int(i) for i in keep] == expected_keep
+    assert np.allclose(scores, expected_scores, rtol=1e-4, atol=1e-6)
+
+
+def test_soft_nms_empty():
+    keep, scores = soft_nms(np.zeros((0, 5), dtype=np.float32))
+    assert keep == [] and scores.shape == (0,)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('mxnet')
+
+from utils.retinaface import RetinaFace
+
+
+@pytest.mark.parametrize('tile, overlap', [(640, 128), (640, 0), (100, 99), (64, 32)])
+def test_tile_cores_partition(tile, overlap):
+    for length in [1, tile - 1, tile, tile + 1, 2 * tile - overlap, 3 * tile + 17, 5000]:
+        t = min(tile, length)
+        starts = RetinaFace._tile_starts(length, t, overlap)
+        cores = RetinaFace._tile_cores(starts, t, length)
+        assert starts[0] == 0 and starts[-1] + t == length
+        assert all(0 < b - a <= tile - overlap for a, b in zip(starts[:-1], starts[1:]))
+        # The cores cover [0, length) without gaps or overlaps, each inside its tile
+        assert cores[0][0] == 0 and cores[-1][1] == length
+        assert all(a[1] == b[0] for a, b in zip(cores[:-1], cores[1:]))
+        for start, (begin, end) in zip(starts, cores):
+            assert start <= begin < end <= start + t
+
+
+@pytest.mark.parametrize('overlap', [640, 1000, -1])
+def test_tile_starts_rejects_bad_overlap(overlap):
+    with pytest.raises(ValueError):
+        RetinaFace._tile_starts(2000, 640, overlap)
+
+
+def test_single_tile_ignores_overlap():
+    assert RetinaFace._tile_starts(100, 100, 128) == [0]
+    assert RetinaFace._tile_cores([0], 100, 100) == [(0, 100)]
+
+
+@pytest.mark.parametrize('overlap', [640, 1000, -1])
+def test_detect_tiled_rejects_bad_overlap(overlap):
+    # Checked before the model is used
+    detector = RetinaFace.__new__(RetinaFace)
+    with pytest.raises(ValueError):
+        detector.detect_tiled(np.zeros((100, 100, 3), dtype=np.uint8), tile_size=640, overlap=overlap)
@@ -0,0 +1,87 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from utils.gallery import Gallery
+from utils.search_server import MicroBatcher, SearchService, start_server
+
+
+class FakeDetector:
+
+    def detect_batch(self, images, threshold):
+        return [(np.zeros((0, 5), dtype=np.float32), None) for _ in images]
+
+
+def request(raw):
+    async def run():
+        service = SearchService(FakeDetector(), None, Gallery(np.eye(4, dtype=np.float32), ['a'], [0, 4]))
+        server = await start_server(service, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(raw)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+        finally:
+            server.close()
+            await server.wait_closed()
+            await service.stop()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('length', [b'abc', b'-5', b'', b'1.5'])
+def test_invalid_content_length_is_bad_request(length):
+    response = request(b'POST /search HTTP/1.1\r\nContent-Length: ' + length + b'\r\n\r\n')
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert b'Content-Length' in response
+
+
+def test_missing_content_length():
+    response = request(b'POST /search HTTP/1.1\r\n\r\n')
+    assert response.startswith(b'HTTP/1.1 411 ')
+
+
+def test_undecodable_image():
+    response = request(b'POST /search HTTP/1.1\r\nContent-Length: 3\r\nConnection: close\r\n\r\nabc')
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert b'decode' in response
+
+
+def test_micro_batcher_coalesces():
+    calls = []
+
+    def double(items):
+        calls.append(len(items))
+        return [2 * item for item in items]
+
+    async def run():
+        batcher = MicroBatcher(double, max_batch_size=4, max_wait=0.05)
+        batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == [2 * i for i in range(10)]
+    assert calls == [4, 4, 2]
+
+
+def test_header_longer_than_the_stream_limit():
+    response = request(b'GET /health HTTP/1.1\r\nX-Padding: ' + b'a' * (70 << 10) + b'\r\n\r\n')
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert b'too long' in response
+
+
+def test_internal_error_is_not_sent_to_the_client(monkeypatch, capsys):
+    def fail(self):
+        raise RuntimeError('secret detail')
+    monkeypatch.setattr(SearchService, 'stats', fail)
+    response = request(b'GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n')
+    assert response.startswith(b'HTTP/1.1 500 ')
+    assert b'internal server error' in response and b'secret' not in response
+    assert 'secret detail' in capsys.readouterr().err
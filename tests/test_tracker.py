@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from utils.tracker import IoUTracker
+
+
+def dets(*boxes):
+    return np.array([list(box) + [0.9] for box in boxes], dtype=np.float32)
+
+
+def test_detections_continue_the_overlapping_track():
+    tracker = IoUTracker(iou_thres=0.3, max_age=30)
+    first = tracker.update(dets((0, 0, 20, 20), (100, 100, 120, 120)), None, 0)
+    assert [t.track_id for t in first] == [0, 1]
+
+    # Both faces moved a little, listed in the other order, plus a new one
+    second = tracker.update(dets((102, 101, 122, 121), (200, 0, 230, 30), (2, 1, 22, 21)), None, 5)
+    assert sorted(t.track_id for t in second[:2]) == [0, 1] and second[2].track_id == 2
+    boxes = {t.track_id: t.box for t in second}
+    assert np.allclose(boxes[0], [2, 1, 22, 21]) and np.allclose(boxes[1], [102, 101, 122, 121])
+    assert tracker.next_id == 3
+
+
+def test_greedy_matching_prefers_the_best_overlap():
+    tracker = IoUTracker(iou_thres=0.1)
+    tracker.update(dets((0, 0, 20, 20), (10, 0, 30, 20)), None, 0)
+    # One detection between both tracks, closer to track 1
+    updated = tracker.update(dets((8, 0, 28, 20)), None, 1)
+    assert [t.track_id for t in updated] == [1]
+
+
+def test_velocity_prediction():
+    tracker = IoUTracker()
+    tracker.update(dets((0, 0, 20, 20)), None, 0)
+    tracker.update(dets((4, 2, 24, 22)), None, 2)
+    tracks, boxes = tracker.boxes(6)
+    assert len(tracks) == 1
+    # 2 px/frame in x, 1 px/frame in y
+    assert np.allclose(boxes[0], [12, 6, 32, 26])
+
+    # A face that kept moving far beyond its last box is still matched through the prediction
+    updated = tracker.update(dets((40, 20, 60, 40)), None, 20)
+    assert [t.track_id for t in updated] == [0]
+    assert tracker.next_id == 1
+
+
+def test_max_age_expiry():
+    tracker = IoUTracker(max_age=10)
+    tracker.update(dets((0, 0, 20, 20)), None, 0)
+    assert len(tracker.boxes(10)[0]) == 1
+    assert len(tracker.boxes(11)[0]) == 0
+    # An expired track is not resurrected by a detection at its place
+    updated = tracker.update(dets((0, 0, 20, 20)), None, 11)
+    assert [t.track_id for t in updated] == [1]
+
+
+def test_landmarks_and_no_detections():
+    tracker = IoUTracker()
+    landmarks = np.arange(10, dtype=np.float32).reshape((1, 5, 2))
+    track, = tracker.update(dets((0, 0, 20, 20)), landmarks, 0)
+    assert np.array_equal(track.landmark, landmarks[0])
+    assert tracker.update(np.zeros((0, 5), dtype=np.float32), None, 1) == []
+    assert tracker.update(None, None, 2) == []
+    assert track.face_quality() == pytest.approx(0.9 * 20)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from utils.video_search import VideoSearcher
+
+
+class FakeDetector:
+    """Returns the scripted (boxes with scores) of each call, with landmarks at the box corner"""
+
+    def __init__(self, script):
+        self.script = list(script)
+
+    def detect(self, frame, threshold):
+        faces = np.array(self.script.pop(0), dtype=np.float32).reshape((-1, 5))
+        landmarks = np.repeat(faces[:, np.newaxis, :2], 5, axis=1)
+        return faces, landmarks
+
+
+class FakeRecognizer:
+    """Embeds a face as its landmark x coordinate"""
+
+    def __init__(self):
+        self.batches = []
+
+    def prepare_insight_input_batch(self, landmarks, image):
+        self.batches.append(len(landmarks))
+        return [float(landmark[0, 0]) for landmark in landmarks]
+
+    def face_vertorizing_batch(self, aligned):
+        return np.array(aligned, dtype=np.float32).reshape((-1, 1))
+
+
+class FakeGallery:
+
+    def search_threshold(self, vector, dist_thres):
+        return [('image{}.jpg'.format(int(vector[0])), 0.0)]
+
+
+def searcher(script, **kwargs):
+    recognizer = FakeRecognizer()
+    searcher = VideoSearcher(FakeDetector(script), recognizer, FakeGallery(), motion_thres=None, **kwargs)
+    return searcher, recognizer
+
+
+FRAME = np.zeros((8, 8, 3), dtype=np.uint8)
+
+
+def test_reembed_only_on_clearly_better_quality():
+    script = [[[10, 10, 50, 50, 0.9]],     # new track, quality 36
+              [[11, 10, 51, 50, 0.95]],    # quality 38, not better by 1.25
+              [[12, 10, 62, 60, 0.95]],    # quality 47.5 > 45, re-embedded
+              [[13, 10, 63, 60, 0.9]]]     # quality 45 < 47.5 * 1.25
+    video, recognizer = searcher(script, detect_every=1, quality_gain=1.25)
+    embedded = [video.process(FRAME)[2] for _ in script]
+
+    assert [[t.track_id for t in tracks] for tracks in embedded] == [[0], [], [0], []]
+    track = embedded[0][0]
+    assert track.quality == pytest.approx(0.95 * 50)
+    assert track.matches == [('image12.jpg', 0.0)]
+    assert (video.detector_calls, video.recognizer_calls, video.faces_embedded) == (4, 2, 2)
+    assert recognizer.batches == [1, 1]
+
+
+def test_faces_of_one_frame_are_embedded_in_one_batch():
+    script = [[[10, 10, 50, 50, 0.9], [100, 10, 140, 50, 0.9]],
+              [[10, 10, 50, 50, 0.9], [100, 10, 140, 50, 0.9], [200, 10, 240, 50, 0.9]]]
+    video, recognizer = searcher(script, detect_every=1)
+    video.process(FRAME)
+    _, _, embedded = video.process(FRAME)
+    # Only the new third face is embedded in the second frame
+    assert [t.track_id for t in embedded] == [2]
+    assert recognizer.batches == [2, 1]
+    assert video.faces_embedded == 3
+
+
+def test_tracks_are_carried_between_detector_runs():
+    script = [[[10, 10, 50, 50, 0.9]], [[14, 10, 54, 50, 0.9]]]
+    video, recognizer = searcher(script, detect_every=4)
+    for _ in range(6):
+        tracks, boxes, _ = video.process(FRAME)
+    assert video.detector_calls == 2
+    assert [t.track_id for t in tracks] == [0]
+    # Moved 1 px per frame between the two detections, extrapolated to frame 5
+    assert np.allclose(boxes[0], [15, 10, 55, 50])
+    assert recognizer.batches == [1]
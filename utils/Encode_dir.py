@@ -1,9 +1,26 @@
 import cv2
 import os
 import json
-import numpy as np
-from utils.retinaface import RetinaFace
-from utils.insightface import InsightFace
+import time
+import zlib
+import hashlib
+import multiprocessing
+from utils.face_daemon import connect, load_models
+from utils.embedding_store import StoreWriter, merge_stores, open_store, remove_images, store_exists
+from utils.encode_pipeline import FaceBatcher, align_detections, iter_aligned
+
+def align_faces(detector, Recognizer, image, thresh):
+    """
+    :return: list of aligned (3, 112, 112) crops of every face found in the image
+    """
+    faces, landmarks = detector.detect(image, thresh)
+    return align_detections(Recognizer, image, faces, landmarks)
+
+def encode_image(detector, Recognizer, image, thresh):
+    """
+    :return: (n, 512) embeddings of every face found in the image
+    """
+    return Recognizer.face_vertorizing_batch(align_faces(detector, Recognizer, image, thresh))
 
 def images_2_json(image_dir, json_path):
 
@@ -15,8 +32,7 @@ def images_2_json(image_dir, json_path):
     gpuid = 0
 
     print('Loading Models...')
-    detector = RetinaFace('../model/mnet.25/mnet.25', 0, gpuid)
-    Recognizer = InsightFace('../model/insightface/insightface', 0, gpuid)
+    detector, Recognizer = load_models('../model/mnet.25/mnet.25', '../model/insightface/insightface', gpuid, connect())
     print('Done!')
 
     json_dict = {}
@@ -29,22 +45,7 @@ def images_2_json(image_dir, json_path):
 
         image = cv2.imread(image_path)
 
-        faces, landmarks = detector.detect(image, thresh)
-
-        vector_list = []
-        if len(faces) == 0:
-            json_dict[image_name] = vector_list
-            continue
-
-        for i in range(faces.shape[0]):
-
-            face = faces[i].astype(np.int)
-            landmark = landmarks[i].astype(np.int)
-
-            aligned = Recognizer.prepare_insight_input(face, landmark, image)
-            vector_list.append(Recognizer.face_vertorizing(aligned).tolist())
-
-        json_dict[image_name] = vector_list
+        json_dict[image_name] = encode_image(detector, Recognizer, image, thresh).tolist()
 
         step += 1
 
@@ -56,7 +57,230 @@ def images_2_json(image_dir, json_path):
         f.write( json.dumps(json_dict, ensure_ascii=False, indent=4) )
     print('Written to {}'.format(json_path))
 
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def manifest_entry(path, stat=None, digest=None):
+    if stat is None:
+        stat = os.stat(path)
+    return {'path': path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': digest if digest is not None else file_digest(path)}
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+def scan_changes(image_dir, image_names, manifest, stored_names):
+    """
+    Compare the images on disk against the manifest of the images already in the store.
+    Size and mtime are checked first; the content hash is only computed for files
+    whose size or mtime changed, so touched but identical files are not re-encoded.
+    :return: new, changed and deleted image names
+    """
+    stored = set(stored_names)
+    on_disk = sorted(image_names)
+    new, changed = [], []
+    for image_name in on_disk:
+        image_path = os.path.join(image_dir, image_name)
+        if image_name not in stored:
+            new.append(image_name)
+            continue
+        stat = os.stat(image_path)
+        entry = manifest.get(image_name)
+        if entry is None:
+            # Stored without a manifest entry, e.g. converted from Images.json: adopt as is
+            manifest[image_name] = manifest_entry(image_path, stat)
+            continue
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            continue
+        digest = file_digest(image_path)
+        if digest == entry['sha1']:
+            manifest[image_name] = manifest_entry(image_path, stat, digest)
+        else:
+            changed.append(image_name)
+    deleted = sorted(stored.difference(on_disk))
+    return new, changed, deleted
+
+def images_2_store(image_dir, store_prefix, batch_size=64, max_latency=2.0, workers=4,
+                   image_names=None, gpuid=0, checkpoint_every=1000, use_daemon=True):
+    """
+    Incrementally bring the embedding store at store_prefix up to date with image_dir.
+    Only new or changed images go through the detector and recognizer; deleted and
+    changed images are dropped from the store, and new embeddings are appended to it.
+    A manifest of (path, size, mtime, sha1) per stored image is kept next to the store.
+
+    Aligned faces from consecutive images are embedded together in batches of
+    batch_size, or after max_latency seconds for a batch that does not fill up.
+    Image decoding and face alignment run on a pool of workers threads while
+    this thread runs the models; workers=0 does everything in this thread.
+    Store and manifest are checkpointed every checkpoint_every images, so an
+    interrupted run resumes from the last checkpoint.
+
+    :param image_names: the images of image_dir this store covers, all of them by default
+    :param use_daemon: use the models of a running face daemon instead of loading them
+    :return: number of encoded images and the seconds spent encoding them
+    """
+    thresh = 0.8
+
+    if image_names is None:
+        image_names = os.listdir(image_dir)
+
+    manifest_path = store_prefix + '.manifest.json'
+    manifest = load_manifest(manifest_path)
+    stored_names = open_store(store_prefix).names if store_exists(store_prefix) else []
+    # Entries of images that never made it into the store are stale
+    stored = set(stored_names)
+    manifest = {name: entry for name, entry in manifest.items() if name in stored}
+
+    new, changed, deleted = scan_changes(image_dir, image_names, manifest, stored_names)
+    print('{} new, {} changed, {} deleted, {} unchanged images'.format(
+        len(new), len(changed), len(deleted), len(stored_names) - len(changed) - len(deleted)))
+
+    if changed or deleted:
+        print('Dropping {} images from the store...'.format(len(changed) + len(deleted)))
+        remove_images(store_prefix, changed + deleted)
+        for image_name in changed + deleted:
+            manifest.pop(image_name, None)
+
+    to_encode = new + changed
+    if len(to_encode) == 0:
+        save_manifest(manifest_path, manifest)
+        print('Store is up to date')
+        return 0, 0.0
+
+    print('Loading Models...')
+    detector, Recognizer = load_models('../model/mnet.25/mnet.25', '../model/insightface/insightface', gpuid,
+                                       connect() if use_daemon else None, recognizer_batch_size=batch_size)
+    print('Done!')
+
+    print('Encoding images...')
+    start_time = time.time()
+    # An image only enters the manifest once its embeddings reached the store
+    entries = {}
+
+    def on_image_done(image_name):
+        manifest[image_name] = entries.pop(image_name)
+
+    with StoreWriter(store_prefix, append=True) as writer, \
+            FaceBatcher(Recognizer, writer, batch_size, max_latency, on_image_done) as batcher:
+        # Also check the batch latency while the decoders fall behind, not only when an image arrives
+        aligned_iter = iter_aligned(image_dir, to_encode, detector, Recognizer, thresh, workers,
+                                    on_idle=batcher.poll, idle_timeout=max_latency / 4.0)
+        for step, (image_name, aligned_list) in enumerate(aligned_iter):
+
+            image_path = os.path.join(image_dir, image_name)
+            entries[image_name] = manifest_entry(image_path)
+
+            if aligned_list is None:
+                print('Could not read {}, storing it without faces'.format(image_path))
+                aligned_list = []
+
+            batcher.add_image(image_name, aligned_list)
+
+            if (step + 1) % 100 == 0:
+                print('On {}/{}'.format(step + 1, len(to_encode)))
+
+            if (step + 1) % checkpoint_every == 0:
+                writer.commit()
+                save_manifest(manifest_path, manifest)
+
+    elapsed = time.time() - start_time
+    print('Embedded {} faces in {} batches'.format(batcher.num_faces, batcher.num_batches))
+    save_manifest(manifest_path, manifest)
+    print('Written to {}'.format(store_prefix))
+    return len(to_encode), elapsed
+
+def shard_of(image_name, num_shards):
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(image_name.encode('utf-8')) % num_shards
+
+def shard_prefix(store_prefix, shard_id, num_shards):
+    return '{}.shard{}of{}'.format(store_prefix, shard_id, num_shards)
+
+def _encode_shard(image_dir, store_prefix, shard_id, num_shards, batch_size, max_latency, workers):
+    image_names = [name for name in os.listdir(image_dir) if shard_of(name, num_shards) == shard_id]
+    return images_2_store(image_dir, shard_prefix(store_prefix, shard_id, num_shards),
+                          batch_size, max_latency, workers, image_names=image_names, gpuid=-1,
+                          use_daemon=False)
+
+def sharded_images_2_store(image_dir, store_prefix, num_shards, threads_per_shard=1,
+                           batch_size=64, max_latency=2.0, workers=1):
+    """
+    Split image_dir deterministically by name into num_shards shards, encode each
+    one in its own process with its own CPU models into a shard store next to
+    store_prefix, then merge the shards into the store at store_prefix.
+
+    Every shard store is incremental and checkpointed, so re-running after a
+    failure resumes the failed shards from their last checkpoint while finished
+    shards are not re-encoded.
+    :return: True if every shard succeeded and the merged store was written
+    """
+    # Inherited by the spawned workers before they import mxnet
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_shard)
+    os.environ['MXNET_CPU_WORKER_NTHREADS'] = str(threads_per_shard)
+
+    ctx = multiprocessing.get_context('spawn')
+    failed = []
+    with ctx.Pool(num_shards) as pool:
+        results = [pool.apply_async(_encode_shard, (image_dir, store_prefix, shard_id, num_shards,
+                                                    batch_size, max_latency, workers))
+                   for shard_id in range(num_shards)]
+        for shard_id, result in enumerate(results):
+            try:
+                num_images, elapsed = result.get()
+            except Exception as e:
+                print('Shard {}/{} failed: {!r}'.format(shard_id, num_shards, e))
+                failed.append(shard_id)
+                continue
+            rate = num_images / elapsed if elapsed > 0 else 0.0
+            print('Shard {}/{}: encoded {} images in {:.1f}s ({:.2f} images/sec)'.format(
+                shard_id, num_shards, num_images, elapsed, rate))
+
+    if failed:
+        print('Shards {} failed, run again to resume them'.format(failed))
+        return False
+
+    prefixes = [shard_prefix(store_prefix, shard_id, num_shards) for shard_id in range(num_shards)]
+    print('Merging {} shards into {}...'.format(num_shards, store_prefix))
+    merge_stores(prefixes, store_prefix)
+    manifest = {}
+    for prefix in prefixes:
+        manifest.update(load_manifest(prefix + '.manifest.json'))
+    save_manifest(store_prefix + '.manifest.json', manifest)
+    print('Written to {}'.format(store_prefix))
+    return True
+
 if __name__ == '__main__':
-    image_dir ='F:/Leisure_Projects/retinaface/DATA/Images'
-    json_path = 'F:/Leisure_Projects/retinaface/DATA/Images.json'
-    images_2_json(image_dir, json_path)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Encode an image directory into the embedding store')
+    parser.add_argument('--image-dir', default='F:/Leisure_Projects/retinaface/DATA/Images')
+    parser.add_argument('--store', default='F:/Leisure_Projects/retinaface/DATA/Images',
+                        help='embedding store prefix')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='image decode / alignment threads, 0 to run everything in the main thread')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--max-latency', type=float, default=2.0)
+    parser.add_argument('--shards', type=int, default=0,
+                        help='encode in this many CPU processes and merge their stores, 0 for one process')
+    parser.add_argument('--threads-per-shard', type=int, default=1,
+                        help='intra-op threads of every shard process')
+    args = parser.parse_args()
+    if args.shards > 0:
+        sharded_images_2_store(args.image_dir, args.store, args.shards, args.threads_per_shard,
+                               args.batch_size, args.max_latency, args.workers)
+    else:
+        images_2_store(args.image_dir, args.store, args.batch_size, args.max_latency, args.workers)
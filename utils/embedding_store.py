@@ -0,0 +1,235 @@
+"""
+Binary embedding store, a compact replacement for DATA/Images.json
+
+A store is a group of files sharing one prefix (e.g. ./DATA/Images):
+    <prefix>.f32        raw little-endian float32 matrix, one embedding per row
+    <prefix>.offsets    raw little-endian int64, image i owns rows offsets[i]:offsets[i + 1]
+    <prefix>.names      utf-8 image names, one per line, in offsets order
+    <prefix>.meta.json  embedding dimension and format version
+
+The matrix and offsets are opened with np.memmap, so opening a store costs
+milliseconds regardless of its size and the OS page cache is shared between
+every process searching the same gallery.
+"""
+import os
+import json
+import numpy as np
+
+from .gallery import Gallery
+
+STORE_VERSION = 1
+VECTOR_DTYPE = np.dtype('<f4')
+OFFSET_DTYPE = np.dtype('<i8')
+
+
+def store_paths(prefix):
+    return {'vectors': prefix + '.f32',
+            'offsets': prefix + '.offsets',
+            'names': prefix + '.names',
+            'meta': prefix + '.meta.json'}
+
+
+def store_exists(prefix):
+    return all(os.path.exists(p) for p in store_paths(prefix).values())
+
+
+def read_meta(prefix):
+    with open(store_paths(prefix)['meta'], 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != STORE_VERSION:
+        raise ValueError('Unsupported store version {} in {}'.format(meta['version'], prefix))
+    return meta
+
+
+def _names_length(path, num_images):
+    # Byte length of the first num_images lines of a names file
+    with open(path, 'rb') as f:
+        data = f.read()
+    if num_images == 0:
+        return 0
+    return len(b'\n'.join(data.split(b'\n', num_images)[:num_images])) + 1
+
+
+class StoreWriter:
+    """
+    Writes a store image by image without holding the gallery in memory.
+
+    The meta file is only written by commit() and close(), so an interrupted
+    write never looks complete. With append=True an existing store is extended
+    instead; its meta file keeps describing the last commit, and anything
+    written after it by an interrupted append is truncated away.
+    """
+
+    def __init__(self, prefix, dim=512, append=False):
+        self.prefix = prefix
+        self.dim = dim
+        self.paths = store_paths(prefix)
+        if append and store_exists(prefix):
+            meta = read_meta(prefix)
+            if meta['dim'] != dim:
+                raise ValueError('Store has dimension {}, not {}'.format(meta['dim'], dim))
+            self.num_rows = meta['rows']
+            self.num_images = meta['images']
+            names_length = _names_length(self.paths['names'], self.num_images)
+            self._vectors = self._open_truncated(self.paths['vectors'], self.num_rows * dim * VECTOR_DTYPE.itemsize)
+            self._offsets = self._open_truncated(self.paths['offsets'], (self.num_images + 1) * OFFSET_DTYPE.itemsize)
+            self._names = self._open_truncated(self.paths['names'], names_length)
+        else:
+            if os.path.exists(self.paths['meta']):
+                os.remove(self.paths['meta'])
+            self._vectors = open(self.paths['vectors'], 'wb')
+            self._offsets = open(self.paths['offsets'], 'wb')
+            self._names = open(self.paths['names'], 'wb')
+            self.num_rows = 0
+            self.num_images = 0
+            self._offsets.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+
+    @staticmethod
+    def _open_truncated(path, size):
+        f = open(path, 'r+b')
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    def append(self, name, vectors):
+        """
+        :param name: image name, must not contain a newline
+        :param vectors: (n, dim) array or list of vectors, n may be 0
+        """
+        if '\n' in name:
+            raise ValueError('Image name {!r} contains a newline'.format(name))
+        vectors = np.asarray(vectors, dtype=VECTOR_DTYPE).reshape((-1, self.dim))
+        self._vectors.write(vectors.tobytes())
+        self.num_rows += vectors.shape[0]
+        self.num_images += 1
+        self._offsets.write(np.array([self.num_rows], dtype=OFFSET_DTYPE).tobytes())
+        self._names.write((name + '\n').encode('utf-8'))
+
+    def commit(self):
+        """
+        Make everything appended so far durable, a later append resumes from here
+        """
+        for f in (self._vectors, self._offsets, self._names):
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path = self.paths['meta'] + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': STORE_VERSION, 'dim': self.dim,
+                       'rows': self.num_rows, 'images': self.num_images}, f)
+        os.replace(tmp_path, self.paths['meta'])
+
+    def close(self):
+        self.commit()
+        self._vectors.close()
+        self._offsets.close()
+        self._names.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._vectors.close()
+            self._offsets.close()
+            self._names.close()
+
+
+def _memmap(path, dtype, shape):
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+def open_store(prefix):
+    """
+    Memory-map a store and wrap it in a Gallery
+    """
+    paths = store_paths(prefix)
+    meta = read_meta(prefix)
+    dim = meta['dim']
+
+    matrix = _memmap(paths['vectors'], VECTOR_DTYPE, (meta['rows'], dim))
+    offsets = _memmap(paths['offsets'], OFFSET_DTYPE, (meta['images'] + 1,))
+    with open(paths['names'], 'r', encoding='utf-8', newline='\n') as f:
+        names = f.read().split('\n')[:meta['images']]
+    if len(names) != meta['images']:
+        raise ValueError('Store {} has {} names for {} images'.format(prefix, len(names), meta['images']))
+    return Gallery(matrix, names, offsets)
+
+
+def remove_images(prefix, names):
+    """
+    Rewrite the store without the given images, keeping the order of the rest
+    """
+    names = set(names)
+    tmp_prefix = prefix + '.tmp'
+    gallery = open_store(prefix)
+    dim = gallery.matrix.shape[1]
+    with StoreWriter(tmp_prefix, dim) as writer:
+        for i, name in enumerate(gallery.names):
+            if name in names:
+                continue
+            writer.append(name, gallery.matrix[gallery.offsets[i]:gallery.offsets[i + 1]])
+    # Drop the memory maps before their files are replaced
+    del gallery
+
+    paths = store_paths(prefix)
+    tmp_paths = store_paths(tmp_prefix)
+    os.remove(paths['meta'])
+    for key in ('vectors', 'offsets', 'names', 'meta'):
+        os.replace(tmp_paths[key], paths[key])
+    return writer.num_images, writer.num_rows
+
+
+def merge_stores(prefixes, out_prefix):
+    """
+    Concatenate several stores into a new store at out_prefix
+    """
+    dim = read_meta(prefixes[0])['dim']
+    with StoreWriter(out_prefix, dim) as writer:
+        for prefix in prefixes:
+            gallery = open_store(prefix)
+            if gallery.matrix.shape[1] != dim:
+                raise ValueError('Cannot merge stores of different dimensions')
+            for i, name in enumerate(gallery.names):
+                writer.append(name, gallery.matrix[gallery.offsets[i]:gallery.offsets[i + 1]])
+            del gallery
+    return writer.num_images, writer.num_rows
+
+
+def json_2_store(json_path, prefix, dim=512):
+    """
+    One-shot conversion of an Images.json written by Encode_dir.images_2_json
+    """
+    with open(json_path, 'r') as f:
+        vector_dict = json.load(f)
+    with StoreWriter(prefix, dim) as writer:
+        for image_name, vector_list in vector_dict.items():
+            writer.append(image_name, vector_list)
+    return writer.num_images, writer.num_rows
+
+
+def load_gallery(prefix, json_path=None):
+    """
+    Open the store at prefix, converting json_path into it first if the store
+    does not exist yet
+    """
+    if not store_exists(prefix):
+        if json_path is None or not os.path.exists(json_path):
+            raise IOError('No embedding store at {}'.format(prefix))
+        print('Converting {} to a binary store at {}...'.format(json_path, prefix))
+        json_2_store(json_path, prefix)
+    return open_store(prefix)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert Images.json to a binary embedding store')
+    parser.add_argument('json_path')
+    parser.add_argument('prefix')
+    parser.add_argument('--dim', type=int, default=512)
+    args = parser.parse_args()
+    num_images, num_rows = json_2_store(args.json_path, args.prefix, args.dim)
+    print('Written {} images / {} faces to {}'.format(num_images, num_rows, args.prefix))
@@ -0,0 +1,180 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+class FaceBatcher:
+    """
+    Accumulates aligned faces across images into fixed-size recognition batches.
+
+    Faces are embedded in the order they were added, so images complete in
+    that order too; every completed image is appended to the store writer
+    together with its embeddings and reported through on_image_done. A batch
+    is run as soon as batch_size faces are pending, or once the oldest pending
+    face has waited max_latency seconds. That wait is only checked when poll()
+    is called, which add_image does after every image; call it on a timer as
+    well when images may arrive further apart than max_latency.
+    """
+
+    def __init__(self, Recognizer, writer, batch_size=64, max_latency=2.0, on_image_done=None):
+        self.Recognizer = Recognizer
+        self.writer = writer
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.on_image_done = on_image_done
+
+        self._faces = []
+        # Arrival time of every pending face
+        self._arrivals = []
+        # [image_name, num_faces, embeddings received so far], in arrival order
+        self._images = deque()
+        self.num_batches = 0
+        self.num_faces = 0
+
+    def add_image(self, image_name, aligned_list):
+        self._images.append([image_name, len(aligned_list), []])
+        self._faces.extend(aligned_list)
+        self._arrivals.extend([time.time()] * len(aligned_list))
+        while len(self._faces) >= self.batch_size:
+            self._run_batch()
+        self._write_completed()
+        self.poll()
+
+    def poll(self):
+        """
+        Flush the pending faces if the oldest of them has waited too long
+        """
+        if self._arrivals and time.time() - self._arrivals[0] >= self.max_latency:
+            self.flush()
+
+    def flush(self):
+        while len(self._faces) > 0:
+            self._run_batch()
+        self._write_completed()
+
+    def _run_batch(self):
+        batch = self._faces[:self.batch_size]
+        del self._faces[:self.batch_size]
+        del self._arrivals[:self.batch_size]
+        vectors = self.Recognizer.face_vertorizing_batch(batch)
+        self.num_batches += 1
+        self.num_faces += len(batch)
+
+        # Hand the embeddings to their images, oldest image first
+        start = 0
+        for image in self._images:
+            missing = image[1] - len(image[2])
+            if missing == 0:
+                continue
+            take = min(missing, len(batch) - start)
+            image[2].extend(vectors[start:start + take])
+            start += take
+            if start == len(batch):
+                break
+
+    def _write_completed(self):
+        while self._images and len(self._images[0][2]) == self._images[0][1]:
+            image_name, _, vectors = self._images.popleft()
+            self.writer.append(image_name, vectors)
+            if self.on_image_done is not None:
+                self.on_image_done(image_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
+def align_detections(Recognizer, image, faces, landmarks):
+    """
+    :return: list of aligned (3, 112, 112) crops for the detected faces
+    """
+    if faces.shape[0] == 0:
+        return []
+    # Landmarks are truncated to integers, as they always were for prepare_insight_input
+    aligned = Recognizer.prepare_insight_input_batch(landmarks.astype(np.int64), image)
+    return list(aligned)
+
+
+_DECODE_DONE = object()
+
+
+def iter_aligned(image_dir, image_names, detector, Recognizer, thresh, workers=4, queue_size=64,
+                 on_idle=None, idle_timeout=0.5):
+    """
+    Producer/consumer pipeline around the detector: a pool of workers threads
+    decodes images ahead of the detector, and the same number of threads align
+    the detected faces while the caller's thread runs the next forward. Both
+    stages are bounded by queue_size images, so a slow model holds the readers back.
+    cv2.imread and cv2.warpAffine release the GIL, which lets the threads use
+    the cores the models leave idle.
+
+    :param on_idle: called every idle_timeout seconds while the detector waits for
+                    decoded images, e.g. FaceBatcher.poll; not used when workers=0
+    :return: generator of (image_name, aligned_list), aligned_list is None for
+             images that could not be read; images come out in decode order
+    """
+    if workers <= 0:
+        for image_name in image_names:
+            image = cv2.imread(os.path.join(image_dir, image_name))
+            if image is None:
+                yield image_name, None
+                continue
+            faces, landmarks = detector.detect(image, thresh)
+            yield image_name, align_detections(Recognizer, image, faces, landmarks)
+        return
+
+    names = queue.Queue()
+    for image_name in image_names:
+        names.put(image_name)
+    decoded = queue.Queue(maxsize=queue_size)
+
+    def decode_worker():
+        while True:
+            try:
+                image_name = names.get_nowait()
+            except queue.Empty:
+                break
+            decoded.put((image_name, cv2.imread(os.path.join(image_dir, image_name))))
+        decoded.put(_DECODE_DONE)
+
+    for _ in range(workers):
+        threading.Thread(target=decode_worker, daemon=True).start()
+
+    # (image_name, alignment future or None), in detection order
+    pending = deque()
+
+    def ready():
+        return pending and (len(pending) > queue_size or pending[0][1] is None or pending[0][1].done())
+
+    with ThreadPoolExecutor(max_workers=workers) as align_pool:
+        finished = 0
+        while finished < workers:
+            try:
+                item = decoded.get(timeout=None if on_idle is None else idle_timeout)
+            except queue.Empty:
+                on_idle()
+                continue
+            if item is _DECODE_DONE:
+                finished += 1
+                continue
+            image_name, image = item
+            if image is None:
+                pending.append((image_name, None))
+            else:
+                faces, landmarks = detector.detect(image, thresh)
+                pending.append((image_name, align_pool.submit(align_detections, Recognizer, image, faces, landmarks)))
+            while ready():
+                image_name, future = pending.popleft()
+                yield image_name, None if future is None else future.result()
+        while pending:
+            image_name, future = pending.popleft()
+            yield image_name, None if future is None else future.result()
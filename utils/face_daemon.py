@@ -0,0 +1,446 @@
+"""
+Local daemon that keeps RetinaFace, InsightFace and the gallery loaded.
+
+Importing mxnet, loading the checkpoints and binding the modules takes
+seconds, which every run of face_searching.py, WashImages.py and
+Encode_dir.py used to pay before touching its first image. The daemon pays
+it once and answers detect / embed / search over a Unix socket. connect()
+returns None when no daemon is listening (or the platform has no Unix
+sockets), and load_models() then loads the models in-process as before, so
+the scripts behave the same with or without the daemon.
+
+Protocol: every message is a 5-byte header struct('<BI') with the opcode
+(requests) or status (responses) and the payload length, followed by the
+payload, a sequence of arrays. Each array is struct('<BB') dtype code and
+ndim, ndim uint32 dimensions, then the raw little-endian data. Images and
+aligned faces travel as uint8, boxes, landmarks and embeddings as float32.
+    PING      -> uint8 [has_gallery]
+    DETECT    image (H, W, 3), threshold () -> faces (n, 5), landmarks (n, 5, 2)
+    EMBED     aligned (n, 3, 112, 112) -> embeddings (n, 512)
+    SEARCH    embeddings (n, 512), dist_thres () -> counts (n,), distances (m,), names
+    SHUTDOWN
+Search results are the m matches of all queries in order, counts[i] of them
+for query i; names is the '\\0' joined utf-8 image names as uint8.
+
+SEARCH always answers from the current store: the daemon checks the meta file
+of its gallery on every search and reopens the store after Encode_dir.py
+appended to it or remove_images() rewrote it. The socket is only accessible
+to the user running the daemon, since any client can run the models or stop
+it; by default it lives in $XDG_RUNTIME_DIR, or in the temp directory under
+a per-user name.
+
+Start it from the repository root with
+    python -m utils.face_daemon serve --gallery ./DATA/Images
+"""
+import os
+import socket
+import struct
+import tempfile
+import threading
+import socketserver
+
+import numpy as np
+
+
+def _default_socket():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'face_searching.sock')
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), 'face_searching-{}.sock'.format(user))
+
+
+DEFAULT_SOCKET = os.environ.get('FACE_DAEMON_SOCKET') or _default_socket()
+
+OP_PING, OP_DETECT, OP_EMBED, OP_SEARCH, OP_SHUTDOWN = range(5)
+STATUS_OK, STATUS_ERROR = 0, 1
+
+_HEADER = struct.Struct('<BI')
+_ARRAY_HEADER = struct.Struct('<BB')
+_DTYPES = [np.dtype(np.uint8), np.dtype('<f4'), np.dtype('<i8')]
+
+
+def pack_arrays(*arrays):
+    chunks = []
+    for array in arrays:
+        array = np.asarray(array)
+        if array.dtype == np.float64:
+            array = array.astype(np.float32)
+        code = _DTYPES.index(array.dtype)
+        chunks.append(_ARRAY_HEADER.pack(code, array.ndim))
+        chunks.append(struct.pack('<{}I'.format(array.ndim), *array.shape))
+        chunks.append(array.tobytes())
+    return b''.join(chunks)
+
+
+def unpack_arrays(payload):
+    arrays = []
+    offset = 0
+    while offset < len(payload):
+        code, ndim = _ARRAY_HEADER.unpack_from(payload, offset)
+        offset += _ARRAY_HEADER.size
+        shape = struct.unpack_from('<{}I'.format(ndim), payload, offset)
+        offset += 4 * ndim
+        dtype = _DTYPES[code]
+        count = int(np.prod(shape))
+        arrays.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape))
+        offset += count * dtype.itemsize
+    return arrays
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError('Connection closed by the other side')
+        received += n
+    return bytes(buf)
+
+
+def send_message(sock, code, payload=b''):
+    sock.sendall(_HEADER.pack(code, len(payload)))
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    code, size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return code, _recv_exactly(sock, size) if size else b''
+
+
+def pack_matches(matches):
+    counts = np.array([len(m) for m in matches], dtype=np.int64)
+    dists = np.array([dist for m in matches for _, dist in m], dtype=np.float32)
+    names = '\0'.join(name for m in matches for name, _ in m).encode('utf-8')
+    return pack_arrays(counts, dists, np.frombuffer(names, dtype=np.uint8))
+
+
+def unpack_matches(arrays):
+    counts, dists, names = arrays
+    names = names.tobytes().decode('utf-8').split('\0') if dists.shape[0] else []
+    matches = []
+    start = 0
+    for count in counts.tolist():
+        matches.append(list(zip(names[start:start + count], dists[start:start + count].tolist())))
+        start += count
+    return matches
+
+
+class FaceDaemon:
+
+    def __init__(self, detector, Recognizer, gallery=None, gallery_prefix=None):
+        """
+        :param gallery: a fixed Gallery to search
+        :param gallery_prefix: embedding store to search instead, reopened whenever its meta file changed
+        """
+        self.detector = detector
+        self.Recognizer = Recognizer
+        self.gallery = gallery
+        self.gallery_prefix = gallery_prefix
+        self._gallery_stamp = None
+        # MXNet modules are not thread-safe, connections take turns on the models
+        self.lock = threading.Lock()
+        self.gallery_lock = threading.Lock()
+        if gallery_prefix is not None:
+            self.current_gallery()
+
+    def current_gallery(self):
+        """
+        The gallery, reopened first if the store at gallery_prefix was written since it was opened
+        """
+        if self.gallery_prefix is None:
+            return self.gallery
+        from .embedding_store import open_store, store_paths
+
+        with self.gallery_lock:
+            try:
+                with open(store_paths(self.gallery_prefix)['meta'], 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    # commit() replaces the meta file: a new inode, mtime or content means new rows or images
+                    stamp = (st.st_ino, st.st_mtime_ns, f.read())
+            except FileNotFoundError:
+                # StoreWriter and remove_images() delete the meta file while they rewrite the store
+                raise ValueError('The gallery store {} is being rewritten, retry later'.format(self.gallery_prefix))
+            if stamp != self._gallery_stamp:
+                self.gallery = open_store(self.gallery_prefix)
+                self._gallery_stamp = stamp
+            return self.gallery
+
+    def handle(self, op, arrays):
+        if op == OP_PING:
+            has_gallery = self.gallery is not None or self.gallery_prefix is not None
+            return pack_arrays(np.array([has_gallery], dtype=np.uint8))
+        if op == OP_DETECT:
+            img, threshold = arrays
+            with self.lock:
+                faces, landmarks = self.detector.detect(img, float(threshold))
+            if landmarks is None:
+                landmarks = np.zeros((faces.shape[0], 5, 2), dtype=np.float32)
+            return pack_arrays(faces, landmarks)
+        if op == OP_EMBED:
+            aligned, = arrays
+            with self.lock:
+                vectors = self.Recognizer.face_vertorizing_batch(list(aligned))
+            return pack_arrays(vectors)
+        if op == OP_SEARCH:
+            gallery = self.current_gallery()
+            if gallery is None:
+                raise ValueError('The daemon was started without a gallery')
+            vectors, dist_thres = arrays
+            return pack_matches(gallery.search_threshold_batch(vectors, float(dist_thres)))
+        raise ValueError('Unknown opcode {}'.format(op))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        daemon = self.server.face_daemon
+        while True:
+            try:
+                op, payload = recv_message(self.request)
+            except ConnectionError:
+                return
+            if op == OP_SHUTDOWN:
+                send_message(self.request, STATUS_OK)
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            try:
+                response = daemon.handle(op, unpack_arrays(payload))
+            except Exception as e:
+                send_message(self.request, STATUS_ERROR, repr(e).encode('utf-8'))
+                continue
+            send_message(self.request, STATUS_OK, response)
+
+
+def serve(socket_path=DEFAULT_SOCKET, detector_prefix='./model/mnet.25/mnet.25',
+          recognizer_prefix='./model/insightface/insightface', gallery_prefix=None, gpuid=0):
+    from .embedding_store import load_gallery
+
+    print('Loading Models...')
+    detector, Recognizer = load_models(detector_prefix, recognizer_prefix, gpuid)
+    if gallery_prefix:
+        # Converts Images.json on first use, the daemon reopens the store itself afterwards
+        load_gallery(gallery_prefix, json_path=gallery_prefix + '.json')
+    daemon = FaceDaemon(detector, Recognizer, gallery_prefix=gallery_prefix or None)
+    print('Done!')
+
+    if os.path.exists(socket_path):
+        if connect(socket_path) is not None:
+            raise RuntimeError('A daemon is already listening on {}'.format(socket_path))
+        os.remove(socket_path)
+    # Owner only, from the moment the socket exists
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _Handler)
+    finally:
+        os.umask(old_umask)
+    os.chmod(socket_path, 0o600)
+    server.daemon_threads = True
+    server.face_daemon = daemon
+    print('Listening on {}'.format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class DaemonClient:
+
+    def __init__(self, sock, socket_path):
+        self.sock = sock
+        self.socket_path = socket_path
+        self.lock = threading.Lock()
+        self.has_gallery = bool(self.call(OP_PING)[0][0])
+
+    def call(self, op, *arrays):
+        with self.lock:
+            send_message(self.sock, op, pack_arrays(*arrays))
+            status, payload = recv_message(self.sock)
+        if status != STATUS_OK:
+            raise RuntimeError('Face daemon error: {}'.format(payload.decode('utf-8')))
+        return unpack_arrays(payload)
+
+    def shutdown(self):
+        with self.lock:
+            send_message(self.sock, OP_SHUTDOWN)
+            recv_message(self.sock)
+
+    def close(self):
+        self.sock.close()
+
+
+def connect(socket_path=None, timeout=None):
+    """
+    :return: a DaemonClient, or None if no daemon listens on socket_path
+    """
+    if socket_path is None:
+        socket_path = DEFAULT_SOCKET
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        return DaemonClient(sock, socket_path)
+    except (OSError, ConnectionError):
+        sock.close()
+        return None
+
+
+class RemoteDetector:
+    """
+    RetinaFace.detect served by the daemon
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def detect(self, img, threshold=0.5, scales=1.0):
+        if scales != 1.0:
+            import cv2
+            img = cv2.resize(img, None, None, fx=scales, fy=scales, interpolation=cv2.INTER_LINEAR)
+        faces, landmarks = self.client.call(OP_DETECT, img, np.array(threshold, dtype=np.float32))
+        if scales != 1.0:
+            faces = faces.copy()
+            faces[:, :4] /= scales
+            landmarks = landmarks / scales
+        return faces, landmarks
+
+
+class RemoteRecognizer:
+    """
+    InsightFace embeddings computed by the daemon, faces are aligned locally
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def prepare_insight_input(face, landmark, face_img):
+        import cv2
+        from . import face_preprocess
+
+        nimg = face_preprocess.preprocess(face_img, face[:4], landmark, image_size='112,112')
+        nimg = cv2.cvtColor(nimg, cv2.COLOR_BGR2RGB)
+        return np.transpose(nimg, (2, 0, 1))
+
+    @staticmethod
+    def prepare_insight_input_batch(landmarks, face_img):
+        from . import face_preprocess
+
+        nimgs = face_preprocess.align_batch(face_img, landmarks, image_size=(112, 112))
+        return nimgs[:, :, :, ::-1].transpose((0, 3, 1, 2))
+
+    def face_vertorizing_batch(self, aligned_list):
+        if len(aligned_list) == 0:
+            return np.zeros((0, 512), dtype=np.float32)
+        return self.client.call(OP_EMBED, np.asarray(aligned_list, dtype=np.uint8))[0]
+
+    def face_vertorizing(self, aligned):
+        return self.face_vertorizing_batch([aligned])[0]
+
+
+class RemoteGallery:
+    """
+    Gallery.search_threshold answered by the current store of the daemon
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def search_threshold_batch(self, vectors, dist_thres=1.0):
+        if len(vectors) == 0:
+            return []
+        arrays = self.client.call(OP_SEARCH, np.asarray(vectors, dtype=np.float32),
+                                  np.array(dist_thres, dtype=np.float32))
+        return unpack_matches(arrays)
+
+    def search_threshold(self, vector, dist_thres=1.0):
+        return self.search_threshold_batch([vector], dist_thres)[0]
+
+
+def load_models(detector_prefix, recognizer_prefix, gpuid=0, client=None, recognizer_batch_size=32):
+    """
+    The detector and recognizer of the daemon behind client, or models loaded in-process
+    when client is None. A None prefix skips that model.
+    :return: detector, Recognizer
+    """
+    if client is not None:
+        print('Using the face daemon at {}'.format(client.socket_path))
+        return (RemoteDetector(client) if detector_prefix is not None else None,
+                RemoteRecognizer(client) if recognizer_prefix is not None else None)
+
+    detector, Recognizer = None, None
+    if detector_prefix is not None:
+        from .retinaface import RetinaFace
+        detector = RetinaFace(detector_prefix, 0, gpuid)
+    if recognizer_prefix is not None:
+        from .insightface import InsightFace
+        Recognizer = InsightFace(recognizer_prefix, 0, gpuid, max_batch_size=recognizer_batch_size)
+    return detector, Recognizer
+
+
+def _command(args):
+    """
+    One-shot detect / embed / search of an image, through the daemon when one is running
+    """
+    import cv2
+    from .embedding_store import load_gallery
+    from .encode_pipeline import align_detections
+
+    client = None if args.no_daemon else connect(args.socket)
+    img = cv2.imread(args.image)
+    detector, Recognizer = load_models(args.detector, args.recognizer if args.command != 'detect' else None,
+                                       args.gpuid, client)
+    faces, landmarks = detector.detect(img, args.threshold)
+    print('{} faces'.format(faces.shape[0]))
+    if args.command == 'detect':
+        return
+    vectors = Recognizer.face_vertorizing_batch(align_detections(Recognizer, img, faces, landmarks))
+    if args.command == 'embed':
+        return
+    if client is not None and client.has_gallery:
+        gallery = RemoteGallery(client)
+    else:
+        gallery = load_gallery(args.gallery, json_path=args.gallery + '.json')
+    for i, matches in enumerate(gallery.search_threshold_batch(vectors, args.dist_thres)):
+        print('Face {}: {}'.format(i, [name for name, _ in matches]))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Face model daemon and its one-shot commands')
+    parser.add_argument('command', choices=['serve', 'stop', 'ping', 'detect', 'embed', 'search'])
+    parser.add_argument('image', nargs='?', help='image of the detect / embed / search commands')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--detector', default='./model/mnet.25/mnet.25')
+    parser.add_argument('--recognizer', default='./model/insightface/insightface')
+    parser.add_argument('--gallery', default='./DATA/Images', help='embedding store prefix')
+    parser.add_argument('--gpuid', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--dist-thres', type=float, default=1.0)
+    parser.add_argument('--no-daemon', action='store_true', help='always run in-process')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket, args.detector, args.recognizer, args.gallery, args.gpuid)
+    elif args.command in ('stop', 'ping'):
+        client = connect(args.socket)
+        if client is None:
+            print('No daemon listening on {}'.format(args.socket))
+        elif args.command == 'stop':
+            client.shutdown()
+            print('Stopped the daemon on {}'.format(args.socket))
+        else:
+            print('Daemon listening on {}, gallery loaded: {}'.format(args.socket, client.has_gallery))
+    else:
+        if args.image is None:
+            parser.error('{} needs an image'.format(args.command))
+        _command(args)
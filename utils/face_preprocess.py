@@ -1,6 +1,129 @@
 import cv2
 import numpy as np
-from skimage import transform as trans
+
+
+def similarity_transform(src, dst):
+    """
+    Least-squares similarity transform (rotation, uniform scale, translation)
+    mapping the points src onto dst, by the Umeyama method. Same result as
+    skimage.transform.SimilarityTransform().estimate(src, dst), without
+    importing skimage.
+
+    :param src: (N, 2) points
+    :param dst: (N, 2) points
+    :return: (3, 3) homogeneous transform matrix
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    num, dim = src.shape
+
+    src_mean = src.mean(axis=0)
+    dst_mean = dst.mean(axis=0)
+    src_demean = src - src_mean
+    dst_demean = dst - dst_mean
+
+    A = np.dot(dst_demean.T, src_demean) / num
+    d = np.ones((dim,), dtype=np.float64)
+    if np.linalg.det(A) < 0:
+        d[dim - 1] = -1
+
+    T = np.eye(dim + 1, dtype=np.float64)
+    U, S, V = np.linalg.svd(A)
+    rank = np.linalg.matrix_rank(A)
+    if rank == 0:
+        return np.nan * T
+    elif rank == dim - 1:
+        if np.linalg.det(U) * np.linalg.det(V) > 0:
+            T[:dim, :dim] = np.dot(U, V)
+        else:
+            s = d[dim - 1]
+            d[dim - 1] = -1
+            T[:dim, :dim] = np.dot(U, np.dot(np.diag(d), V))
+            d[dim - 1] = s
+    else:
+        T[:dim, :dim] = np.dot(U, np.dot(np.diag(d), V))
+
+    scale = 1.0 / src_demean.var(axis=0).sum() * np.dot(S, d)
+    T[:dim, dim] = dst_mean - scale * np.dot(T[:dim, :dim], src_mean.T)
+    T[:dim, :dim] *= scale
+    return T
+
+
+def similarity_transform_batch(src, dst):
+    """
+    similarity_transform for a batch of point sets at once: the Umeyama
+    steps run on stacked arrays (batched 2x2 SVDs) instead of a Python loop.
+
+    :param src: (B, N, 2) points
+    :param dst: (B, N, 2) points, or (N, 2) shared by the whole batch
+    :return: (B, 2, 3) affine matrices, NaN for degenerate point sets
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.broadcast_to(np.asarray(dst, dtype=np.float64), src.shape)
+    num = src.shape[1]
+
+    src_mean = src.mean(axis=1)
+    dst_mean = dst.mean(axis=1)
+    src_demean = src - src_mean[:, np.newaxis, :]
+    dst_demean = dst - dst_mean[:, np.newaxis, :]
+
+    A = np.einsum('bni,bnj->bij', dst_demean, src_demean) / num
+    d = np.ones((A.shape[0], 2), dtype=np.float64)
+    d[np.linalg.det(A) < 0, 1] = -1
+
+    U, S, V = np.linalg.svd(A)
+    rank = np.linalg.matrix_rank(A)
+    # Rank 1: the reflection is decided by U and V rather than by det(A)
+    d_rot = d.copy()
+    rank1 = rank == 1
+    d_rot[rank1, 1] = np.where(np.linalg.det(U[rank1]) * np.linalg.det(V[rank1]) > 0, 1.0, -1.0)
+    R = np.einsum('bij,bj,bjk->bik', U, d_rot, V)
+
+    # Coincident points (rank 0) divide 0 by 0, their matrices are set to NaN below
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.einsum('bi,bi->b', S, d) / src_demean.var(axis=1).sum(axis=1)
+    M = np.empty((src.shape[0], 2, 3), dtype=np.float64)
+    M[:, :, 2] = dst_mean - scale[:, np.newaxis] * np.einsum('bij,bj->bi', R, src_mean)
+    M[:, :, :2] = R * scale[:, np.newaxis, np.newaxis]
+    M[rank == 0] = np.nan
+    return M
+
+
+def landmark_template(image_size=(112, 112)):
+    """
+    Reference positions of the 5 landmarks in the aligned crop
+    """
+    src = np.array([
+        [30.2946, 51.6963],
+        [65.5318, 51.5014],
+        [48.0252, 71.7366],
+        [33.5493, 92.3655],
+        [62.7299, 92.2041]], dtype=np.float32)
+    if image_size[1] == 112:
+        src[:, 0] += 8.0
+    return src
+
+
+def align_batch(img, landmarks, image_size=(112, 112), out=None):
+    """
+    Aligned crops of many faces: the transforms of all faces are estimated
+    together by similarity_transform_batch, then each face is warped straight
+    into its slot of one (B, H, W, 3) array. Same crops as preprocess(img,
+    landmark=landmark, image_size='112,112') per face.
+
+    :param img: image of the faces, or a list of B images, one per face
+    :param landmarks: (B, 5, 2) landmarks
+    :param out: optional (B, H, W, 3) uint8 destination
+    :return: (B, H, W, 3) aligned crops
+    """
+    landmarks = np.asarray(landmarks).astype(np.float32).reshape((-1, 5, 2))
+    M = similarity_transform_batch(landmarks, landmark_template(image_size))
+    if out is None:
+        out = np.empty((landmarks.shape[0], image_size[0], image_size[1], 3), dtype=np.uint8)
+    for b in range(landmarks.shape[0]):
+        face_img = img if isinstance(img, np.ndarray) else img[b]
+        cv2.warpAffine(face_img, M[b], (image_size[1], image_size[0]), dst=out[b], borderValue=0.0)
+    return out
 
 
 def parse_lst_line(line):
@@ -56,19 +179,10 @@ def preprocess(img, bbox=None, landmark=None, **kwargs):
         assert image_size[0] == 112 or image_size[1] == 96
     if landmark is not None:
         assert len(image_size) == 2
-        src = np.array([
-            [30.2946, 51.6963],
-            [65.5318, 51.5014],
-            [48.0252, 71.7366],
-            [33.5493, 92.3655],
-            [62.7299, 92.2041]], dtype=np.float32)
-        if image_size[1] == 112:
-            src[:, 0] += 8.0
+        src = landmark_template(image_size)
         dst = landmark.astype(np.float32)
 
-        tform = trans.SimilarityTransform()
-        tform.estimate(dst, src)
-        M = tform.params[0:2, :]
+        M = similarity_transform(dst, src)[0:2, :]
         # M = cv2.estimateRigidTransform( dst.reshape(1,5,2), src.reshape(1,5,2), False)
 
     if M is None:
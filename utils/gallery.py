@@ -0,0 +1,141 @@
+import numpy as np
+
+
+class ExactIndex:
+    """
+    Brute-force search over the whole gallery matrix, the reference engine.
+
+    Every engine answers search(vector, top_k) with the top_k (rows, distances)
+    sorted by ascending distance, and search_threshold(vector, dist_thres) with
+    all (rows, distances) closer than dist_thres in row order.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def distances(self, vector):
+        """
+        Squared L2 distance from a normalized query vector to every gallery row
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        dist = self.matrix.dot(vector)
+        dist *= -2.0
+        dist += 2.0
+        return dist
+
+    def search(self, vector, top_k=10):
+        dist = self.distances(vector)
+        if top_k < dist.shape[0]:
+            rows = np.argpartition(dist, top_k - 1)[:top_k]
+        else:
+            rows = np.arange(dist.shape[0])
+        rows = rows[np.argsort(dist[rows], kind='stable')]
+        return rows, dist[rows]
+
+    def search_threshold(self, vector, dist_thres=1.0):
+        dist = self.distances(vector)
+        rows = np.where(dist < dist_thres)[0]
+        return rows, dist[rows]
+
+    def search_threshold_batch(self, vectors, dist_thres=1.0):
+        """
+        search_threshold for a (B, dim) batch of queries with one matrix product
+        :return: list of (rows, distances), one per query
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dist = vectors.dot(self.matrix.T)
+        dist *= -2.0
+        dist += 2.0
+        results = []
+        for b in range(dist.shape[0]):
+            rows = np.where(dist[b] < dist_thres)[0]
+            results.append((rows, dist[b, rows]))
+        return results
+
+
+class Gallery:
+    """
+    All gallery embeddings packed into one contiguous float32 (N, dim) matrix.
+
+    Image i owns the rows offsets[i]:offsets[i + 1] of the matrix, so an image
+    without faces simply owns an empty range. Embeddings produced by
+    InsightFace.face_vertorizing are L2-normalized, which lets every query be a
+    single matrix-vector product: |a - b|^2 = 2 - 2 * a.b
+
+    Queries go through self.index, an ExactIndex unless another engine
+    (e.g. IVFIndex) built over the same rows is passed in or assigned. Engines
+    answer with row numbers, so one saved next to a store is only valid until
+    remove_images compacts that store: add the rows again (IVFIndex.add) or
+    rebuild (HNSWIndex) after it.
+    """
+
+    def __init__(self, matrix, names, offsets, index=None):
+        self.matrix = matrix
+        self.names = names
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        assert self.offsets.shape[0] == len(self.names) + 1
+        assert self.offsets[-1] == self.matrix.shape[0]
+        self.index = index if index is not None else ExactIndex(self.matrix)
+
+    @classmethod
+    def from_dict(cls, vector_dict, dim=512):
+        """
+        Build a gallery from the {image_name: [vector, ...]} dict stored in Images.json
+        """
+        names = list(vector_dict.keys())
+        counts = [len(vector_dict[name]) for name in names]
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        matrix = np.empty((offsets[-1], dim), dtype=np.float32)
+        for i, name in enumerate(names):
+            if counts[i] > 0:
+                matrix[offsets[i]:offsets[i + 1]] = vector_dict[name]
+        return cls(matrix, names, offsets)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def row_names(self, rows):
+        """
+        Map matrix rows back to the names of the images they came from
+        """
+        image_ids = np.searchsorted(self.offsets, rows, side='right') - 1
+        return [self.names[i] for i in image_ids]
+
+    def search(self, vector, top_k=10):
+        """
+        :param vector: normalized query embedding
+        :param top_k: number of nearest faces to return
+        :return: [(image_name, distance)] sorted by ascending distance
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        rows, dist = self.index.search(vector, top_k)
+        return list(zip(self.row_names(rows), dist.tolist()))
+
+    def search_threshold(self, vector, dist_thres=1.0):
+        """
+        :param vector: normalized query embedding
+        :param dist_thres: keep faces closer than this squared distance
+        :return: [(image_name, distance)] in gallery order, one entry per matching face
+        """
+        if len(self) == 0:
+            return []
+        rows, dist = self.index.search_threshold(vector, dist_thres)
+        return list(zip(self.row_names(rows), dist.tolist()))
+
+    def search_threshold_batch(self, vectors, dist_thres=1.0):
+        """
+        search_threshold for many queries at once; engines with a
+        search_threshold_batch answer them with a single matrix product
+        :param vectors: (B, dim) normalized query embeddings
+        :return: list of B search_threshold results
+        """
+        if len(self) == 0 or len(vectors) == 0:
+            return [[] for _ in range(len(vectors))]
+        if hasattr(self.index, 'search_threshold_batch'):
+            results = self.index.search_threshold_batch(vectors, dist_thres)
+        else:
+            results = [self.index.search_threshold(vector, dist_thres) for vector in vectors]
+        return [list(zip(self.row_names(rows), dist.tolist())) for rows, dist in results]
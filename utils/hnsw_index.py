@@ -0,0 +1,299 @@
+"""
+Hierarchical navigable small world (HNSW) graph index over normalized embeddings.
+
+Every inserted vector becomes a graph node whose id is its insertion order,
+so an index built over a gallery matrix answers with gallery rows. Rows
+appended to the embedding store later can be indexed without a rebuild:
+    index.update(gallery.matrix)
+Only appends keep the rows already indexed in place. remove_images, which
+Encode_dir runs for every changed or deleted image, compacts the matrix and
+shifts the rows after the first removed image; update then raises
+ValueError and the index has to be rebuilt, instead of silently answering
+with the wrong images.
+
+The index follows the ExactIndex query API and can be assigned to
+Gallery.index. ef_search trades recall for latency and can be changed at
+any time.
+"""
+import heapq
+import numpy as np
+
+
+class HNSWIndex:
+
+    def __init__(self, dim=512, M=16, ef_construction=200, ef_search=64, seed=0):
+        """
+        :param M: neighbours per node on the upper layers, 2 * M on layer 0
+        :param ef_construction: candidate list size while inserting
+        :param ef_search: candidate list size while querying
+        """
+        self.dim = dim
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self.level_mult = 1.0 / np.log(M)
+        self.rng = np.random.RandomState(seed)
+
+        self.count = 0
+        self.entry_point = -1
+        self.max_level = -1
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.levels = np.zeros(0, dtype=np.int32)
+        # Layer 0 holds every node, so its links are a dense (capacity, M0) table
+        self.links0 = np.zeros((0, self.M0), dtype=np.int32)
+        self.counts0 = np.zeros(0, dtype=np.int32)
+        # upper_links[l - 1] maps node -> neighbour list on layer l
+        self.upper_links = []
+        self._visited = np.zeros(0, dtype=np.uint32)
+        self._visit_tag = 0
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, n):
+        capacity = self.vectors.shape[0]
+        if n <= capacity:
+            return
+        capacity = max(n, 2 * capacity, 1024)
+
+        def grow(array):
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:array.shape[0]] = array
+            return grown
+
+        self.vectors = grow(self.vectors)
+        self.levels = grow(self.levels)
+        self.links0 = grow(self.links0)
+        self.counts0 = grow(self.counts0)
+        self._visited = grow(self._visited)
+
+    def _next_visit_tag(self):
+        self._visit_tag += 1
+        if self._visit_tag == np.iinfo(np.uint32).max:
+            self._visited[:] = 0
+            self._visit_tag = 1
+        return self._visit_tag
+
+    def _neighbors(self, node, level):
+        if level == 0:
+            return self.links0[node, :self.counts0[node]]
+        return np.asarray(self.upper_links[level - 1].get(node, ()), dtype=np.int32)
+
+    def _set_neighbors(self, node, level, neighbors):
+        if level == 0:
+            self.links0[node, :len(neighbors)] = neighbors
+            self.counts0[node] = len(neighbors)
+        else:
+            self.upper_links[level - 1][node] = list(neighbors)
+
+    def _distances(self, vector, ids):
+        return 2.0 - 2.0 * self.vectors[ids].dot(vector)
+
+    def _greedy_closest(self, vector, node, dist, level):
+        while True:
+            neighbors = self._neighbors(node, level)
+            if neighbors.shape[0] == 0:
+                return node, dist
+            d = self._distances(vector, neighbors)
+            i = int(np.argmin(d))
+            if d[i] >= dist:
+                return node, dist
+            node, dist = int(neighbors[i]), float(d[i])
+
+    def _search_layer(self, vector, entry_points, ef, level):
+        """
+        Best-first search of one layer
+        :param entry_points: [(distance, node)]
+        :return: up to ef [(distance, node)] sorted by ascending distance
+        """
+        tag = self._next_visit_tag()
+        visited = self._visited
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in entry_points]
+        heapq.heapify(results)
+        for _, n in entry_points:
+            visited[n] = tag
+
+        while candidates:
+            d, node = heapq.heappop(candidates)
+            if d > -results[0][0] and len(results) >= ef:
+                break
+            neighbors = self._neighbors(node, level)
+            neighbors = neighbors[visited[neighbors] != tag]
+            if neighbors.shape[0] == 0:
+                continue
+            visited[neighbors] = tag
+            furthest = -results[0][0]
+            for nd, n in zip(self._distances(vector, neighbors).tolist(), neighbors.tolist()):
+                if len(results) < ef or nd < furthest:
+                    heapq.heappush(candidates, (nd, n))
+                    heapq.heappush(results, (-nd, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+                    furthest = -results[0][0]
+        return sorted((-d, n) for d, n in results)
+
+    def _select_neighbors(self, candidates, M):
+        """
+        HNSW neighbour heuristic: keep a candidate only if it is closer to the
+        base node than to every neighbour already kept, which preserves links
+        between clusters
+        :param candidates: [(distance, node)] sorted by ascending distance
+        """
+        if len(candidates) <= M:
+            return [n for _, n in candidates]
+        ids = np.array([n for _, n in candidates], dtype=np.int32)
+        dist = np.array([d for d, _ in candidates], dtype=np.float32)
+        vecs = self.vectors[ids]
+        pair_dist = 2.0 - 2.0 * vecs.dot(vecs.T)
+        selected = []
+        for j in range(ids.shape[0]):
+            if not selected or np.all(dist[j] < pair_dist[j, selected]):
+                selected.append(j)
+                if len(selected) == M:
+                    break
+        return ids[selected].tolist()
+
+    def _insert(self, vector):
+        node = self.count
+        level = int(-np.log(1.0 - self.rng.uniform()) * self.level_mult)
+        self.vectors[node] = vector
+        self.levels[node] = level
+        self.count += 1
+        while len(self.upper_links) < level:
+            self.upper_links.append({})
+
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            return
+
+        ep = self.entry_point
+        ep_dist = float(self._distances(vector, [ep])[0])
+        for l in range(self.max_level, level, -1):
+            ep, ep_dist = self._greedy_closest(vector, ep, ep_dist, l)
+
+        entry_points = [(ep_dist, ep)]
+        for l in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(vector, entry_points, self.ef_construction, l)
+            neighbors = self._select_neighbors(found, self.M)
+            self._set_neighbors(node, l, neighbors)
+
+            max_links = self.M0 if l == 0 else self.M
+            for n in neighbors:
+                links = self._neighbors(n, l).tolist()
+                links.append(node)
+                if len(links) > max_links:
+                    d = self._distances(self.vectors[n], links)
+                    links = self._select_neighbors(sorted(zip(d.tolist(), links)), max_links)
+                self._set_neighbors(n, l, links)
+            entry_points = found
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def add(self, matrix):
+        """
+        Insert every row of matrix, continuing the node ids after the last insert
+        """
+        matrix = np.asarray(matrix, dtype=np.float32).reshape((-1, self.dim))
+        self._reserve(self.count + matrix.shape[0])
+        for vector in matrix:
+            self._insert(vector)
+        return self
+
+    def indexes_rows_of(self, matrix, chunk=65536):
+        """
+        Whether the nodes of the index are still the first len(self) rows of matrix
+        """
+        if matrix.shape[0] < self.count or matrix.shape[1] != self.dim:
+            return False
+        for start in range(0, self.count, chunk):
+            stop = min(start + chunk, self.count)
+            if not np.array_equal(self.vectors[start:stop], matrix[start:stop]):
+                return False
+        return True
+
+    def update(self, matrix):
+        """
+        Index the rows appended to matrix since the last add
+        :param matrix: the gallery matrix the index was built over, possibly grown since
+        """
+        if not self.indexes_rows_of(matrix):
+            raise ValueError('The indexed rows changed (images were removed from the store), rebuild the index')
+        return self.add(matrix[self.count:])
+
+    def _search(self, vector, ef):
+        vector = np.asarray(vector, dtype=np.float32)
+        ep = self.entry_point
+        ep_dist = float(self._distances(vector, [ep])[0])
+        for l in range(self.max_level, 0, -1):
+            ep, ep_dist = self._greedy_closest(vector, ep, ep_dist, l)
+        found = self._search_layer(vector, [(ep_dist, ep)], ef, 0)
+        rows = np.array([n for _, n in found], dtype=np.int64)
+        dist = np.array([d for d, _ in found], dtype=np.float32)
+        return rows, dist
+
+    def search(self, vector, top_k=10):
+        if self.count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, dist = self._search(vector, max(self.ef_search, top_k))
+        return rows[:top_k], dist[:top_k]
+
+    def search_threshold(self, vector, dist_thres=1.0):
+        """
+        Hits among the ef_search nearest candidates, so at most ef_search results
+        """
+        if self.count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, dist = self._search(vector, self.ef_search)
+        keep = dist < dist_thres
+        rows, dist = rows[keep], dist[keep]
+        order = np.argsort(rows)
+        return rows[order], dist[order]
+
+    def save(self, path):
+        upper_nodes, upper_levels, upper_counts, upper_neighbors = [], [], [], []
+        for l, links in enumerate(self.upper_links):
+            for node, neighbors in links.items():
+                upper_nodes.append(node)
+                upper_levels.append(l + 1)
+                upper_counts.append(len(neighbors))
+                upper_neighbors.extend(neighbors)
+        np.savez(path,
+                 params=np.array([self.dim, self.M, self.ef_construction, self.ef_search, self.seed,
+                                  self.count, self.entry_point, self.max_level]),
+                 vectors=self.vectors[:self.count],
+                 levels=self.levels[:self.count],
+                 links0=self.links0[:self.count],
+                 counts0=self.counts0[:self.count],
+                 upper_nodes=np.array(upper_nodes, dtype=np.int32),
+                 upper_levels=np.array(upper_levels, dtype=np.int32),
+                 upper_counts=np.array(upper_counts, dtype=np.int32),
+                 upper_neighbors=np.array(upper_neighbors, dtype=np.int32))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        dim, M, ef_construction, ef_search, seed, count, entry_point, max_level = \
+            [int(v) for v in data['params']]
+        index = cls(dim, M, ef_construction, ef_search, seed)
+        # Continue the level sequence instead of replaying the first count draws
+        index.rng = np.random.RandomState(seed + count)
+        index._reserve(count)
+        index.count = count
+        index.entry_point = entry_point
+        index.max_level = max_level
+        index.vectors[:count] = data['vectors']
+        index.levels[:count] = data['levels']
+        index.links0[:count] = data['links0']
+        index.counts0[:count] = data['counts0']
+        index.upper_links = [{} for _ in range(max(max_level, 0))]
+        start = 0
+        for node, level, n in zip(data['upper_nodes'].tolist(), data['upper_levels'].tolist(),
+                                  data['upper_counts'].tolist()):
+            index.upper_links[level - 1][node] = data['upper_neighbors'][start:start + n].tolist()
+            start += n
+        return index
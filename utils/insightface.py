@@ -5,14 +5,23 @@ import mxnet as mx
 
 from . import face_preprocess
 
-from sklearn import preprocessing as preprocessing
+def l2_normalize(vectors):
+    """
+    Rows scaled to unit L2 norm in place, all-zero rows are left as they are
+    (what sklearn.preprocessing.normalize does, without importing sklearn)
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    vectors /= norms
+    return vectors
 
 class InsightFace:
 
-    def __init__(self, prefix, epoch, ctx_id=0, image_size=(112,112)):
+    def __init__(self, prefix, epoch, ctx_id=0, image_size=(112,112), max_batch_size=32):
 
         self.ctx_id = ctx_id
         self.image_size = image_size
+        self.max_batch_size = max_batch_size
 
         if self.ctx_id >= 0:
             self.ctx = mx.gpu(self.ctx_id)
@@ -22,11 +31,15 @@ class InsightFace:
         sym, arg_params, aux_params = mx.model.load_checkpoint(prefix, epoch)
         all_layers = sym.get_internals()
         sym = all_layers['fc1_output']
+        self.sym = sym
 
         self.model = mx.mod.Module(symbol=sym, context=self.ctx, label_names=None)
         self.model.bind(data_shapes=[('data', (1, 3, self.image_size[0], self.image_size[1]))])
         self.model.set_params(arg_params, aux_params)
 
+        # Modules bound for larger batches, sharing their parameters with self.model
+        self._batch_models = {1: self.model}
+
     @staticmethod
     def prepare_insight_input(face, landmark, face_img):
 
@@ -38,15 +51,67 @@ class InsightFace:
 
         return aligned
 
+    @staticmethod
+    def prepare_insight_input_batch(landmarks, face_img):
+        """
+        prepare_insight_input for all the faces of an image at once
+        :param landmarks: (n, 5, 2) landmarks
+        :return: (n, 3, 112, 112) aligned RGB faces
+        """
+        nimgs = face_preprocess.align_batch(face_img, landmarks, image_size=(112, 112))
+        return nimgs[:, :, :, ::-1].transpose((0, 3, 1, 2))
+
     def face_vertorizing(self, aligned):
         input_blob = np.expand_dims(aligned, axis=0)
         data = mx.nd.array(input_blob)
         db = mx.io.DataBatch(data=(data,))
         self.model.forward(db, is_train=False)
         vector = self.model.get_outputs()[0].asnumpy()
-        vector = preprocessing.normalize(vector).flatten()
+        vector = l2_normalize(vector).flatten()
         return vector
 
+    def _batch_bucket(self, n):
+        # Batches are padded up to the next power of two so only a few modules get bound
+        batch_size = 1
+        while batch_size < n:
+            batch_size *= 2
+        return min(batch_size, self.max_batch_size)
+
+    def _get_batch_model(self, batch_size):
+        model = self._batch_models.get(batch_size)
+        if model is None:
+            model = mx.mod.Module(symbol=self.sym, context=self.ctx, label_names=None)
+            model.bind(data_shapes=[('data', (batch_size, 3, self.image_size[0], self.image_size[1]))],
+                       for_training=False,
+                       shared_module=self.model)
+            self._batch_models[batch_size] = model
+        return model
+
+    def face_vertorizing_batch(self, aligned_list):
+        """
+        Embed many aligned faces with one forward per max_batch_size faces
+        :param aligned_list: list of (3, 112, 112) outputs of prepare_insight_input
+        :return: (N, 512) L2-normalized embeddings
+        """
+        if len(aligned_list) == 0:
+            return np.zeros((0, 512), dtype=np.float32)
+
+        vectors = []
+        for start in range(0, len(aligned_list), self.max_batch_size):
+            chunk = aligned_list[start:start + self.max_batch_size]
+            batch_size = self._batch_bucket(len(chunk))
+
+            input_blob = np.zeros((batch_size, 3, self.image_size[0], self.image_size[1]), dtype=np.float32)
+            input_blob[:len(chunk)] = chunk
+            data = mx.nd.array(input_blob)
+            db = mx.io.DataBatch(data=(data,))
+
+            model = self._get_batch_model(batch_size)
+            model.forward(db, is_train=False)
+            vectors.append(model.get_outputs()[0].asnumpy()[:len(chunk)])
+
+        return l2_normalize(np.vstack(vectors))
+
     @staticmethod
     def vector_diff(v1, v2):
         return np.sum(np.square(v1 - v2))
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+Inverted-file (IVF) index with optional product quantization, in pure NumPy.
+
+A k-means coarse quantizer splits the gallery into nlist cells; a query only
+scans the rows of its nprobe closest cells. Without PQ the scanned rows are
+compared exactly (IVF-Flat). With PQ the residuals x - centroid are split into
+pq_m sub-vectors, each encoded as one byte, and distances are read from
+per-query lookup tables (asymmetric distance computation).
+
+The index follows the ExactIndex query API, so it can be dropped into a
+Gallery built over the same rows:
+    gallery.index = IVFIndex(nlist=1024, nprobe=16).build(gallery.matrix)
+"""
+import numpy as np
+
+
+def _sq_dists(x, centroids, centroid_norms):
+    # |x - c|^2 up to the constant |x|^2, which does not change the argmin
+    d = x.dot(centroids.T)
+    d *= -2.0
+    d += centroid_norms
+    return d
+
+
+def assign(x, centroids, chunk=65536):
+    """
+    Index of the nearest centroid for every row of x
+    """
+    centroid_norms = np.sum(np.square(centroids), axis=1)
+    labels = np.empty(x.shape[0], dtype=np.int64)
+    for start in range(0, x.shape[0], chunk):
+        block = np.asarray(x[start:start + chunk], dtype=np.float32)
+        labels[start:start + chunk] = np.argmin(_sq_dists(block, centroids, centroid_norms), axis=1)
+    return labels
+
+
+def kmeans(x, k, niter=20, seed=0, max_points_per_centroid=256):
+    """
+    Lloyd's k-means on a random subsample of at most k * max_points_per_centroid rows
+    :return: (k, dim) float32 centroids
+    """
+    rng = np.random.RandomState(seed)
+    n = x.shape[0]
+    if n < k:
+        raise ValueError('k-means with {} centroids needs at least {} training vectors, got {}'.format(k, k, n))
+    if n > k * max_points_per_centroid:
+        sample = np.sort(rng.choice(n, k * max_points_per_centroid, replace=False))
+        x = x[sample]
+    x = np.asarray(x, dtype=np.float32)
+
+    centroids = x[rng.choice(x.shape[0], k, replace=False)].copy()
+    for _ in range(niter):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength=k).astype(np.float32)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        # Re-seed empty cells with random training points
+        if np.any(empty):
+            centroids[empty] = x[rng.choice(x.shape[0], int(np.sum(empty)), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+
+    def __init__(self, nlist=1024, nprobe=16, pq_m=0, pq_bits=8, niter=20, seed=0):
+        """
+        :param nlist: number of coarse k-means cells
+        :param nprobe: number of cells scanned per query, tunable after build
+        :param pq_m: number of PQ sub-vectors, 0 keeps raw vectors (IVF-Flat)
+        :param pq_bits: bits per PQ code, at most 8
+        """
+        assert 0 < pq_bits <= 8
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.pq_ksub = 2 ** pq_bits
+        self.niter = niter
+        self.seed = seed
+
+        self.centroids = None
+        self.pq_codebooks = None
+        self.pq_codeword_norms = None
+        # Cell c holds list_rows[list_offsets[c]:list_offsets[c + 1]]
+        self.list_offsets = None
+        self.list_rows = None
+        self.list_data = None
+
+    @property
+    def use_pq(self):
+        return self.pq_m > 0
+
+    def train(self, matrix):
+        """
+        Galleries with fewer rows than nlist (or than 2 ** pq_bits codewords)
+        get one cell (codeword) per row at most
+        """
+        if matrix.shape[0] == 0:
+            raise ValueError('Cannot train an IVF index on an empty matrix')
+        self.nlist = min(self.nlist, matrix.shape[0])
+        self.centroids = kmeans(matrix, self.nlist, self.niter, self.seed)
+        if self.use_pq:
+            dim = matrix.shape[1]
+            assert dim % self.pq_m == 0, 'pq_m must divide the embedding dimension'
+            sample = matrix
+            max_train = self.pq_ksub * 256
+            if matrix.shape[0] > max_train:
+                rng = np.random.RandomState(self.seed + 1)
+                sample = matrix[np.sort(rng.choice(matrix.shape[0], max_train, replace=False))]
+            sample = np.asarray(sample, dtype=np.float32)
+            self.pq_ksub = min(self.pq_ksub, sample.shape[0])
+            residuals = sample - self.centroids[assign(sample, self.centroids)]
+            dsub = dim // self.pq_m
+            self.pq_codebooks = np.stack([
+                kmeans(residuals[:, j * dsub:(j + 1) * dsub], self.pq_ksub, self.niter, self.seed + j)
+                for j in range(self.pq_m)])
+            self.pq_codeword_norms = np.sum(np.square(self.pq_codebooks), axis=2)
+        return self
+
+    def encode(self, x, labels):
+        """
+        PQ codes (n, pq_m) of the residuals of x to their assigned centroids
+        """
+        residuals = np.asarray(x, dtype=np.float32) - self.centroids[labels]
+        dsub = residuals.shape[1] // self.pq_m
+        codes = np.empty((x.shape[0], self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codes[:, j] = assign(residuals[:, j * dsub:(j + 1) * dsub], self.pq_codebooks[j])
+        return codes
+
+    def add(self, matrix):
+        """
+        Index every row of matrix, replacing previously added rows
+        """
+        labels = assign(matrix, self.centroids)
+        order = np.argsort(labels, kind='stable')
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=self.nlist), out=self.list_offsets[1:])
+        self.list_rows = order
+        # Rows are stored cell by cell so a probe reads one contiguous block
+        if self.use_pq:
+            self.list_data = self.encode(matrix[order], labels[order])
+        else:
+            self.list_data = np.ascontiguousarray(matrix[order], dtype=np.float32)
+        return self
+
+    def build(self, matrix):
+        return self.train(matrix).add(matrix)
+
+    def _probe(self, vector):
+        centroid_dist = _sq_dists(vector[np.newaxis, :], self.centroids,
+                                  np.sum(np.square(self.centroids), axis=1))[0]
+        nprobe = min(self.nprobe, self.nlist)
+        return np.argpartition(centroid_dist, nprobe - 1)[:nprobe]
+
+    def _scan(self, vector):
+        """
+        Candidate rows and their (approximate) squared distances
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        cells = self._probe(vector)
+        rows = []
+        dists = []
+        for c in cells:
+            start, end = self.list_offsets[c], self.list_offsets[c + 1]
+            if start == end:
+                continue
+            rows.append(self.list_rows[start:end])
+            if self.use_pq:
+                # table[j, k] = |residual_j - codeword_jk|^2
+                residual = (vector - self.centroids[c]).reshape((self.pq_m, -1))
+                table = np.einsum('md,mkd->mk', residual, self.pq_codebooks)
+                table *= -2.0
+                table += self.pq_codeword_norms
+                table += np.sum(np.square(residual), axis=1)[:, np.newaxis]
+                codes = self.list_data[start:end]
+                dists.append(np.sum(table[np.arange(self.pq_m), codes], axis=1))
+            else:
+                dists.append(2.0 - 2.0 * self.list_data[start:end].dot(vector))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(rows), np.concatenate(dists).astype(np.float32, copy=False)
+
+    def search(self, vector, top_k=10):
+        rows, dist = self._scan(vector)
+        if top_k < dist.shape[0]:
+            keep = np.argpartition(dist, top_k - 1)[:top_k]
+            rows, dist = rows[keep], dist[keep]
+        order = np.argsort(dist, kind='stable')
+        return rows[order], dist[order]
+
+    def search_threshold(self, vector, dist_thres=1.0):
+        rows, dist = self._scan(vector)
+        keep = dist < dist_thres
+        rows, dist = rows[keep], dist[keep]
+        order = np.argsort(rows)
+        return rows[order], dist[order]
+
+    def save(self, path):
+        arrays = {'params': np.array([self.nlist, self.nprobe, self.pq_m, self.pq_ksub, self.niter, self.seed]),
+                  'centroids': self.centroids,
+                  'list_offsets': self.list_offsets,
+                  'list_rows': self.list_rows,
+                  'list_data': self.list_data}
+        if self.use_pq:
+            arrays['pq_codebooks'] = self.pq_codebooks
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        nlist, nprobe, pq_m, pq_ksub, niter, seed = [int(v) for v in data['params']]
+        index = cls(nlist, nprobe, pq_m, 8, niter, seed)
+        # Codebooks of small galleries hold fewer than 2 ** pq_bits codewords
+        index.pq_ksub = pq_ksub
+        index.centroids = data['centroids']
+        index.list_offsets = data['list_offsets']
+        index.list_rows = data['list_rows']
+        index.list_data = data['list_data']
+        if index.use_pq:
+            index.pq_codebooks = data['pq_codebooks']
+            index.pq_codeword_norms = np.sum(np.square(index.pq_codebooks), axis=2)
+        return index
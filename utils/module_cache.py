@@ -0,0 +1,149 @@
+"""
+LRU cache of MXNet modules bound for a small set of input shapes.
+
+Forwarding a Module with a shape it was not bound for makes MXNet reshape its
+executors implicitly on every call, which is slow and leaks memory when the
+shapes keep changing. Instead, inputs are padded up to a canonical bucket
+shape and every bucket keeps its own bound executor. Like
+rcnn/core/module.MutableModule, new executors are bound with the base module
+as shared_module, so all of them use the base module's parameters.
+
+Padding is an approximation: the outputs of the padded region are cropped
+afterwards, but near the bottom and right edges of the image the receptive
+fields of the kept outputs reach into the zeros, so scores and boxes there
+can move slightly and borderline faces can appear or disappear: the network
+sees a black border instead of the zero padding of each layer of the
+unpadded forward. A multiple of 1 never pads and gives the exact unpadded
+forward, at the cost of one bound executor per distinct input size.
+
+The input tensors are cached the same way: InputBuffers keeps one
+preallocated float32 tensor per bucket shape and normalizes images straight
+into it.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+
+def bucket_shape(data_shape, multiple=32):
+    """
+    (N, C, H, W) with H and W rounded up to a multiple of `multiple`
+    """
+    n, c, h, w = data_shape
+    return (n, c, -(-h // multiple) * multiple, -(-w // multiple) * multiple)
+
+
+class BucketedModule:
+
+    def __init__(self, sym, ctx, base_module, max_buckets=8):
+        """
+        :param base_module: bound module whose parameters every bucket shares,
+                            it is never evicted
+        :param max_buckets: number of bound executors kept besides the base module
+        """
+        self.sym = sym
+        self.ctx = ctx
+        self.base_module = base_module
+        self.base_shape = tuple(base_module.data_shapes[0][1])
+        self.max_buckets = max_buckets
+        self._modules = OrderedDict()
+        self.hits = 0
+        self.binds = 0
+        self.evictions = 0
+
+    def get(self, data_shape):
+        data_shape = tuple(data_shape)
+        if data_shape == self.base_shape:
+            self.hits += 1
+            return self.base_module
+        module = self._modules.get(data_shape)
+        if module is not None:
+            self.hits += 1
+            self._modules.move_to_end(data_shape)
+            return module
+
+        import mxnet as mx
+        module = mx.mod.Module(symbol=self.sym, context=self.ctx, label_names=None)
+        module.bind(data_shapes=[('data', data_shape)],
+                    for_training=False,
+                    shared_module=self.base_module)
+        self.binds += 1
+        self._modules[data_shape] = module
+        if len(self._modules) > self.max_buckets:
+            self._modules.popitem(last=False)
+            self.evictions += 1
+        return module
+
+    def stats(self):
+        lookups = self.hits + self.binds
+        return {'lookups': lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+                'binds': self.binds,
+                'evictions': self.evictions,
+                'buckets': [self.base_shape] + list(self._modules.keys())}
+
+
+class InputBuffers:
+    """
+    Reusable (N, 3, H, W) float32 network inputs, one per bucket shape.
+
+    BGR to RGB, HWC to CHW and the pixel normalization are done in a single
+    pass from the image into the buffer; with the identity normalization
+    (scale 1, means 0, stds 1) this is a plain casting copy. The buffers are
+    overwritten by the next call with the same shape, so their contents must
+    be consumed (e.g. copied by nd.array) before that.
+    """
+
+    def __init__(self, pixel_means, pixel_stds, pixel_scale, multiple=32, max_buffers=8):
+        self.pixel_means = np.asarray(pixel_means, dtype=np.float32)[::-1].reshape((3, 1, 1))
+        self.pixel_stds = np.asarray(pixel_stds, dtype=np.float32)[::-1].reshape((3, 1, 1))
+        self.pixel_scale = float(pixel_scale)
+        self.identity = self.pixel_scale == 1.0 and not self.pixel_means.any() and (self.pixel_stds == 1.0).all()
+        self.multiple = multiple
+        self.max_buffers = max_buffers
+        self._buffers = OrderedDict()
+
+    def _get(self, shape):
+        buf = self._buffers.get(shape)
+        if buf is None:
+            buf = np.zeros(shape, dtype=np.float32)
+            self._buffers[shape] = buf
+            if len(self._buffers) > self.max_buffers:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(shape)
+        return buf
+
+    def normalize(self, img, out):
+        """
+        :param img: (H, W, 3) BGR image of any dtype
+        :param out: (3, H, W) float32 destination
+        """
+        src = img[:, :, ::-1].transpose((2, 0, 1))
+        if self.identity:
+            np.copyto(out, src, casting='unsafe')
+            return out
+        # Same float32 operations, in the same order, as (im / scale - mean) / std
+        np.divide(src, self.pixel_scale, out=out, dtype=np.float32)
+        np.subtract(out, self.pixel_means, out=out)
+        np.divide(out, self.pixel_stds, out=out)
+        return out
+
+    def fill(self, images, pad=True):
+        """
+        Normalize images of a common shape into the buffer of their shape
+        :param pad: zero-pad H and W up to the bucket multiple
+        :return: the (N, 3, H', W') buffer
+        """
+        h, w = images[0].shape[:2]
+        shape = (len(images), 3, h, w)
+        if pad:
+            shape = bucket_shape(shape, self.multiple)
+        buf = self._get(shape)
+        # Clear what an earlier, larger image of the same bucket left in the padding
+        buf[:, :, h:, :] = 0
+        buf[:, :, :h, w:] = 0
+        for b, img in enumerate(images):
+            self.normalize(img, buf[b, :, :h, :w])
+        return buf
@@ -1,5 +1,6 @@
 from __future__ import print_function
 import datetime
+from collections import OrderedDict
 import numpy as np
 import mxnet as mx
 from mxnet import ndarray as nd
@@ -7,6 +8,7 @@ import cv2
 from rcnn.processing.bbox_transform import clip_boxes
 from rcnn.processing.generate_anchor import generate_anchors_fpn, anchors_plane
 from rcnn.processing.nms import gpu_nms_wrapper, cpu_nms_wrapper
+from .module_cache import BucketedModule, InputBuffers, bucket_shape
 
 class RetinaFace:
     def __init__(self,
@@ -15,7 +17,11 @@ class RetinaFace:
                  ctx_id=0,
                  nms=0.4,
                  decay4=0.5,
-                 vote=False):
+                 vote=False,
+                 max_batch_size=8,
+                 bucket_multiple=32,
+                 max_buckets=8,
+                 max_anchor_grids=32):
         self.ctx_id = ctx_id
         self.decay4 = decay4
         self.nms_threshold = nms
@@ -61,6 +67,10 @@ class RetinaFace:
             zip(self.fpn_keys,
                 [anchors.shape[0] for anchors in self._anchors_fpn.values()]))
 
+        # (stride, feat_h, feat_w) -> (feat_h * feat_w * A, 4) anchors, least recently used first
+        self._anchor_cache = OrderedDict()
+        self.max_anchor_grids = max_anchor_grids
+
         sym, arg_params, aux_params = mx.model.load_checkpoint(prefix, epoch)
         if self.ctx_id >= 0:
             self.ctx = mx.gpu(self.ctx_id)
@@ -93,20 +103,23 @@ class RetinaFace:
                         for_training=False)
         self.model.set_params(arg_params, aux_params)
 
+        # Inputs are zero-padded up to a multiple of bucket_multiple, and every
+        # padded (batch, 3, H, W) shape gets its own executor sharing self.model's parameters.
+        # Detections near the bottom and right edges can differ slightly from the
+        # unpadded forward (see utils/module_cache.py); bucket_multiple=1 is exact
+        self.max_batch_size = max_batch_size
+        self.bucket_multiple = bucket_multiple
+        self.module_cache = BucketedModule(sym, self.ctx, self.model, max_buckets)
+        self.input_buffers = InputBuffers(self.pixel_means, self.pixel_stds, self.pixel_scale,
+                                          bucket_multiple, max_buckets)
+
     def get_input(self, img):
-        im = img.astype(np.float32)
-        im_tensor = np.zeros((1, 3, im.shape[0], im.shape[1]))
-        for i in range(3):
-            im_tensor[0, i, :, :] = (im[:, :, 2 - i] / self.pixel_scale - self.pixel_means[2 - i]) / self.pixel_stds[2 - i]
+        im_tensor = self.input_buffers.fill([img], pad=False)
         data = nd.array(im_tensor)
         return data
 
     def detect(self, img, threshold=0.5, scales=1.0):
 
-        proposals_list = []
-        scores_list = []
-        landmarks_list = []
-        strides_list = []
         timea = datetime.datetime.now()
 
         if scales != 1.0:
@@ -117,22 +130,208 @@ class RetinaFace:
                             fy=scales,
                             interpolation=cv2.INTER_LINEAR)
         else:
-            im = img.copy()
-
-        im = im.astype(np.float32)
+            im = img
 
         im_info = [im.shape[0], im.shape[1]]
-        im_tensor = np.zeros((1, 3, im.shape[0], im.shape[1]))
+        im_tensor = self.input_buffers.fill([im])
 
-        for i in range(3):
-            im_tensor[0, i, :, :] = (im[:, :, 2 - i] / self.pixel_scale - self.pixel_means[2 - i]) / self.pixel_stds[2 - i]
+        net_out = self._forward(im_tensor)
+
+        return self._postprocess(net_out, im_info, threshold, scales)[0]
+
+    def detect_batch(self, images, threshold=0.5, scales=1.0):
+        """
+        Detect faces in several images of the same shape, max_batch_size images per forward
+        :return: list of (det, landmarks), one per image, as returned by detect
+        """
+        results = []
+        for start in range(0, len(images), self.max_batch_size):
+            chunk = images[start:start + self.max_batch_size]
+            for img in chunk:
+                assert img.shape == chunk[0].shape, 'detect_batch needs images of a common shape'
+            if scales != 1.0:
+                chunk = [cv2.resize(img, None, None, fx=scales, fy=scales, interpolation=cv2.INTER_LINEAR)
+                         for img in chunk]
+
+            im_info = [chunk[0].shape[0], chunk[0].shape[1]]
+            im_tensor = self.input_buffers.fill(chunk)
+
+            net_out = self._forward(im_tensor)
+            results.extend(self._postprocess(net_out, im_info, threshold, scales))
+        return results
+
+    def detect_multiscale(self, img, threshold=0.5, scales=(0.5, 1.0, 2.0), skip_face_size=None):
+        """
+        Image pyramid detection: every scale is resized from img and normalized
+        into the input buffer kept for its shape, and the proposals of all
+        scales are merged before a single NMS / box voting step.
+
+        Scales run from the coarsest up. With skip_face_size, once a scale has
+        found faces and all of them are at least skip_face_size pixels (in img),
+        the finer scales are skipped: they would mostly find the same faces again.
+        :return: det, landmarks as returned by detect
+        """
+        proposals_list, scores_list, landmarks_list, strides_list = [], [], [], []
+        for scale in sorted(scales):
+            if scale != 1.0:
+                im = cv2.resize(img, None, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+            else:
+                im = img
+            im_tensor = self.input_buffers.fill([im])
+            net_out = self._forward(im_tensor)
+            decoded = self._decode(net_out, [im.shape[0], im.shape[1]], threshold, scale)
+            for merged, per_image in zip((proposals_list, scores_list, landmarks_list, strides_list), decoded):
+                merged.extend(per_image[0])
+
+            if skip_face_size is not None:
+                proposals = np.vstack(decoded[0][0])
+                if proposals.shape[0] > 0:
+                    sides = np.maximum(proposals[:, 2] - proposals[:, 0], proposals[:, 3] - proposals[:, 1])
+                    if sides.min() >= skip_face_size:
+                        break
+
+        return self._finalize(proposals_list, scores_list, landmarks_list, strides_list)
+
+    @staticmethod
+    def _tile_starts(length, tile, overlap):
+        """
+        Start offsets of tiles covering [0, length), the last one flush with the end
+        """
+        if length <= tile:
+            return [0]
+        if not 0 <= overlap < tile:
+            raise ValueError('Tile overlap {} must be in [0, {}), the tile size'.format(overlap, tile))
+        step = tile - overlap
+        starts = list(range(0, length - tile, step))
+        starts.append(length - tile)
+        return starts
+
+    @staticmethod
+    def _tile_cores(starts, tile, length):
+        """
+        [begin, end) of the part of every tile nearest to it, splitting the
+        overlaps in the middle; the cores partition [0, length)
+        """
+        bounds = [0] + [(starts[i + 1] + starts[i] + tile) / 2.0 for i in range(len(starts) - 1)] + [length]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def detect_tiled(self, img, threshold=0.5, tile_size=640, overlap=128, scales=1.0):
+        """
+        Detect small faces in a very large image without one huge forward: the
+        image is cut into overlapping tile_size x tile_size tiles, run in batches
+        of max_batch_size, and the detections are mapped back to the image.
+        A tile only keeps the faces centered in its core (its half of every
+        overlap), so a face no larger than overlap is found once, whole, and a
+        final NMS merges what is left of duplicates along the seams. Faces
+        larger than overlap can come out cut at a seam, find those with detect
+        on a downscaled image.
+        :return: det, landmarks as returned by detect
+        """
+        # A side of the image no longer than tile_size is one tile, whatever the overlap
+        if not 0 <= overlap < tile_size:
+            raise ValueError('Tile overlap {} must be in [0, {}), the tile size'.format(overlap, tile_size))
+        if scales != 1.0:
+            im = cv2.resize(img, None, None, fx=scales, fy=scales, interpolation=cv2.INTER_LINEAR)
+        else:
+            im = img
+        height, width = im.shape[0], im.shape[1]
+        tile_h, tile_w = min(tile_size, height), min(tile_size, width)
+        ys, xs = self._tile_starts(height, tile_h, overlap), self._tile_starts(width, tile_w, overlap)
+        y_cores, x_cores = self._tile_cores(ys, tile_h, height), self._tile_cores(xs, tile_w, width)
+        tiles = [(y, x, y_core, x_core) for y, y_core in zip(ys, y_cores) for x, x_core in zip(xs, x_cores)]
+
+        det_list, landmarks_list = [], []
+        for start in range(0, len(tiles), self.max_batch_size):
+            chunk = tiles[start:start + self.max_batch_size]
+            # Tiles are views of im, normalized straight into the input buffer
+            im_tensor = self.input_buffers.fill([im[y:y + tile_h, x:x + tile_w] for y, x, _, _ in chunk])
+            net_out = self._forward(im_tensor)
+            results = self._postprocess(net_out, [tile_h, tile_w], threshold, 1.0)
+            for (y, x, y_core, x_core), (det, landmarks) in zip(chunk, results):
+                det[:, 0:4] += [x, y, x, y]
+                ctr_x = (det[:, 0] + det[:, 2]) / 2.0
+                ctr_y = (det[:, 1] + det[:, 3]) / 2.0
+                inside = (ctr_x >= x_core[0]) & (ctr_x < x_core[1]) & (ctr_y >= y_core[0]) & (ctr_y < y_core[1])
+                det_list.append(det[inside])
+                if landmarks is not None:
+                    landmarks = landmarks[inside]
+                    landmarks[:, :, 0] += x
+                    landmarks[:, :, 1] += y
+                    landmarks_list.append(landmarks)
+
+        det = np.vstack(det_list).astype(np.float32, copy=False)
+        landmarks = np.vstack(landmarks_list) if landmarks_list else None
+        if det.shape[0] > 0 and self.nms_threshold > 0.0:
+            keep = self.nms(np.ascontiguousarray(det[:, 0:5]))
+            det = det[keep]
+            if landmarks is not None:
+                landmarks = landmarks[keep]
+        det[:, 0:4] /= scales
+        if landmarks is not None:
+            landmarks[:, :, 0:2] /= scales
+        return det, landmarks
+
+    def _forward(self, im_tensor):
+        shape = bucket_shape(im_tensor.shape, self.bucket_multiple)
+        if shape != im_tensor.shape:
+            padded = np.zeros(shape, dtype=im_tensor.dtype)
+            padded[:, :, :im_tensor.shape[2], :im_tensor.shape[3]] = im_tensor
+            im_tensor = padded
 
         data = nd.array(im_tensor)
         db = mx.io.DataBatch(data=(data, ),
                              provide_data=[('data', data.shape)])
 
-        self.model.forward(db, is_train=False)
-        net_out = self.model.get_outputs()
+        model = self.module_cache.get(data.shape)
+        model.forward(db, is_train=False)
+        return model.get_outputs()
+
+    def bucket_stats(self):
+        """
+        Hit rate, bind and eviction counts of the shape-bucketed module cache
+        """
+        return self.module_cache.stats()
+
+    def _get_anchors(self, stride, height, width):
+        """
+        Anchors of a (height, width) feature map as (height * width * A, 4),
+        built once per grid and kept read-only
+        """
+        key = (stride, height, width)
+        anchors = self._anchor_cache.get(key)
+        if anchors is not None:
+            self._anchor_cache.move_to_end(key)
+            return anchors
+
+        anchors = anchors_plane(height, width, stride, self._anchors_fpn['stride%s' % stride])
+        anchors = anchors.reshape((-1, 4))
+        anchors.flags.writeable = False
+
+        self._anchor_cache[key] = anchors
+        if len(self._anchor_cache) > self.max_anchor_grids:
+            self._anchor_cache.popitem(last=False)
+        return anchors
+
+    def _postprocess(self, net_out, im_info, threshold, scales):
+        """
+        Decode the network outputs of a batch; every stride is decoded for the
+        whole batch at once, only thresholding and NMS run per image
+        :return: list of (det, landmarks), one per image of the batch
+        """
+        proposals_list, scores_list, landmarks_list, strides_list = self._decode(net_out, im_info, threshold, scales)
+        return [self._finalize(proposals_list[b], scores_list[b], landmarks_list[b], strides_list[b])
+                for b in range(len(proposals_list))]
+
+    def _decode(self, net_out, im_info, threshold, scales):
+        """
+        :return: per image of the batch, the lists of proposals, scores,
+                 landmarks and strides of every stride, to be merged by _finalize
+        """
+        batch_size = net_out[0].shape[0]
+        proposals_list = [[] for _ in range(batch_size)]
+        scores_list = [[] for _ in range(batch_size)]
+        landmarks_list = [[] for _ in range(batch_size)]
+        strides_list = [[] for _ in range(batch_size)]
 
         sym_idx = 0
 
@@ -144,29 +343,42 @@ class RetinaFace:
             if self.cascade:
                 is_cascade = True
 
+            # Drop the outputs of the bucket padding, back to the unpadded feature map extents
+            feat_shape = (-(-im_info[0] // stride), -(-im_info[1] // stride))
+
+            A = self._num_anchors['stride%s' % s]
             scores = net_out[sym_idx].asnumpy()
-            scores = scores[:, self._num_anchors['stride%s' % s]:, :, :]
+            scores = self._clip_pad(scores, feat_shape)
+            scores = scores[:, A:, :, :]
             bbox_deltas = net_out[sym_idx + 1].asnumpy()
+            bbox_deltas = self._clip_pad(bbox_deltas, feat_shape)
             height, width = bbox_deltas.shape[2], bbox_deltas.shape[3]
-
-            A = self._num_anchors['stride%s' % s]
             K = height * width
-            anchors_fpn = self._anchors_fpn['stride%s' % s]
-            anchors = anchors_plane(height, width, stride, anchors_fpn)
-
-            anchors = anchors.reshape((K * A, 4))
+            bbox_pred_len = bbox_deltas.shape[1] // A
 
             scores = scores.transpose((0, 2, 3, 1)).reshape((-1, 1))
+            if stride == 4 and self.decay4 < 1.0:
+                scores *= self.decay4
 
-            bbox_deltas = bbox_deltas.transpose((0, 2, 3, 1))
-            bbox_pred_len = bbox_deltas.shape[3] // A
-
-            bbox_deltas = bbox_deltas.reshape((-1, bbox_pred_len))
+            # Threshold first, only the surviving anchors are decoded. Row
+            # r = ((b * height + y) * width + x) * A + a of scores is anchor a
+            # at (y, x) of image b; survivors stay sorted by image.
+            keep = np.where(scores.ravel() >= threshold)[0]
+            image_idx, anchor_idx = np.divmod(keep, K * A)
+            pos, a = np.divmod(anchor_idx, A)
+            y, x = np.divmod(pos, width)
+            image_idx, y, x = image_idx[:, np.newaxis], y[:, np.newaxis], x[:, np.newaxis]
+            scores = scores[keep]
+            anchors = self._get_anchors(stride, height, width)[anchor_idx]
+
+            channels = a[:, np.newaxis] * bbox_pred_len + np.arange(bbox_pred_len)
+            bbox_deltas = bbox_deltas[image_idx, channels, y, x]
             bbox_deltas[:, 0::4] = bbox_deltas[:, 0::4] * self.bbox_stds[0]
             bbox_deltas[:, 1::4] = bbox_deltas[:, 1::4] * self.bbox_stds[1]
             bbox_deltas[:, 2::4] = bbox_deltas[:, 2::4] * self.bbox_stds[2]
             bbox_deltas[:, 3::4] = bbox_deltas[:, 3::4] * self.bbox_stds[3]
-            proposals = self.bbox_pred(anchors, bbox_deltas)
+            # bbox_deltas is a fresh gather, decode it in place
+            proposals = self.bbox_pred(anchors, bbox_deltas, out=bbox_deltas)
 
             # if is_cascade:
             #     cascade_sym_num = 0
@@ -221,35 +433,30 @@ class RetinaFace:
             #             #print('find cascade bbox at stride', stride)
 
             proposals = clip_boxes(proposals, im_info[:2])
-
-            if stride == 4 and self.decay4 < 1.0:
-                scores *= self.decay4
-
-            scores_ravel = scores.ravel()
-
-            order = np.where(scores_ravel >= threshold)[0]
-
-            proposals = proposals[order, :]
-            scores = scores[order]
-
             proposals[:, 0:4] /= scales
 
-            proposals_list.append(proposals)
-            scores_list.append(scores)
-            if self.nms_threshold < 0.0:
-                _strides = np.empty(shape=(scores.shape), dtype=np.float32)
-                _strides.fill(stride)
-                strides_list.append(_strides)
-
-            if not self.vote and self.use_landmarks:
+            landmarks = None
+            if self.use_landmarks:
                 landmark_deltas = net_out[sym_idx + 2].asnumpy()
+                landmark_deltas = self._clip_pad(landmark_deltas, feat_shape)
                 landmark_pred_len = landmark_deltas.shape[1] // A
-                landmark_deltas = landmark_deltas.transpose((0, 2, 3, 1)).reshape((-1, 5, landmark_pred_len // 5))
+                channels = a[:, np.newaxis] * landmark_pred_len + np.arange(landmark_pred_len)
+                landmark_deltas = landmark_deltas[image_idx, channels, y, x].reshape((-1, 5, landmark_pred_len // 5))
                 landmark_deltas *= self.landmark_std
-                landmarks = self.landmark_pred(anchors, landmark_deltas)
-                landmarks = landmarks[order, :]
+                landmarks = self.landmark_pred(anchors, landmark_deltas, out=landmark_deltas)
                 landmarks[:, :, 0:2] /= scales
-                landmarks_list.append(landmarks)
+
+            bounds = np.searchsorted(image_idx.ravel(), np.arange(batch_size + 1))
+            for b in range(batch_size):
+                begin, end = bounds[b], bounds[b + 1]
+                proposals_list[b].append(proposals[begin:end])
+                scores_list[b].append(scores[begin:end])
+                if self.nms_threshold < 0.0:
+                    _strides = np.empty(shape=(end - begin, 1), dtype=np.float32)
+                    _strides.fill(stride)
+                    strides_list[b].append(_strides)
+                if landmarks is not None:
+                    landmarks_list[b].append(landmarks[begin:end])
 
             if self.use_landmarks:
                 sym_idx += 3
@@ -258,6 +465,12 @@ class RetinaFace:
             # if is_cascade:
             #     sym_idx += cascade_sym_num
 
+        return proposals_list, scores_list, landmarks_list, strides_list
+
+    def _finalize(self, proposals_list, scores_list, landmarks_list, strides_list):
+        """
+        Merge the proposals of all strides of one image and apply NMS / box voting
+        """
         proposals = np.vstack(proposals_list)
         landmarks = None
         if proposals.shape[0] == 0:
@@ -277,7 +490,7 @@ class RetinaFace:
         if self.nms_threshold < 0.0:
             strides = np.vstack(strides_list)
             strides = strides[order]
-        if not self.vote and self.use_landmarks:
+        if self.use_landmarks:
             landmarks = np.vstack(landmarks_list)
             landmarks = landmarks[order].astype(np.float32, copy=False)
 
@@ -291,7 +504,7 @@ class RetinaFace:
                     landmarks = landmarks[keep]
             else:
                 det = np.hstack((pre_det, proposals[:, 4:]))
-                det = self.bbox_vote(det)
+                det, landmarks = self.bbox_vote(det, landmarks)
         elif self.nms_threshold < 0.0:
             det = np.hstack((proposals[:, 0:4], scores, strides)).astype(np.float32, copy=False)
         else:
@@ -422,103 +635,170 @@ class RetinaFace:
         return tensor
 
     @staticmethod
-    def bbox_pred(boxes, box_deltas):
+    def _box_geometry(boxes):
+        """
+        :return: (N, 1) float32 widths, heights, center x and center y of boxes
+        """
+        boxes = boxes.astype(np.float32, copy=False)
+        widths = boxes[:, 2:3] - boxes[:, 0:1] + 1.0
+        heights = boxes[:, 3:4] - boxes[:, 1:2] + 1.0
+        ctr_x = boxes[:, 0:1] + 0.5 * (widths - 1.0)
+        ctr_y = boxes[:, 1:2] + 0.5 * (heights - 1.0)
+        return widths, heights, ctr_x, ctr_y
+
+    @staticmethod
+    def bbox_pred(boxes, box_deltas, out=None):
         """
       Transform the set of class-agnostic boxes into class-specific boxes
-      by applying the predicted offsets (box_deltas)
+      by applying the predicted offsets (box_deltas), in float32
       :param boxes: !important [N 4]
       :param box_deltas: [N, 4 * num_classes]
+      :param out: preallocated float32 [N, 4 * num_classes] result, may be
+                  box_deltas itself to decode in place
       :return: [N 4 * num_classes]
       """
+        box_deltas = box_deltas.astype(np.float32, copy=False)
+        if out is None:
+            out = np.empty(box_deltas.shape, dtype=np.float32)
         if boxes.shape[0] == 0:
-            return np.zeros((0, box_deltas.shape[1]))
-
-        boxes = boxes.astype(np.float, copy=False)
-        widths = boxes[:, 2] - boxes[:, 0] + 1.0
-        heights = boxes[:, 3] - boxes[:, 1] + 1.0
-        ctr_x = boxes[:, 0] + 0.5 * (widths - 1.0)
-        ctr_y = boxes[:, 1] + 0.5 * (heights - 1.0)
-
-        dx = box_deltas[:, 0:1]
-        dy = box_deltas[:, 1:2]
-        dw = box_deltas[:, 2:3]
-        dh = box_deltas[:, 3:4]
-
-        pred_ctr_x = dx * widths[:, np.newaxis] + ctr_x[:, np.newaxis]
-        pred_ctr_y = dy * heights[:, np.newaxis] + ctr_y[:, np.newaxis]
-        pred_w = np.exp(dw) * widths[:, np.newaxis]
-        pred_h = np.exp(dh) * heights[:, np.newaxis]
-
-        pred_boxes = np.zeros(box_deltas.shape)
-        # x1
-        pred_boxes[:, 0:1] = pred_ctr_x - 0.5 * (pred_w - 1.0)
-        # y1
-        pred_boxes[:, 1:2] = pred_ctr_y - 0.5 * (pred_h - 1.0)
-        # x2
-        pred_boxes[:, 2:3] = pred_ctr_x + 0.5 * (pred_w - 1.0)
-        # y2
-        pred_boxes[:, 3:4] = pred_ctr_y + 0.5 * (pred_h - 1.0)
-
-        if box_deltas.shape[1] > 4:
-            pred_boxes[:, 4:] = box_deltas[:, 4:]
-
-        return pred_boxes
+            return out
+
+        widths, heights, ctr_x, ctr_y = RetinaFace._box_geometry(boxes)
+
+        pred_ctr_x = box_deltas[:, 0:1] * widths + ctr_x
+        pred_ctr_y = box_deltas[:, 1:2] * heights + ctr_y
+        half_w = 0.5 * (np.exp(box_deltas[:, 2:3]) * widths - 1.0)
+        half_h = 0.5 * (np.exp(box_deltas[:, 3:4]) * heights - 1.0)
+
+        # x1, y1, x2, y2
+        np.subtract(pred_ctr_x, half_w, out=out[:, 0:1])
+        np.subtract(pred_ctr_y, half_h, out=out[:, 1:2])
+        np.add(pred_ctr_x, half_w, out=out[:, 2:3])
+        np.add(pred_ctr_y, half_h, out=out[:, 3:4])
+
+        if box_deltas.shape[1] > 4 and out is not box_deltas:
+            out[:, 4:] = box_deltas[:, 4:]
+
+        return out
 
     @staticmethod
-    def landmark_pred(boxes, landmark_deltas):
+    def landmark_pred(boxes, landmark_deltas, out=None):
+        """
+        :param landmark_deltas: [N, 5, 2]
+        :param out: preallocated float32 [N, 5, 2] result, may be landmark_deltas
+                    itself to decode in place
+        :return: [N, 5, 2] landmark points
+        """
+        landmark_deltas = landmark_deltas.astype(np.float32, copy=False)
+        if out is None:
+            out = np.empty(landmark_deltas.shape, dtype=np.float32)
         if boxes.shape[0] == 0:
-            return np.zeros((0, landmark_deltas.shape[1]))
-        boxes = boxes.astype(np.float, copy=False)
-        widths = boxes[:, 2] - boxes[:, 0] + 1.0
-        heights = boxes[:, 3] - boxes[:, 1] + 1.0
-        ctr_x = boxes[:, 0] + 0.5 * (widths - 1.0)
-        ctr_y = boxes[:, 1] + 0.5 * (heights - 1.0)
-        pred = landmark_deltas.copy()
-        for i in range(5):
-            pred[:, i, 0] = landmark_deltas[:, i, 0] * widths + ctr_x
-            pred[:, i, 1] = landmark_deltas[:, i, 1] * heights + ctr_y
-        return pred
-
-    def bbox_vote(self, det):
+            return out
+
+        widths, heights, ctr_x, ctr_y = RetinaFace._box_geometry(boxes)
+
+        np.multiply(landmark_deltas[:, :, 0], widths, out=out[:, :, 0])
+        out[:, :, 0] += ctr_x
+        np.multiply(landmark_deltas[:, :, 1], heights, out=out[:, :, 1])
+        out[:, :, 1] += ctr_y
+
+        if landmark_deltas.shape[2] > 2 and out is not landmark_deltas:
+            out[:, :, 2:] = landmark_deltas[:, :, 2:]
+
+        return out
+
+    def bbox_vote(self, det, landmarks=None, max_dets=750):
+        """
+        Box voting: every box is replaced by the score-weighted average of the
+        boxes overlapping it by at least nms_threshold, scored with their max
+        score; landmarks are averaged with the same weights. As before, a box
+        overlapping nothing is dropped unless it is the last one left.
+
+        The boxes are sorted once by score and once into horizontal bands as
+        high as the highest box, by x1 within a band. A box can only overlap
+        boxes of its own and the two adjacent bands whose x1 is at most the
+        widest box away, so overlaps are computed for those blocks alone, and
+        boxes merged into a cluster are never looked at again.
+        :param det: [N, 5] boxes and scores
+        :param landmarks: [N, 5, 2] landmarks of det, or None
+        :return: voted [M, 5] boxes and [M, 5, 2] landmarks (None without landmarks), M <= max_dets
+        """
         if det.shape[0] == 0:
-            return np.zeros((0, 5))
-        dets = None
-        while det.shape[0] > 0:
-            if dets is not None and dets.shape[0] >= 750:
+            return np.zeros((0, 5)), None if landmarks is None else np.zeros((0, 5, 2))
+
+        order = np.argsort(-det[:, 4], kind='stable')
+        det = det[order]
+        if landmarks is not None:
+            landmarks = landmarks[order]
+        area = (det[:, 2] - det[:, 0] + 1) * (det[:, 3] - det[:, 1] + 1)
+        # Margins of 2 pixels: the +1 of the overlap width and float32 rounding
+        max_width = float(np.max(det[:, 2] - det[:, 0])) + 2.0
+        band_height = float(np.max(det[:, 3] - det[:, 1])) + 2.0
+        band = np.floor((det[:, 1] - det[:, 1].min()) / band_height).astype(np.int64)
+        band_order = np.lexsort((det[:, 0], band))
+        band_sorted = band[band_order]
+        x1_sorted = det[band_order, 0]
+        num_bands = int(band_sorted[-1]) + 1
+        # Band b is band_order[band_starts[b]:band_starts[b + 1]]
+        band_starts = np.searchsorted(band_sorted, np.arange(num_bands + 1))
+
+        x1, y1, x2, y2 = [np.ascontiguousarray(det[:, k]) for k in range(4)]
+        # Python scalars of the top boxes, cheaper to index than the arrays
+        boxes, areas, bands = det[:, 0:4].tolist(), area.tolist(), band.tolist()
+
+        n = det.shape[0]
+        dets = np.zeros((min(n, max_dets), det.shape[1]))
+        voted_landmarks = None if landmarks is None else np.zeros((dets.shape[0],) + landmarks.shape[1:])
+        alive = np.ones(n, dtype=bool)
+        remaining = n
+        count = 0
+        for i in range(n):
+            if remaining == 0 or count >= max_dets:
                 break
+            if not alive[i]:
+                continue
+            bx1, by1, bx2, by2 = boxes[i]
+            blocks = []
+            for b in range(max(bands[i] - 1, 0), min(bands[i] + 2, num_bands)):
+                start, end = band_starts[b], band_starts[b + 1]
+                lo, hi = x1_sorted[start:end].searchsorted([bx1 - max_width, bx2 + 2.0])
+                blocks.append(band_order[start + lo:start + hi])
+            block = np.concatenate(blocks)
+            block = np.sort(block[alive[block]])
+
             # IOU
-            area = (det[:, 2] - det[:, 0] + 1) * (det[:, 3] - det[:, 1] + 1)
-            xx1 = np.maximum(det[0, 0], det[:, 0])
-            yy1 = np.maximum(det[0, 1], det[:, 1])
-            xx2 = np.minimum(det[0, 2], det[:, 2])
-            yy2 = np.minimum(det[0, 3], det[:, 3])
+            xx1 = np.maximum(bx1, x1[block])
+            yy1 = np.maximum(by1, y1[block])
+            xx2 = np.minimum(bx2, x2[block])
+            yy2 = np.minimum(by2, y2[block])
             w = np.maximum(0.0, xx2 - xx1 + 1)
             h = np.maximum(0.0, yy2 - yy1 + 1)
             inter = w * h
-            o = inter / (area[0] + area[:] - inter)
+            o = inter / (areas[i] + area[block] - inter)
 
             # nms
-            merge_index = np.where(o >= self.nms_threshold)[0]
-            det_accu = det[merge_index, :]
-            det = np.delete(det, merge_index, 0)
+            merge_index = block[o >= self.nms_threshold]
+            alive[merge_index] = False
+            remaining -= merge_index.shape[0]
             if merge_index.shape[0] <= 1:
-                if det.shape[0] == 0:
-                    try:
-                        dets = np.row_stack((dets, det_accu))
-                    except:
-                        dets = det_accu
+                if remaining == 0:
+                    dets[count] = det[i]
+                    if landmarks is not None:
+                        voted_landmarks[count] = landmarks[i]
+                    count += 1
                 continue
-            det_accu[:,
-                     0:4] = det_accu[:, 0:4] * np.tile(det_accu[:, -1:],
-                                                       (1, 4))
-            max_score = np.max(det_accu[:, 4])
-            det_accu_sum = np.zeros((1, 5))
-            det_accu_sum[:, 0:4] = np.sum(det_accu[:, 0:4], axis=0) / np.sum(
-                det_accu[:, -1:])
-            det_accu_sum[:, 4] = max_score
-            if dets is None:
-                dets = det_accu_sum
-            else:
-                dets = np.row_stack((dets, det_accu_sum))
-        dets = dets[0:750, :]
-        return dets
+
+            det_accu = det[merge_index, :]
+            weights = det_accu[:, -1:]
+            score_sum = np.sum(weights)
+            det_accu[:, 0:4] = det_accu[:, 0:4] * weights
+            dets[count, 0:4] = np.sum(det_accu[:, 0:4], axis=0) / score_sum
+            dets[count, 4] = np.max(det_accu[:, 4])
+            if landmarks is not None:
+                voted_landmarks[count] = np.sum(landmarks[merge_index] * weights[:, :, np.newaxis],
+                                                axis=0) / score_sum
+            count += 1
+
+        if landmarks is not None:
+            voted_landmarks = voted_landmarks[:count]
+        return dets[:count], voted_landmarks
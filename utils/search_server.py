@@ -0,0 +1,306 @@
+"""
+Long-running asyncio face search service.
+
+The models and the gallery are loaded once. Every uploaded image goes
+through two shared micro-batchers: concurrent requests are coalesced into
+one RetinaFace batch, and the faces of all of them into one InsightFace
+batch followed by a single batched gallery query. A batch is run as soon as
+max_batch_size items are waiting, or max_wait seconds after its first item
+arrived, so max_wait trades a little latency for throughput under load.
+The models run on a single thread; image decoding and face alignment run
+on the default executor.
+
+HTTP/1.1 with keep-alive, using only the standard library:
+    POST /search    raw image bytes (jpg, png, ...) as the request body
+    GET  /stats     batching statistics
+    GET  /health
+"""
+import json
+import time
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .encode_pipeline import align_detections
+
+
+class MicroBatcher:
+    """
+    Coalesces items submitted by concurrent coroutines into calls of
+    func(list_of_items) -> list_of_results, run on executor
+    """
+
+    def __init__(self, func, max_batch_size=16, max_wait=0.005, executor=None):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self._queue = None
+        self._task = None
+        self.num_batches = 0
+        self.num_items = 0
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                # Whatever is already queued still joins the batch
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Requests that went away meanwhile are not computed
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self.executor, self.func, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.num_batches += 1
+            self.num_items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {'batches': self.num_batches,
+                'items': self.num_items,
+                'mean_batch_size': self.num_items / float(self.num_batches) if self.num_batches else 0.0}
+
+
+class SearchService:
+
+    def __init__(self, detector, Recognizer, gallery, threshold=0.8, dist_thres=1.0,
+                 max_batch_size=16, max_wait=0.005):
+        """
+        :param max_batch_size: images per detection batch, and requests per embedding batch
+        :param max_wait: seconds a batch waits for more requests after its first one
+        """
+        self.detector = detector
+        self.Recognizer = Recognizer
+        self.gallery = gallery
+        self.threshold = threshold
+        self.dist_thres = dist_thres
+        # MXNet modules are not thread-safe: one thread runs every model call
+        self.model_executor = ThreadPoolExecutor(max_workers=1)
+        self.detect_batcher = MicroBatcher(self._detect_batch, max_batch_size, max_wait, self.model_executor)
+        self.embed_batcher = MicroBatcher(self._embed_batch, max_batch_size, max_wait, self.model_executor)
+        self.num_requests = 0
+
+    def start(self):
+        self.detect_batcher.start()
+        self.embed_batcher.start()
+
+    async def stop(self):
+        await self.detect_batcher.stop()
+        await self.embed_batcher.stop()
+
+    def _detect_batch(self, images):
+        """
+        detect_batch needs a common shape: images are grouped by shape
+        """
+        results = [None] * len(images)
+        groups = {}
+        for i, img in enumerate(images):
+            groups.setdefault(img.shape, []).append(i)
+        for indices in groups.values():
+            detections = self.detector.detect_batch([images[i] for i in indices], self.threshold)
+            for i, detection in zip(indices, detections):
+                results[i] = detection
+        return results
+
+    def _embed_batch(self, aligned_lists):
+        """
+        Embed the faces of several requests at once and query the gallery with all of them
+        :return: per request, the gallery matches of each of its faces
+        """
+        counts = [len(aligned_list) for aligned_list in aligned_lists]
+        faces = [aligned for aligned_list in aligned_lists for aligned in aligned_list]
+        vectors = self.Recognizer.face_vertorizing_batch(faces)
+        matches = self.gallery.search_threshold_batch(vectors, self.dist_thres)
+        results = []
+        start = 0
+        for count in counts:
+            results.append(matches[start:start + count])
+            start += count
+        return results
+
+    async def search(self, data):
+        """
+        :param data: encoded image bytes
+        :return: {'faces': [{'box', 'score', 'matches'}]}, or None if data is not an image
+        """
+        loop = asyncio.get_running_loop()
+        self.num_requests += 1
+        img = await loop.run_in_executor(None, cv2.imdecode, np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        faces, landmarks = await self.detect_batcher.submit(img)
+        if faces.shape[0] == 0:
+            return {'faces': []}
+        aligned_list = await loop.run_in_executor(None, align_detections, self.Recognizer, img, faces, landmarks)
+        matches = await self.embed_batcher.submit(aligned_list)
+        return {'faces': [{'box': face[:4].tolist(),
+                           'score': float(face[4]),
+                           'matches': [{'name': name, 'distance': dist} for name, dist in face_matches]}
+                          for face, face_matches in zip(faces, matches)]}
+
+    def stats(self):
+        return {'requests': self.num_requests,
+                'detect': self.detect_batcher.stats(),
+                'embed': self.embed_batcher.stats()}
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 411: 'Length Required',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+async def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+        status, _REASONS[status], len(body), 'keep-alive' if keep_alive else 'close')
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+async def _handle_request(service, method, path, body):
+    if method == 'POST' and path == '/search':
+        start_time = time.time()
+        result = await service.search(body)
+        if result is None:
+            return 400, {'error': 'could not decode the image'}
+        result['seconds'] = time.time() - start_time
+        return 200, result
+    if method == 'GET' and path == '/stats':
+        return 200, service.stats()
+    if method == 'GET' and path == '/health':
+        return 200, {'status': 'ok'}
+    return 404, {'error': 'unknown endpoint {} {}'.format(method, path)}
+
+
+def make_handler(service, max_body=32 << 20):
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    await _write_response(writer, 400, {'error': 'malformed request line'}, False)
+                    break
+                method, path, version = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                body = b''
+                if method == 'POST':
+                    if 'content-length' not in headers:
+                        await _write_response(writer, 411, {'error': 'Content-Length is required'}, False)
+                        break
+                    try:
+                        length = int(headers['content-length'])
+                    except ValueError:
+                        length = -1
+                    if length < 0:
+                        await _write_response(writer, 400, {'error': 'invalid Content-Length'}, False)
+                        break
+                    if length > max_body:
+                        await _write_response(writer, 413, {'error': 'image larger than {} bytes'.format(max_body)}, False)
+                        break
+                    body = await reader.readexactly(length)
+
+                try:
+                    status, payload = await _handle_request(service, method, path.split('?')[0], body)
+                except Exception:
+                    # The details stay in the server log, clients only learn that the request failed
+                    print('Error handling {} {}'.format(method, path))
+                    traceback.print_exc()
+                    status, payload = 500, {'error': 'internal server error'}
+                await _write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ValueError:
+            # readline() past the limit of the stream reader (64 KiB)
+            try:
+                await _write_response(writer, 400, {'error': 'request line or header too long'}, False)
+            except ConnectionError:
+                pass
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def start_server(service, host='127.0.0.1', port=8080):
+    """
+    Start the batchers of service and serve it, returns the asyncio server
+    """
+    service.start()
+    return await asyncio.start_server(make_handler(service), host, port)
+
+
+async def _serve(service, host, port):
+    server = await start_server(service, host, port)
+    print('Serving on http://{}:{}'.format(host, port))
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+
+
+def serve(service, host='127.0.0.1', port=8080):
+    """
+    Serve service on a new event loop until interrupted
+    """
+    try:
+        asyncio.run(_serve(service, host, port))
+    except KeyboardInterrupt:
+        pass
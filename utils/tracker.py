@@ -0,0 +1,120 @@
+"""
+Greedy IoU tracker for detections that only arrive every few frames.
+
+Between two detector runs a track is moved with the constant per-frame
+velocity measured between its last two detections, which is enough to keep
+boxes on walking people at CCTV frame rates. When the detector runs again,
+every detection is matched to the predicted track box it overlaps most
+(highest IoU first); unmatched detections start new tracks and tracks that
+were not matched for max_age frames are dropped.
+"""
+import numpy as np
+
+from rcnn.processing.bbox_transform import bbox_overlaps
+
+
+class Track:
+
+    def __init__(self, track_id, box, score, landmark, frame_idx):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float64)
+        self.score = float(score)
+        self.landmark = landmark
+        self.velocity = np.zeros(4)
+        self.last_frame = frame_idx
+        self.hits = 1
+        # Filled in by the recognizer
+        self.embedding = None
+        self.quality = 0.0
+        self.matches = []
+
+    def predict(self, frame_idx):
+        """
+        Box extrapolated from the last detection to frame_idx
+        """
+        return self.box + self.velocity * (frame_idx - self.last_frame)
+
+    def update(self, box, score, landmark, frame_idx):
+        box = np.asarray(box, dtype=np.float64)
+        gap = frame_idx - self.last_frame
+        if gap > 0:
+            self.velocity = (box - self.box) / gap
+        self.box = box
+        self.score = float(score)
+        self.landmark = landmark
+        self.last_frame = frame_idx
+        self.hits += 1
+
+    def face_quality(self):
+        """
+        Detection score times the shorter side of the box, larger is better
+        """
+        w = self.box[2] - self.box[0]
+        h = self.box[3] - self.box[1]
+        return self.score * max(min(w, h), 0.0)
+
+
+class IoUTracker:
+
+    def __init__(self, iou_thres=0.3, max_age=30):
+        """
+        :param iou_thres: minimum IoU between a detection and a predicted box to match them
+        :param max_age: frames a track survives without being matched
+        """
+        self.iou_thres = iou_thres
+        self.max_age = max_age
+        self.tracks = []
+        self.next_id = 0
+
+    def update(self, faces, landmarks, frame_idx):
+        """
+        :param faces: (n, 5) detections [x1, y1, x2, y2, score] of frame frame_idx
+        :param landmarks: (n, 5, 2) landmarks of the detections, or None
+        :return: the tracks that got a detection in this frame, matched ones first
+        """
+        self.tracks = [t for t in self.tracks if frame_idx - t.last_frame <= self.max_age]
+        num_faces = 0 if faces is None else faces.shape[0]
+
+        matched_tracks, matched_faces = [], []
+        if self.tracks and num_faces:
+            predicted = np.array([t.predict(frame_idx) for t in self.tracks])
+            overlaps = bbox_overlaps(predicted, faces[:, :4].astype(np.float64))
+            # Greedy assignment, best overlap first
+            order = np.argsort(-overlaps, axis=None, kind='stable')
+            used_tracks, used_faces = set(), set()
+            for flat in order:
+                t, f = divmod(int(flat), num_faces)
+                if overlaps[t, f] < self.iou_thres:
+                    break
+                if t in used_tracks or f in used_faces:
+                    continue
+                used_tracks.add(t)
+                used_faces.add(f)
+                matched_tracks.append(t)
+                matched_faces.append(f)
+
+        updated = []
+        for t, f in zip(matched_tracks, matched_faces):
+            track = self.tracks[t]
+            track.update(faces[f, :4], faces[f, 4], None if landmarks is None else landmarks[f], frame_idx)
+            updated.append(track)
+
+        used_faces = set(matched_faces)
+        for f in range(num_faces):
+            if f in used_faces:
+                continue
+            track = Track(self.next_id, faces[f, :4], faces[f, 4],
+                          None if landmarks is None else landmarks[f], frame_idx)
+            self.next_id += 1
+            self.tracks.append(track)
+            updated.append(track)
+        return updated
+
+    def boxes(self, frame_idx):
+        """
+        :return: the live tracks and their (n, 4) boxes predicted for frame_idx
+        """
+        tracks = [t for t in self.tracks if frame_idx - t.last_frame <= self.max_age]
+        if not tracks:
+            return tracks, np.zeros((0, 4))
+        return tracks, np.array([t.predict(frame_idx) for t in tracks])
@@ -0,0 +1,200 @@
+"""
+Face search over a video stream.
+
+RetinaFace runs every detect_every frames, or earlier once enough of the
+picture changed since its last run; in between, faces are followed by the
+IoU tracker. Each track is embedded once, when it is first detected, and
+again only when a later detection of it is of clearly better quality
+(larger and more confident). The gallery is queried per embedding, so a
+face that stays in view for minutes costs a handful of recognizer calls.
+"""
+import time
+
+import cv2
+import numpy as np
+
+from .tracker import IoUTracker
+
+
+class MotionDetector:
+    """
+    Fraction of pixels that changed since the reference frame, on a small
+    blurred grayscale copy of the frames
+    """
+
+    def __init__(self, width=160, pixel_thres=25):
+        self.width = width
+        self.pixel_thres = pixel_thres
+        self.reference = None
+
+    def _small(self, frame):
+        h, w = frame.shape[:2]
+        height = max(1, int(round(h * self.width / float(w))))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (self.width, height), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def set_reference(self, frame):
+        self.reference = self._small(frame)
+
+    def changed(self, frame):
+        if self.reference is None:
+            return 1.0
+        diff = cv2.absdiff(self._small(frame), self.reference)
+        return np.count_nonzero(diff > self.pixel_thres) / float(diff.size)
+
+
+class VideoSearcher:
+
+    def __init__(self, detector, Recognizer, gallery, threshold=0.8, dist_thres=1.0,
+                 detect_every=10, motion_thres=0.02, min_detect_interval=2,
+                 iou_thres=0.3, max_age=30, quality_gain=1.25):
+        """
+        :param threshold: RetinaFace score threshold
+        :param dist_thres: squared embedding distance of a gallery match
+        :param detect_every: run the detector at least every this many frames
+        :param motion_thres: changed pixel fraction that triggers the detector early, None to disable
+        :param min_detect_interval: frames between two motion triggered detector runs
+        :param iou_thres: minimum IoU to continue a track
+        :param max_age: frames a track survives without a detection
+        :param quality_gain: re-embed a track when its face quality grew by this factor
+        """
+        self.detector = detector
+        self.Recognizer = Recognizer
+        self.gallery = gallery
+        self.threshold = threshold
+        self.dist_thres = dist_thres
+        self.detect_every = detect_every
+        self.motion_thres = motion_thres
+        self.min_detect_interval = min_detect_interval
+        self.quality_gain = quality_gain
+        self.tracker = IoUTracker(iou_thres, max_age)
+        self.motion = MotionDetector()
+
+        self.frame_idx = -1
+        self._last_detect = None
+        self.detector_calls = 0
+        self.motion_triggers = 0
+        self.recognizer_calls = 0
+        self.faces_embedded = 0
+
+    def _should_detect(self, frame):
+        if self._last_detect is None:
+            return True
+        since = self.frame_idx - self._last_detect
+        if since >= self.detect_every:
+            return True
+        if self.motion_thres is None or since < self.min_detect_interval:
+            return False
+        if self.motion.changed(frame) >= self.motion_thres:
+            self.motion_triggers += 1
+            return True
+        return False
+
+    def _embed(self, frame, tracks):
+        """
+        Embed the freshly detected tracks that were never embedded or now look better
+        """
+        pending = []
+        for track in tracks:
+            if track.landmark is None:
+                continue
+            quality = track.face_quality()
+            if track.embedding is None or quality > track.quality * self.quality_gain:
+                pending.append((track, quality))
+        if not pending:
+            return []
+
+        landmarks = np.array([track.landmark for track, _ in pending]).astype(np.int64)
+        aligned = self.Recognizer.prepare_insight_input_batch(landmarks, frame)
+        vectors = self.Recognizer.face_vertorizing_batch(aligned)
+        self.recognizer_calls += 1
+        self.faces_embedded += len(pending)
+
+        for (track, quality), vector in zip(pending, vectors):
+            track.embedding = vector
+            track.quality = quality
+            track.matches = self.gallery.search_threshold(vector, self.dist_thres)
+        return [track for track, _ in pending]
+
+    def process(self, frame):
+        """
+        Advance the stream by one frame
+        :return: live tracks, their (n, 4) boxes in this frame, and the tracks (re-)embedded in this frame
+        """
+        self.frame_idx += 1
+        embedded = []
+        if self._should_detect(frame):
+            faces, landmarks = self.detector.detect(frame, self.threshold)
+            self.detector_calls += 1
+            self._last_detect = self.frame_idx
+            if self.motion_thres is not None:
+                self.motion.set_reference(frame)
+            updated = self.tracker.update(faces, landmarks, self.frame_idx)
+            embedded = self._embed(frame, updated)
+        tracks, boxes = self.tracker.boxes(self.frame_idx)
+        return tracks, boxes, embedded
+
+    def stats(self, elapsed, video_fps=0.0):
+        """
+        :param elapsed: wall seconds spent on the frames so far
+        :param video_fps: frame rate of the source, 0 if unknown (then a frame lasts as long as it took)
+        """
+        frames = self.frame_idx + 1
+        video_seconds = frames / float(video_fps) if video_fps > 0 else elapsed
+        per_second = 1.0 / video_seconds if video_seconds > 0 else 0.0
+        return {'frames': frames,
+                'elapsed': elapsed,
+                'fps': frames / elapsed if elapsed > 0 else 0.0,
+                'video_seconds': video_seconds,
+                'tracks': self.tracker.next_id,
+                'detector_calls': self.detector_calls,
+                'motion_triggers': self.motion_triggers,
+                'recognizer_calls': self.recognizer_calls,
+                'faces_embedded': self.faces_embedded,
+                'detector_calls_per_video_second': self.detector_calls * per_second,
+                'recognizer_calls_per_video_second': self.recognizer_calls * per_second,
+                'faces_embedded_per_video_second': self.faces_embedded * per_second}
+
+
+def open_source(source):
+    """
+    :param source: video file path, stream url, or the index of a capture device
+    """
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError('Could not open video source {}'.format(source))
+    return cap
+
+
+def search_video(searcher, source, max_frames=None, on_frame=None, report_every=100):
+    """
+    Run searcher over every frame of source
+    :param on_frame: called as on_frame(frame, tracks, boxes, embedded) after each frame,
+                     returning False stops the stream
+    :return: searcher.stats() at the end of the stream
+    """
+    cap = open_source(source)
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    start_time = time.time()
+    try:
+        while max_frames is None or searcher.frame_idx + 1 < max_frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            tracks, boxes, embedded = searcher.process(frame)
+            for track in embedded:
+                names = [name for name, _ in track.matches]
+                print('Frame {}: track {} matches {} gallery faces {}'.format(
+                    searcher.frame_idx, track.track_id, len(names), names[:5]))
+            if on_frame is not None and on_frame(frame, tracks, boxes, embedded) is False:
+                break
+            if report_every and (searcher.frame_idx + 1) % report_every == 0:
+                elapsed = time.time() - start_time
+                print('On frame {}, {:.1f} frames/sec'.format(searcher.frame_idx + 1,
+                                                               (searcher.frame_idx + 1) / elapsed))
+    finally:
+        cap.release()
+    return searcher.stats(time.time() - start_time, video_fps)
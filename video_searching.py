@@ -0,0 +1,62 @@
+import argparse
+import cv2
+from utils.retinaface import RetinaFace
+from utils.insightface import InsightFace
+from utils.embedding_store import load_gallery
+from utils.video_search import VideoSearcher, search_video
+
+def draw_tracks(frame, tracks, boxes):
+    for track, box in zip(tracks, boxes):
+        box = box.astype(int)
+        color = (0, 255, 0) if track.matches else (0, 0, 255)
+        cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), color, 2)
+        label = '{} {}'.format(track.track_id, track.matches[0][0] if track.matches else '?')
+        cv2.putText(frame, label, (box[0], max(box[1] - 5, 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return frame
+
+parser = argparse.ArgumentParser(description='Search the gallery for the faces of a video file or capture device')
+parser.add_argument('source', help='video file, stream url, or capture device index')
+parser.add_argument('--gallery', default='./DATA/Images', help='embedding store prefix')
+parser.add_argument('--gpuid', type=int, default=0)
+parser.add_argument('--threshold', type=float, default=0.8)
+parser.add_argument('--dist-thres', type=float, default=1.0)
+parser.add_argument('--detect-every', type=int, default=10, help='run the detector at least every N frames')
+parser.add_argument('--motion-thres', type=float, default=0.02,
+                    help='changed pixel fraction that triggers the detector early, negative to disable')
+parser.add_argument('--max-frames', type=int, default=None)
+parser.add_argument('--show', action='store_true', help='display the tracked faces, q quits')
+args = parser.parse_args()
+
+# Memory-map the embedding store (converted from Images.json on first use)
+gallery = load_gallery(args.gallery, json_path=args.gallery + '.json')
+
+# Load the face detection model and face recognition model
+print('Loading Models...')
+detector = RetinaFace('./model/mnet.25/mnet.25', 0, ctx_id=args.gpuid)
+Recognizer = InsightFace('./model/insightface/insightface', 0, ctx_id=args.gpuid)
+print('Done!')
+
+searcher = VideoSearcher(detector, Recognizer, gallery, threshold=args.threshold, dist_thres=args.dist_thres,
+                         detect_every=args.detect_every,
+                         motion_thres=args.motion_thres if args.motion_thres >= 0 else None)
+
+on_frame = None
+if args.show:
+    cv2.namedWindow('Video search', 0)
+
+    def on_frame(frame, tracks, boxes, embedded):
+        cv2.imshow('Video search', draw_tracks(frame, tracks, boxes))
+        return cv2.waitKey(1) != ord('q')
+
+stats = search_video(searcher, args.source, args.max_frames, on_frame)
+if args.show:
+    cv2.destroyAllWindows()
+
+print('{} frames ({:.1f}s of video) in {:.1f}s: {:.1f} frames/sec'.format(
+    stats['frames'], stats['video_seconds'], stats['elapsed'], stats['fps']))
+print('{} tracks, {} detector calls ({} motion triggered), {} faces embedded in {} recognizer calls'.format(
+    stats['tracks'], stats['detector_calls'], stats['motion_triggers'],
+    stats['faces_embedded'], stats['recognizer_calls']))
+print('Per second of video: {:.2f} detector calls, {:.2f} recognizer calls, {:.2f} faces embedded'.format(
+    stats['detector_calls_per_video_second'], stats['recognizer_calls_per_video_second'],
+    stats['faces_embedded_per_video_second']))